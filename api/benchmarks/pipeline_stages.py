@@ -0,0 +1,478 @@
+"""
+Benchmark degli stage della pipeline su video sintetici.
+
+Genera con ffmpeg video di barre colorate con tagli netti in istanti noti,
+di diverse durate e risoluzioni, e misura su ognuno:
+
+- segmentation: VideoSegmenter.detect_scenes (frame/s, scene/s e tagli
+  ritrovati rispetto a quelli generati)
+- captions: CaptionGeneratorDetailed.generate_captions_batch sui thumbnail
+- clip: CLIPModelIntegration.encode_images e encode_texts
+- montage: MontageCompiler.compile_montage con le scene rilevate
+- endpoints: latenza degli endpoint Flask (ms per richiesta)
+
+Gli stage dei modelli richiedono i pesi dei modelli; se non possono essere
+caricati lo stage viene riportato con il campo "error" e il benchmark
+prosegue. I risultati sono scritti in JSON; con --baseline vengono
+confrontati con quelli di un'esecuzione precedente e il benchmark fallisce
+se uno stage è più lento del margine indicato.
+
+Uso:
+    python benchmarks/pipeline_stages.py [--lengths 10,30] [--resolutions 360,720]
+        [--repeat 3] [--output risultati.json] [--baseline precedenti.json]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from unittest.mock import patch
+
+# Cartella dell'API (contiene i moduli della pipeline)
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_FOLDER)
+
+# Altezze supportate per i video sintetici, con la larghezza in 16:9
+RESOLUTIONS = {240: 426, 360: 640, 480: 854, 720: 1280, 1080: 1920}
+
+# Frame al secondo dei video sintetici
+SYNTHETIC_FPS = 25
+
+# Durata minima e massima, in secondi, di una scena sintetica
+SCENE_SECONDS = (1.5, 4.0)
+
+# Tolleranza, in secondi, per considerare ritrovato un taglio generato
+CUT_TOLERANCE = 1.0 / SYNTHETIC_FPS
+
+# Frasi del riassunto usate per gli stage clip e montage
+SUMMARY_SENTENCES = [
+    "A wide shot of the city at dawn.",
+    "Two people talk in a crowded room.",
+    "A car drives along a coastal road.",
+    "The crowd cheers at the end of the match."
+]
+
+def generate_synthetic_video(path, seconds, height, seed=0):
+    """
+    Genera un video di barre colorate con tagli netti in istanti noti.
+    
+    Ogni scena è una schermata di barre SMPTE con tonalità diversa, negata
+    nelle scene dispari, così che ogni taglio sia un cambio netto di colore e
+    luminosità; la durata delle scene è casuale ma riproducibile dal seed.
+    
+    Args:
+        path: Percorso del video da generare
+        seconds: Durata del video, in secondi
+        height: Altezza del video (una di RESOLUTIONS)
+        seed: Seme per le durate delle scene
+    
+    Returns:
+        Lista degli istanti dei tagli, in secondi
+    """
+    rng = random.Random(seed)
+    
+    # Durate in frame interi, così che i tagli cadano esattamente su un frame
+    total_frames = int(seconds * SYNTHETIC_FPS)
+    durations = []
+    while sum(durations) < total_frames:
+        durations.append(int(rng.uniform(*SCENE_SECONDS) * SYNTHETIC_FPS))
+    durations[-1] -= sum(durations) - total_frames
+    if len(durations) > 1 and durations[-1] < SCENE_SECONDS[0] * SYNTHETIC_FPS:
+        durations[-2] += durations.pop()
+    
+    size = f"{RESOLUTIONS[height]}x{height}"
+    filters = []
+    for i, frames in enumerate(durations):
+        negate = ",negate" if i % 2 else ""
+        filters.append(
+            f"smptebars=s={size}:r={SYNTHETIC_FPS}:d={frames / SYNTHETIC_FPS},hue=h={(i * 137) % 360}{negate}[v{i}]"
+        )
+    inputs = "".join(f"[v{i}]" for i in range(len(durations)))
+    filter_complex = ";".join(filters) + f";{inputs}concat=n={len(durations)}:v=1:a=0[out]"
+    
+    subprocess.run([
+        shutil.which("ffmpeg"), "-y", "-v", "error",
+        "-filter_complex", filter_complex,
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-map", "[out]", "-map", "0:a",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", path
+    ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    cuts = []
+    position = 0
+    for frames in durations[:-1]:
+        position += frames
+        cuts.append(position / SYNTHETIC_FPS)
+    return cuts
+
+
+def measure(func, repeat):
+    """
+    Esegue func repeat volte e restituisce l'ultimo risultato e i tempi, in secondi.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return result, times
+
+
+def timing(times):
+    # Riepilogo dei tempi di più esecuzioni
+    return {"runs": len(times), "seconds": statistics.median(times), "best_seconds": min(times)}
+
+
+def bench_segmentation(video, work_folder, repeat):
+    """
+    Misura VideoSegmenter.detect_scenes e confronta i tagli con quelli generati.
+    """
+    from video_segmenter import VideoSegmenter
+    
+    segmenter = VideoSegmenter(work_folder)
+    scenes, times = measure(lambda: segmenter.detect_scenes(video["path"], video["name"]), repeat)
+    
+    detected = [scene["start_time"] for scene in scenes[1:]]
+    found = sum(1 for cut in video["cuts"] if any(abs(cut - t) <= CUT_TOLERANCE for t in detected))
+    
+    result = timing(times)
+    result.update({
+        "frames": video["frames"],
+        "frames_per_second": video["frames"] / result["seconds"],
+        "scenes": len(scenes),
+        "scenes_per_second": len(scenes) / result["seconds"],
+        "cuts_expected": len(video["cuts"]),
+        "cuts_found": found,
+        "cuts_spurious": len(detected) - found
+    })
+    return result, scenes
+
+
+def bench_captions(scenes, repeat):
+    """
+    Misura la generazione delle didascalie dei thumbnail delle scene.
+    """
+    from ai_models_detailed import CaptionGeneratorDetailed
+    
+    generator = CaptionGeneratorDetailed()
+    started = time.perf_counter()
+    generator.load_model()
+    load_seconds = time.perf_counter() - started
+    
+    thumbnails = [scene["thumbnail"] for scene in scenes]
+    _, times = measure(lambda: generator.generate_captions_batch(thumbnails), repeat)
+    
+    result = timing(times)
+    result.update({
+        "load_seconds": load_seconds,
+        "scenes": len(thumbnails),
+        "scenes_per_second": len(thumbnails) / result["seconds"]
+    })
+    return result
+
+
+def bench_clip(scenes, repeat):
+    """
+    Misura il calcolo degli embedding CLIP dei thumbnail e delle frasi.
+    """
+    from ai_models_detailed import CLIPModelIntegration
+    
+    # Senza archivio degli embedding: ogni ripetizione ricalcola tutto
+    clip_model = CLIPModelIntegration()
+    started = time.perf_counter()
+    clip_model.load_model()
+    load_seconds = time.perf_counter() - started
+    
+    thumbnails = [scene["thumbnail"] for scene in scenes]
+    _, image_times = measure(lambda: clip_model.encode_images(thumbnails), repeat)
+    _, text_times = measure(lambda: clip_model.encode_texts(SUMMARY_SENTENCES), repeat)
+    
+    result = timing(image_times)
+    result.update({
+        "load_seconds": load_seconds,
+        "scenes": len(thumbnails),
+        "scenes_per_second": len(thumbnails) / result["seconds"],
+        "text_seconds": statistics.median(text_times),
+        "texts_per_second": len(SUMMARY_SENTENCES) / statistics.median(text_times)
+    })
+    return result
+
+
+def bench_montage(video, scenes, work_folder, repeat):
+    """
+    Misura MontageCompiler.compile_montage, con una scena per frase del riassunto.
+    """
+    from video_processing import MontageCompiler
+    
+    output_folder = os.path.join(work_folder, "output")
+    compiler = MontageCompiler(work_folder, output_folder)
+    
+    # Scene scelte a intervalli regolari, in ordine inverso per forzare i salti nel video
+    step = max(1, len(scenes) // len(SUMMARY_SENTENCES))
+    selected = list(reversed(scenes[::step][:len(SUMMARY_SENTENCES)]))
+    summary_segments = [
+        {"id": i + 1, "text": text, "matchedSceneId": scene["id"]}
+        for i, (text, scene) in enumerate(zip(SUMMARY_SENTENCES, selected))
+    ]
+    
+    output_path, times = measure(
+        lambda: compiler.compile_montage(video["path"], scenes, summary_segments, video["name"]), repeat
+    )
+    if not output_path.endswith(".mp4"):
+        raise RuntimeError("Compilazione del montaggio fallita")
+    
+    output_seconds = sum(scene["end_time"] - scene["start_time"] for scene in selected)
+    result = timing(times)
+    result.update({
+        "scenes": len(selected),
+        "scenes_per_second": len(selected) / result["seconds"],
+        "output_seconds": output_seconds,
+        "realtime_factor": output_seconds / result["seconds"]
+    })
+    return result, output_path
+
+
+def bench_endpoints(video, montage_path, work_folder, requests):
+    """
+    Misura la latenza degli endpoint Flask con il client di test, in cartelle
+    temporanee e senza worker né proxy in background.
+    """
+    os.environ["JOB_WORKERS"] = "0"
+    os.environ["PROXY_VIDEOS"] = "0"
+    import main
+    from video_index import VideoIndex
+    
+    upload_folder = os.path.join(work_folder, "uploads")
+    output_folder = os.path.join(work_folder, "endpoint_output")
+    os.makedirs(upload_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+    
+    job_id = video["name"]
+    shutil.copyfile(montage_path, os.path.join(output_folder, f"{job_id}_montage.mp4"))
+    with open(video["path"], "rb") as f:
+        video_bytes = f.read()
+    
+    results = {}
+    with patch.dict(main.app.config, {"UPLOAD_FOLDER": upload_folder}), \
+            patch.object(main, "OUTPUT_FOLDER", output_folder), \
+            patch.object(main, "video_index", VideoIndex(os.path.join(work_folder, "videos.db"), upload_folder)):
+        client = main.app.test_client()
+        etag = client.get(f"/api/stream/{job_id}").headers["ETag"]
+        
+        def get(path, headers=None):
+            # Il corpo della risposta viene letto nella misura, come farebbe il client
+            response = client.get(path, headers=headers)
+            response.get_data()
+            return response
+        
+        def upload():
+            import io
+            return client.post("/api/upload", data={
+                "video": (io.BytesIO(video_bytes), "video.mp4"),
+                "summary": " ".join(SUMMARY_SENTENCES)
+            }, content_type="multipart/form-data")
+        
+        endpoints = {
+            "health": (lambda: get("/api/health"), 200),
+            "stream_full": (lambda: get(f"/api/stream/{job_id}"), 200),
+            "stream_range_1mb": (lambda: get(f"/api/stream/{job_id}", {"Range": "bytes=0-1048575"}), 206),
+            "stream_not_modified": (lambda: get(f"/api/stream/{job_id}", {"If-None-Match": etag}), 304),
+            "upload": (upload, 200)
+        }
+        
+        for name, (request, expected_status) in endpoints.items():
+            response, times = measure(request, requests)
+            if response.status_code != expected_status:
+                raise RuntimeError(f"{name}: risposta {response.status_code}, attesa {expected_status}")
+            
+            latencies = sorted(t * 1000 for t in times)
+            results[name] = {
+                "requests": len(latencies),
+                "median_ms": statistics.median(latencies),
+                "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "bytes": len(response.data) if name != "upload" else len(video_bytes)
+            }
+    
+    return results
+
+
+def run_stage(results, stage, video_name, func):
+    """
+    Esegue uno stage e ne registra il risultato; un errore viene registrato
+    nel risultato invece di interrompere il benchmark.
+    """
+    try:
+        output = func()
+    except Exception as e:
+        results.append({"stage": stage, "video": video_name, "error": f"{type(e).__name__}: {str(e)}"})
+        print(f"{stage:<12} {video_name:<16} ERRORE: {str(e).splitlines()[0] if str(e) else type(e).__name__}", file=sys.stderr)
+        return None
+    
+    result, value = output if isinstance(output, tuple) else (output, None)
+    results.append({"stage": stage, "video": video_name, **result})
+    print(f"{stage:<12} {video_name:<16} {summarize(stage, result)}", file=sys.stderr)
+    return value
+
+
+def summarize(stage, result):
+    # Riga di riepilogo leggibile di un risultato
+    if stage == "endpoints":
+        return ", ".join(f"{name} {values['median_ms']:.1f}ms" for name, values in result["endpoints"].items())
+    
+    text = f"{result['seconds']:.3f}s"
+    if "frames_per_second" in result:
+        text += f", {result['frames_per_second']:.0f} frame/s"
+    if "scenes_per_second" in result:
+        text += f", {result['scenes_per_second']:.1f} scene/s"
+    if "cuts_expected" in result:
+        text += f", tagli {result['cuts_found']}/{result['cuts_expected']} (spuri {result['cuts_spurious']})"
+    return text
+
+
+def environment():
+    """
+    Descrizione dell'ambiente di esecuzione, per confrontare esecuzioni diverse.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=API_FOLDER, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    
+    ffmpeg = shutil.which("ffmpeg")
+    ffmpeg_version = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True).stdout.split("\n")[0] if ffmpeg else None
+    
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "ffmpeg": ffmpeg_version,
+        "timestamp": time.time()
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Confronta i risultati con quelli di un'esecuzione precedente.
+    
+    Returns:
+        Lista delle regressioni: stage più lenti della baseline oltre max_regression
+    """
+    def durations(run):
+        # (stage, video, misura) -> durata: secondi degli stage, ms mediani degli endpoint
+        values = {}
+        for result in run:
+            if "error" in result:
+                continue
+            if result["stage"] == "endpoints":
+                for name, endpoint in result["endpoints"].items():
+                    values[(result["stage"], result["video"], name)] = endpoint["median_ms"] / 1000
+            else:
+                values[(result["stage"], result["video"], "seconds")] = result["seconds"]
+        return values
+    
+    current = durations(results)
+    previous = durations(baseline["results"])
+    
+    regressions = []
+    for key in sorted(current.keys() & previous.keys()):
+        ratio = current[key] / previous[key] if previous[key] > 0 else 1.0
+        print(f"{' '.join(key):<48} {previous[key]:.4f}s -> {current[key]:.4f}s ({ratio - 1:+.0%})")
+        if ratio > 1 + max_regression:
+            regressions.append(f"{' '.join(key)} più lento del {ratio - 1:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark degli stage della pipeline su video sintetici")
+    parser.add_argument("--lengths", default="10,30", help="Durate dei video sintetici, in secondi, separate da virgole")
+    parser.add_argument("--resolutions", default="360,720", help=f"Altezze dei video, tra {sorted(RESOLUTIONS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Esecuzioni misurate per ogni stage")
+    parser.add_argument("--requests", type=int, default=50, help="Richieste misurate per ogni endpoint")
+    parser.add_argument("--stages", default="segmentation,captions,clip,montage,endpoints", help="Stage da misurare")
+    parser.add_argument("--output", help="File JSON dei risultati (default: stampati su stdout)")
+    parser.add_argument("--baseline", help="File JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Rallentamento massimo ammesso rispetto alla baseline")
+    parser.add_argument("--keep", action="store_true", help="Non eliminare i video sintetici e i file generati")
+    args = parser.parse_args()
+    
+    # I log dei moduli (uno per scena o per richiesta) coprirebbero il riepilogo
+    logging.disable(logging.INFO)
+    
+    if shutil.which("ffmpeg") is None:
+        print("FALLITO: ffmpeg non disponibile")
+        return 1
+    
+    lengths = [float(value) for value in args.lengths.split(",")]
+    resolutions = [int(value) for value in args.resolutions.split(",")]
+    stages = set(args.stages.split(","))
+    
+    work_folder = tempfile.mkdtemp(prefix="montage_bench_")
+    results = []
+    
+    try:
+        for height in resolutions:
+            for seconds in lengths:
+                name = f"bars_{height}p_{seconds:g}s"
+                path = os.path.join(work_folder, f"{name}.mp4")
+                cuts = generate_synthetic_video(path, seconds, height)
+                video = {"name": name, "path": path, "cuts": cuts, "frames": int(seconds * SYNTHETIC_FPS)}
+                video_folder = os.path.join(work_folder, name)
+                os.makedirs(video_folder, exist_ok=True)
+                
+                # Gli stage successivi usano le scene rilevate dalla segmentazione
+                scenes = run_stage(results, "segmentation", name, lambda: bench_segmentation(video, video_folder, args.repeat))
+                if not scenes:
+                    continue
+                
+                if "captions" in stages:
+                    run_stage(results, "captions", name, lambda: bench_captions(scenes, args.repeat))
+                if "clip" in stages:
+                    run_stage(results, "clip", name, lambda: bench_clip(scenes, args.repeat))
+                
+                montage_path = None
+                if "montage" in stages or "endpoints" in stages:
+                    montage_path = run_stage(
+                        results, "montage", name, lambda: bench_montage(video, scenes, video_folder, args.repeat)
+                    )
+                if "endpoints" in stages and montage_path:
+                    run_stage(results, "endpoints", name, lambda: (
+                        {"endpoints": bench_endpoints(video, montage_path, video_folder, args.requests)}, None
+                    ))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_folder, ignore_errors=True)
+    
+    report = {"environment": environment(), "results": results}
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Risultati salvati in {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += compare(results, json.load(f), args.max_regression)
+    
+    for failure in failures:
+        print(f"FALLITO: {failure}")
+    
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
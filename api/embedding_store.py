@@ -0,0 +1,247 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+import numpy as np
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chiavi cercate con una sola query nell'indice
+LOOKUP_BATCH_SIZE = 500
+
+class EmbeddingStore:
+    """
+    Archivio persistente su disco degli embedding, indicizzato per hash del
+    contenuto e nome del modello.
+    
+    Per ogni modello gli embedding sono salvati in float16 in un array
+    memory-mapped, affiancato da un indice SQLite che associa l'hash del
+    contenuto alla riga dell'array. Lo stesso thumbnail, anche se appartiene
+    a job diversi, viene quindi codificato una sola volta per modello.
+    """
+    
+    def __init__(self, store_folder, initial_capacity=1024):
+        """
+        Inizializza l'archivio degli embedding.
+        
+        Args:
+            store_folder: Cartella in cui salvare gli array e gli indici
+            initial_capacity: Numero di righe allocate alla creazione di un array
+        """
+        self.store_folder = store_folder
+        self.initial_capacity = initial_capacity
+        os.makedirs(store_folder, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._shards = {}
+    
+    @staticmethod
+    def content_hash(file_path, chunk_size=1024 * 1024):
+        """
+        Calcola l'hash SHA-256 del contenuto di un file.
+        
+        Args:
+            file_path: Percorso del file
+            chunk_size: Dimensione dei blocchi letti dal disco
+        
+        Returns:
+            Hash esadecimale del contenuto
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def get_many(self, model_name, keys):
+        """
+        Recupera gli embedding salvati per un insieme di chiavi.
+        
+        Args:
+            model_name: Nome del modello che ha prodotto gli embedding (es. "ViT-B/32")
+            keys: Lista di hash del contenuto
+        
+        Returns:
+            Dizionario chiave -> embedding (float32) per le sole chiavi presenti
+        """
+        with self._lock:
+            shard = self._get_shard(model_name)
+            rows = shard.lookup(keys)
+            return {key: shard.read(row) for key, row in rows.items()}
+    
+    def put_many(self, model_name, keys, vectors):
+        """
+        Salva gli embedding per un insieme di chiavi.
+        
+        Args:
+            model_name: Nome del modello che ha prodotto gli embedding
+            keys: Lista di hash del contenuto
+            vectors: Matrice (len(keys) x dim) di embedding
+        """
+        if len(keys) == 0:
+            return
+        
+        with self._lock:
+            self._get_shard(model_name).write(keys, np.asarray(vectors))
+    
+    def count(self, model_name):
+        """
+        Restituisce il numero di embedding salvati per un modello.
+        """
+        with self._lock:
+            return self._get_shard(model_name).count()
+    
+    def _get_shard(self, model_name):
+        if model_name not in self._shards:
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+            self._shards[model_name] = _EmbeddingShard(
+                os.path.join(self.store_folder, safe_name),
+                self.initial_capacity
+            )
+        return self._shards[model_name]
+
+
+class _EmbeddingShard:
+    """
+    Array memory-mapped e indice SQLite degli embedding di un singolo modello.
+    
+    Una scrittura aggiunge all'indice solo le righe nuove e una lettura cerca
+    solo le chiavi richieste, con un costo che non dipende dal numero di
+    embedding già salvati. Le scritture sono serializzate tra processi dalla
+    transazione SQLite; le righe vengono registrate nell'indice solo dopo la
+    scrittura dei vettori nell'array, quindi un lettore non vede mai righe
+    incomplete.
+    """
+    
+    def __init__(self, base_path, initial_capacity):
+        self.data_path = f"{base_path}.f16"
+        self.db_path = f"{base_path}_index.db"
+        self.initial_capacity = initial_capacity
+        
+        self.dim = None
+        self.capacity = 0
+        self._array = None
+        
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER NOT NULL) WITHOUT ROWID")
+        
+        self.refresh()
+    
+    def _connect(self):
+        # isolation_level=None: le transazioni vengono gestite esplicitamente;
+        # alla chiusura una transazione non confermata viene annullata
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+    
+    def refresh(self):
+        """
+        Aggiorna dimensione e capacità dell'array, che un altro processo può
+        aver esteso.
+        """
+        if self.dim is None:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            if row is None:
+                return
+            self.dim = row[0]
+        
+        try:
+            capacity = os.path.getsize(self.data_path) // (self.dim * np.dtype(np.float16).itemsize)
+        except FileNotFoundError:
+            return
+        
+        if capacity != self.capacity:
+            self.capacity = capacity
+            self._open_array()
+    
+    def lookup(self, keys, conn=None):
+        """
+        Restituisce le righe dell'array delle chiavi presenti nell'indice.
+        """
+        keys = list(dict.fromkeys(keys))
+        if conn is None:
+            with self._connect() as conn:
+                return self.lookup(keys, conn)
+        
+        rows = {}
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            rows.update(conn.execute(
+                f"SELECT key, row FROM rows WHERE key IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall())
+        
+        # Righe scritte da un altro processo oltre la capacità nota
+        if rows and max(rows.values()) >= self.capacity:
+            self.refresh()
+        return rows
+    
+    def count(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()
+        return row[0] if row else 0
+    
+    def read(self, row):
+        return np.asarray(self._array[row], dtype=np.float32)
+    
+    def write(self, keys, vectors):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            
+            dim = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            if dim is None:
+                conn.execute("INSERT INTO meta (name, value) VALUES ('dim', ?)", (int(vectors.shape[1]),))
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != dim[0]:
+                raise ValueError(f"Dimensione degli embedding non valida: {vectors.shape[1]} invece di {dim[0]}")
+            
+            existing = self.lookup(keys, conn)
+            new_items = {}
+            for key, vector in zip(keys, vectors):
+                if key not in existing and key not in new_items:
+                    new_items[key] = vector
+            if not new_items:
+                conn.execute("COMMIT")
+                return
+            
+            size = conn.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()
+            start = size[0] if size else 0
+            
+            self.refresh()
+            self._ensure_capacity(start + len(new_items))
+            self._array[start:start + len(new_items)] = np.stack(list(new_items.values())).astype(np.float16)
+            self._array.flush()
+            
+            conn.executemany(
+                "INSERT INTO rows (key, row) VALUES (?, ?)",
+                [(key, start + i) for i, key in enumerate(new_items)]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('size', ?)", (start + len(new_items),)
+            )
+            conn.execute("COMMIT")
+    
+    def _ensure_capacity(self, required):
+        if required <= self.capacity:
+            return
+        
+        new_capacity = max(self.initial_capacity, self.capacity * 2, required)
+        
+        # Estende il file; le nuove righe vengono riempite di zeri dal filesystem
+        with open(self.data_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * np.dtype(np.float16).itemsize)
+        
+        self.capacity = new_capacity
+        self._open_array()
+    
+    def _open_array(self):
+        if self.capacity == 0:
+            self._array = None
+            return
+        
+        self._array = np.memmap(self.data_path, dtype=np.float16, mode='r+', shape=(self.capacity, self.dim))
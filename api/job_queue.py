@@ -0,0 +1,608 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from contextlib import closing
+from model_server import ModelClient, run_model_server
+from metrics import registry as metrics_registry, set_role
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stage della pipeline di elaborazione, nell'ordine di esecuzione
+STAGES = ["segmentation", "captions", "matching"]
+
+# Lease dei job in esecuzione: il worker aggiorna heartbeat_at ogni
+# HEARTBEAT_INTERVAL secondi; un job senza aggiornamenti da LEASE_TIMEOUT
+# secondi, o il cui worker è terminato, viene rimesso in coda
+LEASE_TIMEOUT = 120
+HEARTBEAT_INTERVAL = 15
+
+# Esecuzioni di un job interrotte dalla terminazione del worker (es. memoria
+# esaurita) dopo le quali il job viene segnato come fallito invece di essere
+# rimesso in coda
+MAX_ATTEMPTS = 3
+
+class JobQueue:
+    """
+    Coda persistente dei job di elaborazione, basata su SQLite.
+    
+    La coda è condivisa tra il processo Flask, che accoda i job, e i processi
+    worker, che li prelevano ed eseguono aggiornando lo stato di ogni stage.
+    Ogni cambio di stato e ogni avanzamento di uno stage viene registrato
+    anche come evento, in ordine, per i client che seguono il job in tempo
+    reale (endpoint /api/jobs/<job_id>/events).
+    
+    Un job in esecuzione è in lease al worker che lo ha prelevato: se il
+    worker termina senza concluderlo (memoria esaurita, SIGKILL, riavvio) il
+    job viene rimesso in coda al prelievo o all'accodamento successivo.
+    """
+    
+    def __init__(self, db_path, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        """
+        Inizializza la coda dei job.
+        
+        Args:
+            db_path: Percorso del database SQLite
+            lease_timeout: Secondi senza heartbeat dopo i quali un job in
+                esecuzione viene rimesso in coda
+            max_attempts: Esecuzioni interrotte dopo le quali un job viene
+                segnato come fallito
+        """
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = min(HEARTBEAT_INTERVAL, lease_timeout / 4)
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stages TEXT NOT NULL,
+                    error TEXT,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    details TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id)")
+    
+    def _connect(self):
+        # isolation_level=None: le transazioni vengono gestite esplicitamente;
+        # alla chiusura una transazione non confermata viene annullata
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+    
+    def enqueue(self, job_id, payload, kind="process"):
+        """
+        Accoda un job. Se il job è già in coda o in esecuzione non viene duplicato.
+        
+        Args:
+            job_id: ID del job
+            payload: Dizionario con i parametri del job (es. video_path, summary)
+            kind: Tipo di job
+        
+        Returns:
+            Stato corrente del job
+        """
+        stages = {stage: "pending" for stage in STAGES}
+        
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._reclaim_expired(conn)
+            row = conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            
+            if row is not None and row[0] in ("queued", "running"):
+                logger.info(f"Job {job_id} già in stato {row[0]}, non viene accodato di nuovo")
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, kind, state, payload, stages, created_at, attempts) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?, 0)",
+                    (job_id, kind, json.dumps(payload), json.dumps(stages), time.time())
+                )
+                
+                # Gli eventi di un'esecuzione precedente dello stesso job non sono più validi
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                self._insert_event(conn, job_id, "job", "queued")
+                logger.info(f"Job {job_id} accodato")
+            
+            conn.execute("COMMIT")
+        
+        return self.get_status(job_id)
+    
+    def claim_next(self, worker_id, job_id=None):
+        """
+        Preleva il job in coda più vecchio e lo segna come in esecuzione,
+        dopo aver rimesso in coda i job dei worker terminati.
+        
+        Args:
+            worker_id: Identificativo del worker che preleva il job (vedi
+                worker_identity; il PID permette di riconoscere un worker terminato)
+            job_id: Se indicato, preleva solo questo job
+        
+        Returns:
+            Dizionario con job_id, kind, payload e worker, o None se la coda è vuota
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._reclaim_expired(conn)
+            if job_id is None:
+                row = conn.execute(
+                    "SELECT job_id, kind, payload FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT job_id, kind, payload FROM jobs WHERE state = 'queued' AND job_id = ?",
+                    (job_id,)
+                ).fetchone()
+            
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1 WHERE job_id = ?",
+                (worker_id, now, now, row[0])
+            )
+            self._insert_event(conn, row[0], "job", "running")
+            conn.execute("COMMIT")
+        
+        return {"job_id": row[0], "kind": row[1], "payload": json.loads(row[2]), "worker": worker_id}
+    
+    def heartbeat(self, job_id, worker_id):
+        """
+        Rinnova il lease di un job in esecuzione.
+        
+        Returns:
+            False se il job non è più in esecuzione per questo worker (es.
+            rimesso in coda perché il lease era scaduto)
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND state = 'running' AND worker = ?",
+                (time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+    
+    def reclaim_expired(self):
+        """
+        Rimette in coda i job in esecuzione il cui lease è scaduto o il cui
+        worker è terminato, o li segna come falliti dopo max_attempts
+        esecuzioni interrotte.
+        
+        Returns:
+            Numero di job rimessi in coda o segnati come falliti
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            reclaimed = self._reclaim_expired(conn)
+            conn.execute("COMMIT")
+        return reclaimed
+    
+    def _reclaim_expired(self, conn):
+        # Eseguito all'interno della transazione di chi preleva o accoda un job
+        now = time.time()
+        rows = conn.execute(
+            "SELECT job_id, worker, COALESCE(heartbeat_at, started_at), attempts FROM jobs WHERE state = 'running'"
+        ).fetchall()
+        
+        reclaimed = 0
+        for job_id, worker, heartbeat_at, attempts in rows:
+            expired = heartbeat_at is None or now - heartbeat_at > self.lease_timeout
+            if not expired and _worker_alive(worker):
+                continue
+            
+            reason = "lease scaduto" if expired else "worker terminato"
+            if attempts >= self.max_attempts:
+                error = f"Elaborazione interrotta {attempts} volte ({reason})"
+                logger.error(f"Job {job_id} del worker {worker} segnato come fallito: {error}")
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                    (error, now, job_id)
+                )
+                self._insert_event(conn, job_id, "job", "failed", {"error": error})
+            else:
+                logger.warning(f"Job {job_id} del worker {worker} rimesso in coda: {reason}")
+                
+                # Gli stage vengono rieseguiti; quelli completati usano la cache
+                stages = {stage: "pending" for stage in STAGES}
+                conn.execute(
+                    "UPDATE jobs SET state = 'queued', worker = NULL, heartbeat_at = NULL, stages = ? WHERE job_id = ?",
+                    (json.dumps(stages), job_id)
+                )
+                self._insert_event(conn, job_id, "job", "queued", {"requeued": True, "reason": reason})
+            reclaimed += 1
+        
+        return reclaimed
+    
+    def update_stage(self, job_id, stage, state, details=None):
+        """
+        Aggiorna lo stato di uno stage di un job e pubblica l'evento corrispondente.
+        
+        Args:
+            job_id: ID del job
+            stage: Nome dello stage
+            state: Nuovo stato ("pending", "running", "done", "failed")
+            details: Dizionario opzionale con i dettagli dell'evento
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT stages FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                stages = json.loads(row[0])
+                stages[stage] = state
+                conn.execute("UPDATE jobs SET stages = ? WHERE job_id = ?", (json.dumps(stages), job_id))
+                self._insert_event(conn, job_id, stage, state, details)
+            conn.execute("COMMIT")
+    
+    def publish_event(self, job_id, stage, state, details=None):
+        """
+        Pubblica un evento di un job (es. l'avanzamento di uno stage), senza
+        modificarne lo stato.
+        
+        Args:
+            job_id: ID del job
+            stage: Nome dello stage
+            state: Tipo di evento (es. "progress")
+            details: Dizionario opzionale con i dettagli dell'evento
+        """
+        with self._connect() as conn:
+            self._insert_event(conn, job_id, stage, state, details)
+    
+    def get_events(self, job_id, after_id=0, limit=500):
+        """
+        Restituisce gli eventi di un job successivi a un dato evento.
+        
+        Args:
+            job_id: ID del job
+            after_id: ID dell'ultimo evento già ricevuto (0 per tutti)
+            limit: Numero massimo di eventi restituiti
+        
+        Returns:
+            Lista di dizionari con id, job_id, stage, state, details e created_at,
+            in ordine di pubblicazione
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, stage, state, details, created_at FROM job_events "
+                "WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (job_id, after_id, limit)
+            ).fetchall()
+        
+        return [
+            {
+                "id": row[0],
+                "job_id": job_id,
+                "stage": row[1],
+                "state": row[2],
+                "details": json.loads(row[3]) if row[3] else {},
+                "created_at": row[4]
+            }
+            for row in rows
+        ]
+    
+    def get_progress(self, job_id):
+        """
+        Restituisce l'ultimo avanzamento pubblicato per ogni stage di un job.
+        
+        Returns:
+            Dizionario stage -> dettagli dell'avanzamento
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT stage, details FROM job_events WHERE id IN ("
+                "SELECT MAX(id) FROM job_events WHERE job_id = ? AND state = 'progress' GROUP BY stage)",
+                (job_id,)
+            ).fetchall()
+        
+        return {stage: json.loads(details) if details else {} for stage, details in rows}
+    
+    @staticmethod
+    def _insert_event(conn, job_id, stage, state, details=None):
+        conn.execute(
+            "INSERT INTO job_events (job_id, stage, state, details, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, stage, state, json.dumps(details) if details else None, time.time())
+        )
+    
+    def complete(self, job_id):
+        """
+        Segna un job come completato.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET state = 'done', finished_at = ? WHERE job_id = ?",
+                (time.time(), job_id)
+            )
+            self._insert_event(conn, job_id, "job", "done")
+            conn.execute("COMMIT")
+    
+    def fail(self, job_id, error):
+        """
+        Segna un job come fallito, insieme agli stage non completati.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT stages FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                stages = json.loads(row[0])
+                for stage, state in stages.items():
+                    if state == "running":
+                        stages[stage] = "failed"
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = ?, stages = ?, finished_at = ? WHERE job_id = ?",
+                    (error, json.dumps(stages), time.time(), job_id)
+                )
+                self._insert_event(conn, job_id, "job", "failed", {"error": error})
+            conn.execute("COMMIT")
+    
+    def get_status(self, job_id):
+        """
+        Restituisce lo stato di un job.
+        
+        Args:
+            job_id: ID del job
+        
+        Returns:
+            Dizionario con stato del job e di ogni stage, o None se il job non esiste
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, kind, state, stages, error, created_at, started_at, finished_at, attempts "
+                "FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "state": row[2],
+            "stages": json.loads(row[3]),
+            "error": row[4],
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7],
+            "attempts": row[8]
+        }
+
+
+def worker_identity():
+    """
+    Identificativo del processo corrente come worker della coda (host:PID).
+    """
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+def _worker_alive(worker):
+    # Solo i worker dello stesso host possono essere verificati con il PID;
+    # per gli altri vale la scadenza del lease
+    host, _, pid = (worker or "").rpartition(":")
+    if host != os.uname().nodename or not pid.isdigit():
+        return True
+    
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def run_job(queue, processor, job):
+    """
+    Esegue un job prelevato dalla coda, aggiornandone lo stato.
+    
+    Args:
+        queue: JobQueue da cui è stato prelevato il job
+        processor: ScalableVideoProcessor con cui eseguire il job
+        job: Job restituito da JobQueue.claim_next
+    
+    Returns:
+        Risultati dell'elaborazione
+    """
+    job_id = job["job_id"]
+    payload = job["payload"]
+    
+    # Il lease del job viene rinnovato per tutta l'esecuzione, anche durante
+    # gli stage che non pubblicano avanzamenti
+    stop_heartbeat = threading.Event()
+    
+    def heartbeat():
+        while not stop_heartbeat.wait(queue.heartbeat_interval):
+            if not queue.heartbeat(job_id, job["worker"]):
+                logger.warning(f"Lease del job {job_id} perso dal worker {job['worker']}")
+                return
+    
+    heartbeat_thread = threading.Thread(target=heartbeat, name=f"heartbeat-{job_id}", daemon=True)
+    heartbeat_thread.start()
+    
+    def on_progress(stage, state, details=None):
+        # L'avanzamento all'interno di uno stage non ne cambia lo stato
+        if state == "progress":
+            queue.publish_event(job_id, stage, state, details)
+        else:
+            queue.update_stage(job_id, stage, state, details)
+    
+    try:
+        results = processor.process_video(
+            payload["video_path"],
+            payload["summary"],
+            job_id,
+            progress_callback=on_progress,
+            match_mode=payload.get("match_mode")
+        )
+    except Exception as e:
+        results = {"error": str(e)}
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+    
+    if "error" in results:
+        logger.error(f"Job {job_id} fallito: {results['error']}")
+        queue.fail(job_id, results["error"])
+    else:
+        queue.complete(job_id)
+    
+    return results
+
+
+def _worker_main(db_path, upload_folder, temp_folder, output_folder, threads_per_worker, poll_interval, stop_event,
+                 model_socket=None):
+    """
+    Ciclo principale di un processo worker: preleva ed esegue i job finché
+    non viene richiesto l'arresto.
+    """
+    # Importato qui per caricare i modelli solo nei processi worker
+    from optimized_processing import ScalableVideoProcessor
+    
+    worker_id = worker_identity()
+    queue = JobQueue(db_path)
+    set_role("worker")
+    
+    # Con il server dei modelli il worker non carica i modelli in proprio
+    model_client = ModelClient(model_socket) if model_socket else None
+    processor = ScalableVideoProcessor(
+        upload_folder, temp_folder, output_folder, max_workers=threads_per_worker, model_client=model_client
+    )
+    
+    logger.info(f"Worker {worker_id} avviato")
+    
+    while not stop_event.is_set():
+        job = queue.claim_next(worker_id)
+        
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+        
+        logger.info(f"Worker {worker_id}: esecuzione del job {job['job_id']}")
+        run_job(queue, processor, job)
+        
+        # Metriche del job (durate, memoria) subito visibili in /api/metrics
+        metrics_registry.flush(force=True)
+    
+    logger.info(f"Worker {worker_id} arrestato")
+
+
+class JobWorkerPool:
+    """
+    Pool di processi worker che eseguono i job della coda con
+    ScalableVideoProcessor.process_video.
+    """
+    
+    def __init__(self, db_path, upload_folder, temp_folder, output_folder, num_workers=2, poll_interval=1.0,
+                 model_socket=None):
+        """
+        Inizializza il pool di worker.
+        
+        Args:
+            db_path: Percorso del database SQLite della coda
+            upload_folder: Cartella per i file caricati
+            temp_folder: Cartella per i file temporanei
+            output_folder: Cartella per i file di output
+            num_workers: Numero di processi worker
+            poll_interval: Intervallo di attesa, in secondi, quando la coda è vuota
+            model_socket: Socket Unix del server dei modelli condiviso (vedi
+                model_server.ModelServer), avviato insieme ai worker; se None
+                ogni worker carica i propri modelli
+        """
+        self.db_path = db_path
+        self.folders = (upload_folder, temp_folder, output_folder)
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.model_socket = model_socket
+        
+        # Divide i core disponibili tra i worker per non saturare la CPU
+        self.threads_per_worker = max(2, multiprocessing.cpu_count() // max(1, num_workers))
+        
+        # "spawn" evita di duplicare nei worker lo stato del processo Flask (thread, modelli)
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._model_server_stop = self._context.Event()
+        self._processes = []
+        self._model_server = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """
+        Avvia i processi worker, se non sono già in esecuzione.
+        """
+        with self._lock:
+            self._stop_event.clear()
+            self._processes = [process for process in self._processes if process.is_alive()]
+            
+            # Job rimasti in esecuzione da worker terminati (anche in un avvio
+            # precedente dell'API): rimessi in coda prima di avviare i nuovi worker
+            reclaimed = JobQueue(self.db_path).reclaim_expired()
+            if reclaimed:
+                logger.info(f"{reclaimed} job di worker terminati rimessi in coda")
+            
+            # Un solo processo carica i modelli; se un altro pool ha già avviato
+            # un server sullo stesso socket, questo resta in attesa come riserva
+            if self.model_socket and (self._model_server is None or not self._model_server.is_alive()):
+                self._model_server_stop.clear()
+                self._model_server = self._context.Process(
+                    target=run_model_server, args=(self.model_socket, self._model_server_stop), daemon=False
+                )
+                self._model_server.start()
+            
+            while len(self._processes) < self.num_workers:
+                process = self._context.Process(
+                    target=_worker_main,
+                    args=(self.db_path, *self.folders, self.threads_per_worker, self.poll_interval, self._stop_event,
+                          self.model_socket),
+                    # Non daemon: i worker devono poter avviare a loro volta dei processi
+                    # (es. segmentazione parallela); vengono arrestati con stop()
+                    daemon=False
+                )
+                process.start()
+                self._processes.append(process)
+            
+            logger.info(f"Pool di worker attivo con {len(self._processes)} processi")
+    
+    def stop(self, timeout=10):
+        """
+        Arresta i processi worker al termine del job in corso.
+        """
+        with self._lock:
+            self._stop_event.set()
+            for process in self._processes:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+            
+            # Il server dei modelli si arresta dopo i worker che lo usano
+            if self._model_server is not None:
+                self._model_server_stop.set()
+                self._model_server.join(timeout)
+                if self._model_server.is_alive():
+                    self._model_server.terminate()
+                self._model_server = None
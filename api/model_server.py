@@ -0,0 +1,423 @@
+import os
+import time
+import fcntl
+import queue
+import logging
+import argparse
+import threading
+import numpy as np
+from multiprocessing.connection import Listener, Client
+from progress import ProgressTracker
+from metrics import set_role
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Attesa massima, in secondi, per raccogliere altre richieste nello stesso batch
+DEFAULT_MAX_WAIT = 0.02
+
+# Numero massimo di elementi (immagini o testi) in un batch del server
+DEFAULT_MAX_BATCH_ITEMS = 256
+
+# Numero di elementi inviati dal client in ogni richiesta
+DEFAULT_CHUNK_SIZE = 32
+
+class ModelServer:
+    """
+    Server locale dei modelli AI, condiviso tra i processi worker.
+    
+    Il generatore di didascalie e CLIP vengono caricati una sola volta, nel
+    processo del server, invece che in ogni worker. I worker inviano le
+    richieste su un socket Unix (vedi ModelClient); le richieste dello stesso
+    tipo che arrivano da job diversi entro max_wait secondi vengono unite in
+    un unico batch, con una sola chiamata al modello.
+    
+    Un file di lock accanto al socket garantisce un solo server attivo: un
+    secondo server avviato sullo stesso socket resta in attesa e subentra se
+    il primo termina.
+    """
+    
+    def __init__(self, socket_path, max_wait=DEFAULT_MAX_WAIT, max_batch_items=DEFAULT_MAX_BATCH_ITEMS):
+        """
+        Inizializza il server.
+        
+        Args:
+            socket_path: Percorso del socket Unix
+            max_wait: Attesa massima, in secondi, per completare un batch
+            max_batch_items: Numero massimo di elementi per batch
+        """
+        # Importato qui: i processi che usano solo ModelClient non caricano i modelli
+        from ai_models_detailed import CaptionGeneratorDetailed, CLIPModelIntegration
+        
+        self.socket_path = socket_path
+        self.max_wait = max_wait
+        self.max_batch_items = max_batch_items
+        
+        # I modelli vengono caricati alla prima richiesta
+        self.caption_generator = CaptionGeneratorDetailed()
+        self.clip_model = CLIPModelIntegration()
+        
+        # Operazioni servite: ogni funzione elabora un batch di elementi e
+        # restituisce una tupla di sequenze allineate agli elementi
+        self._handlers = {
+            "captions": lambda items: (self.caption_generator.generate_captions_batch(items),),
+            "encode_images": lambda items: self.clip_model._encode_image_files(items, len(items) or 1),
+            "encode_texts": lambda items: (self.clip_model.encode_texts(items),)
+        }
+        
+        self._pending = queue.Queue()
+        self._deferred = []
+        self._stop = threading.Event()
+        self._listener = None
+        
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "items": 0, "errors": 0}
+    
+    def serve_forever(self):
+        """
+        Acquisisce il lock, apre il socket e serve le richieste fino a stop().
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        
+        with open(self.socket_path + ".lock", "w") as lock_file:
+            if not self._acquire_lock(lock_file):
+                return
+            
+            # Un socket rimasto da un server terminato in modo anomalo va rimosso
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            
+            self._listener = Listener(self.socket_path, family="AF_UNIX")
+            os.chmod(self.socket_path, 0o600)
+            logger.info(f"Server dei modelli in ascolto su {self.socket_path}")
+            
+            batcher = threading.Thread(target=self._batch_loop, daemon=True)
+            batcher.start()
+            
+            try:
+                while not self._stop.is_set():
+                    try:
+                        conn = self._listener.accept()
+                    except OSError:
+                        if self._stop.is_set():
+                            break
+                        raise
+                    threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+            finally:
+                self._listener.close()
+                self._listener = None
+                batcher.join(timeout=5)
+                logger.info("Server dei modelli arrestato")
+    
+    def stop(self):
+        """
+        Arresta il server.
+        """
+        self._stop.set()
+        
+        # Sblocca accept() con una connessione fittizia
+        if self._listener is not None:
+            try:
+                Client(self.socket_path, family="AF_UNIX").close()
+            except OSError:
+                pass
+    
+    def stats(self):
+        """
+        Restituisce i contatori del server e la dimensione media dei batch.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["average_batch_items"] = stats["items"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+    
+    def _acquire_lock(self, lock_file):
+        # Attende che il lock sia libero (nessun altro server attivo) o che
+        # venga richiesto l'arresto
+        waiting = False
+        while not self._stop.is_set():
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if not waiting:
+                    logger.info(f"Server dei modelli già attivo su {self.socket_path}: in attesa")
+                    waiting = True
+                self._stop.wait(1.0)
+        return False
+    
+    def _serve_connection(self, conn):
+        """
+        Serve le richieste di una connessione, una alla volta.
+        """
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    kind, items = conn.recv()
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    logger.warning(f"Richiesta non valida al server dei modelli: {str(e)}")
+                    return
+                
+                if kind == "stats":
+                    response = ("ok", self.stats())
+                elif kind not in self._handlers:
+                    response = ("error", f"Operazione non supportata: {kind}")
+                else:
+                    request = _Request(kind, list(items))
+                    self._pending.put(request)
+                    request.done.wait()
+                    response = ("error", request.error) if request.error is not None else ("ok", request.result)
+                
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    return
+    
+    def _batch_loop(self):
+        """
+        Raccoglie le richieste in attesa in batch dello stesso tipo e li
+        esegue, uno alla volta, nel thread dei modelli.
+        """
+        while not self._stop.is_set():
+            if self._deferred:
+                first = self._deferred.pop(0)
+            else:
+                try:
+                    first = self._pending.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            
+            batch = [first]
+            count = len(first.items)
+            
+            # Richieste dello stesso tipo rimandate da un batch precedente
+            for request in list(self._deferred):
+                if count >= self.max_batch_items:
+                    break
+                if request.kind == first.kind:
+                    self._deferred.remove(request)
+                    batch.append(request)
+                    count += len(request.items)
+            
+            # Richieste arrivate entro max_wait secondi
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                
+                if request.kind == first.kind:
+                    batch.append(request)
+                    count += len(request.items)
+                else:
+                    self._deferred.append(request)
+            
+            self._run_batch(first.kind, batch)
+        
+        # Le richieste rimaste ricevono un errore invece di restare in attesa
+        while self._deferred or not self._pending.empty():
+            request = self._deferred.pop(0) if self._deferred else self._pending.get_nowait()
+            request.finish(error="Server dei modelli in arresto")
+    
+    def _run_batch(self, kind, batch):
+        """
+        Esegue un batch con un'unica chiamata al modello e distribuisce i
+        risultati alle richieste.
+        """
+        items = [item for request in batch for item in request.items]
+        
+        try:
+            result = self._handlers[kind](items)
+        except Exception as e:
+            logger.error(f"Errore del server dei modelli ({kind}): {str(e)}")
+            with self._stats_lock:
+                self._stats["errors"] += len(batch)
+            for request in batch:
+                request.finish(error=str(e))
+            return
+        
+        start = 0
+        for request in batch:
+            end = start + len(request.items)
+            request.finish(tuple(part[start:end] for part in result))
+            start = end
+        
+        with self._stats_lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["items"] += len(items)
+        
+        if len(batch) > 1:
+            logger.info(f"Batch {kind}: {len(items)} elementi da {len(batch)} richieste")
+
+
+class _Request:
+    """
+    Richiesta in attesa di essere eseguita in un batch.
+    """
+    
+    def __init__(self, kind, items):
+        self.kind = kind
+        self.items = items
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+    
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class ModelClient:
+    """
+    Client del server dei modelli, usato dai worker al posto dei modelli locali.
+    
+    Ogni thread usa una propria connessione. Le liste di elementi vengono
+    inviate in richieste da chunk_size elementi, così che il server possa
+    unirle a quelle degli altri job senza che un job molto grande occupi
+    da solo un batch.
+    """
+    
+    def __init__(self, socket_path, chunk_size=DEFAULT_CHUNK_SIZE, connect_timeout=60):
+        """
+        Inizializza il client.
+        
+        Args:
+            socket_path: Percorso del socket Unix del server
+            chunk_size: Numero di elementi per richiesta
+            connect_timeout: Attesa massima, in secondi, che il server sia
+                disponibile (ad esempio mentre viene avviato)
+        """
+        self.socket_path = socket_path
+        self.chunk_size = chunk_size
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+    
+    def generate_captions(self, image_paths, progress_callback=None):
+        """
+        Genera le didascalie delle immagini (vedi
+        CaptionGeneratorDetailed.generate_captions_batch).
+        """
+        tracker = ProgressTracker(progress_callback, "captions", len(image_paths), unit="captions")
+        captions = []
+        
+        for chunk in self._chunks(image_paths):
+            captions.extend(self.call("captions", chunk)[0])
+            tracker.advance(len(chunk))
+        
+        return captions
+    
+    def encode_image_files(self, image_paths):
+        """
+        Codifica le immagini con CLIP (vedi CLIPModelIntegration._encode_image_files).
+        
+        Returns:
+            Matrice di embedding non normalizzati e lista di flag che indicano
+            quali immagini sono state lette correttamente
+        """
+        features = []
+        valid = []
+        
+        for chunk in self._chunks(image_paths):
+            chunk_features, chunk_valid = self.call("encode_images", chunk)
+            features.append(chunk_features)
+            valid.extend(chunk_valid)
+        
+        return np.concatenate(features), valid
+    
+    def encode_texts(self, texts):
+        """
+        Calcola gli embedding CLIP normalizzati dei testi.
+        """
+        return np.concatenate([self.call("encode_texts", chunk)[0] for chunk in self._chunks(texts)])
+    
+    def stats(self):
+        """
+        Restituisce i contatori del server.
+        """
+        return self.call("stats", None)
+    
+    def call(self, kind, items):
+        """
+        Invia una richiesta al server e ne attende il risultato. In caso di
+        connessione interrotta (es. server riavviato) la richiesta viene
+        ripetuta una volta su una nuova connessione.
+        """
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send((kind, items))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._close()
+                if attempt == 1:
+                    raise RuntimeError(f"Server dei modelli non raggiungibile: {str(e)}")
+        
+        if status == "error":
+            raise RuntimeError(f"Errore del server dei modelli: {result}")
+        return result
+    
+    def _chunks(self, items):
+        # Almeno una richiesta anche per una lista vuota, per la forma del risultato
+        return [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)] or [items]
+    
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = Client(self.socket_path, family="AF_UNIX")
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Server dei modelli non disponibile su {self.socket_path}")
+                time.sleep(0.2)
+        
+        self._local.conn = conn
+        return conn
+    
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+
+def run_model_server(socket_path, stop_event=None):
+    """
+    Esegue un server dei modelli fino a quando stop_event non viene impostato
+    (usato come target di un processo da JobWorkerPool).
+    """
+    set_role("model_server")
+    server = ModelServer(socket_path)
+    
+    if stop_event is not None:
+        def wait_for_stop():
+            stop_event.wait()
+            server.stop()
+        threading.Thread(target=wait_for_stop, daemon=True).start()
+    
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server locale dei modelli AI condiviso tra i worker")
+    parser.add_argument("--socket", required=True, help="Percorso del socket Unix")
+    parser.add_argument("--max-wait", type=float, default=DEFAULT_MAX_WAIT, help="Attesa massima, in secondi, per completare un batch")
+    parser.add_argument("--max-batch-items", type=int, default=DEFAULT_MAX_BATCH_ITEMS, help="Numero massimo di elementi per batch")
+    args = parser.parse_args()
+    
+    set_role("model_server")
+    ModelServer(args.socket, max_wait=args.max_wait, max_batch_items=args.max_batch_items).serve_forever()
@@ -1,31 +1,96 @@
 import os
+import re
+import queue
 import logging
+import threading
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
 import time
 import json
+import hashlib
+from tiered_cache import TieredCache
+from progress import ProgressTracker
+from pipeline import Pipeline, PipelineStage
+from metrics import timed, stage_timer
+from parallel_executor import ParallelExecutor, EXECUTOR_MODES
+from video_index import video_id_of
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Numero di scene passate insieme al generatore di didascalie mentre la
+# segmentazione è ancora in corso (vedi ScalableVideoProcessor.segment_and_caption)
+STREAM_BATCH_SIZE = 16
+
+# Numero di thumbnail codificati insieme con CLIP durante la segmentazione
+EMBEDDING_BATCH_SIZE = 32
+
+# Thread predefiniti per gli stage della pipeline di segmentazione: i modelli
+# usano già tutti i core, più chiamate in parallelo si contenderebbero CPU e memoria
+DEFAULT_STAGE_WORKERS = {"captions": 1, "embeddings": 1}
+
+# Intervallo, in secondi, con cui il caricamento dei batch verifica l'interruzione
+_POLL_INTERVAL = 0.1
+
+# Segnala la fine dei batch caricati
+_END = object()
+
+def split_summary(summary):
+    """
+    Divide il riassunto in frasi, ignorando quelle vuote.
+    
+    Returns:
+        Lista di segmenti con id (posizione della frase, da 1) e testo
+    """
+    segments = []
+    for i, sentence in enumerate(re.split(r'(?<=[.!?])\s+', summary)):
+        if sentence.strip():
+            segments.append({"id": i + 1, "text": sentence.strip()})
+    return segments
+
+
+def matching_cache_stage(segment_texts, match_mode):
+    """
+    Stage della cache del matching per le frasi di un riassunto e una
+    modalità di abbinamento (l'ID del job identifica solo il video).
+    """
+    summary_hash = hashlib.sha256("\n".join(segment_texts).encode("utf-8")).hexdigest()[:16]
+    return f"matching_{match_mode}_{summary_hash}"
+
+
 class PerformanceOptimizer:
     """
     Classe per ottimizzare le prestazioni della pipeline di elaborazione video.
     Implementa tecniche di parallelizzazione, caching e gestione efficiente della memoria.
     """
     
-    def __init__(self, temp_folder, max_workers=None):
+    def __init__(self, temp_folder, max_workers=None, cache_memory_budget=64 * 1024 * 1024,
+                 cache_disk_budget=512 * 1024 * 1024, cache_ttl=7 * 24 * 3600, executor_mode="thread",
+                 worker_initializer=None, worker_initargs=()):
         """
         Inizializza l'ottimizzatore di prestazioni.
         
         Args:
             temp_folder: Cartella per i file temporanei e di cache
             max_workers: Numero massimo di worker per l'elaborazione parallela
+            cache_memory_budget: Byte massimi dei risultati tenuti in memoria
+            cache_disk_budget: Byte massimi dei file di cache su disco
+            cache_ttl: Durata, in secondi, delle voci di cache
+            executor_mode: Modalità predefinita di process_in_parallel (thread,
+                process o inline)
+            worker_initializer: Funzione opzionale che prepara lo stato di ogni
+                worker (es. carica un modello), disponibile con worker_state()
+            worker_initargs: Argomenti di worker_initializer
         """
         self.temp_folder = temp_folder
         self.cache_folder = os.path.join(temp_folder, "cache")
-        os.makedirs(self.cache_folder, exist_ok=True)
+        self.cache = TieredCache(
+            self.cache_folder,
+            memory_budget=cache_memory_budget,
+            disk_budget=cache_disk_budget,
+            ttl=cache_ttl
+        )
         
         # Determina il numero ottimale di worker
         if max_workers is None:
@@ -34,6 +99,13 @@ class PerformanceOptimizer:
         else:
             self.max_workers = max_workers
         
+        if executor_mode not in EXECUTOR_MODES:
+            raise ValueError(f"Modalità di esecuzione non valida: {executor_mode}")
+        self.executor_mode = executor_mode
+        self.worker_initializer = worker_initializer
+        self.worker_initargs = worker_initargs
+        self._executors = {}
+        
         logger.info(f"Inizializzato ottimizzatore di prestazioni con {self.max_workers} worker")
     
     def get_cache_path(self, job_id, stage):
@@ -47,11 +119,11 @@ class PerformanceOptimizer:
         Returns:
             Percorso del file di cache
         """
-        return os.path.join(self.cache_folder, f"{job_id}_{stage}_cache.json")
+        return self.cache.path(f"{job_id}_{stage}")
     
     def cache_exists(self, job_id, stage):
         """
-        Verifica se esiste una cache per un determinato job e stage.
+        Verifica se esiste una cache valida per un determinato job e stage.
         
         Args:
             job_id: ID del job
@@ -60,8 +132,7 @@ class PerformanceOptimizer:
         Returns:
             True se la cache esiste, False altrimenti
         """
-        cache_path = self.get_cache_path(job_id, stage)
-        return os.path.exists(cache_path)
+        return self.cache.contains(f"{job_id}_{stage}")
     
     def save_to_cache(self, job_id, stage, data):
         """
@@ -75,11 +146,8 @@ class PerformanceOptimizer:
         Returns:
             Percorso del file di cache
         """
-        cache_path = self.get_cache_path(job_id, stage)
-        
         try:
-            with open(cache_path, 'w') as f:
-                json.dump(data, f)
+            cache_path = self.cache.put(f"{job_id}_{stage}", data)
             
             logger.info(f"Dati salvati nella cache per il job {job_id}, stage {stage}")
             return cache_path
@@ -89,59 +157,93 @@ class PerformanceOptimizer:
     
     def load_from_cache(self, job_id, stage):
         """
-        Carica i dati dalla cache.
+        Carica i dati dalla cache. I dati restituiti sono condivisi con la
+        cache in memoria e non vanno modificati.
         
         Args:
             job_id: ID del job
             stage: Nome dello stage
             
         Returns:
-            Dati caricati dalla cache, o None se la cache non esiste
+            Dati caricati dalla cache, o None se la cache non esiste o è scaduta
         """
-        cache_path = self.get_cache_path(job_id, stage)
-        
-        if not os.path.exists(cache_path):
-            return None
-        
         try:
-            with open(cache_path, 'r') as f:
-                data = json.load(f)
-            
-            logger.info(f"Dati caricati dalla cache per il job {job_id}, stage {stage}")
-            return data
+            data = self.cache.get(f"{job_id}_{stage}")
         except Exception as e:
             logger.error(f"Errore durante il caricamento dalla cache: {str(e)}")
             return None
+        
+        if data is not None:
+            logger.info(f"Dati caricati dalla cache per il job {job_id}, stage {stage}")
+        return data
+    
+    def invalidate_cache(self, job_id, stage):
+        """
+        Rimuove dalla cache i dati di un determinato job e stage, anche per
+        gli altri processi che condividono la cartella della cache.
+        """
+        self.cache.delete(f"{job_id}_{stage}")
     
-    def process_in_parallel(self, items, process_func, *args, **kwargs):
+    @timed("process_in_parallel", items=len)
+    def process_in_parallel(self, items, process_func, *args, mode=None, chunk_size=None, **kwargs):
         """
         Elabora una lista di elementi in parallelo.
         
         Args:
             items: Lista di elementi da elaborare
-            process_func: Funzione da applicare a ciascun elemento
+            process_func: Funzione da applicare a ciascun elemento; in modalità
+                process deve essere definita a livello di modulo
             *args, **kwargs: Argomenti aggiuntivi da passare alla funzione
+            mode: Modalità di esecuzione: "thread" per operazioni I/O-bound o
+                che rilasciano il GIL, "process" per operazioni CPU-bound in
+                Python, "inline" per eseguire nel chiamante (default: executor_mode)
+            chunk_size: Elementi inviati insieme a un worker (default: automatico)
             
         Returns:
             Lista dei risultati
         """
+        mode = mode or self.executor_mode
         start_time = time.time()
-        logger.info(f"Avvio elaborazione parallela di {len(items)} elementi con {self.max_workers} worker")
+        logger.info(f"Avvio elaborazione parallela di {len(items)} elementi con {self.max_workers} worker ({mode})")
         
-        # Usa ThreadPoolExecutor per operazioni I/O-bound
-        # Usa ProcessPoolExecutor per operazioni CPU-bound
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Applica la funzione a ciascun elemento
-            results = list(executor.map(lambda item: process_func(item, *args, **kwargs), items))
+        results = self.get_executor(mode).map(process_func, items, *args, chunk_size=chunk_size, **kwargs)
         
         elapsed_time = time.time() - start_time
         logger.info(f"Elaborazione parallela completata in {elapsed_time:.2f} secondi")
         
         return results
     
+    def get_executor(self, mode=None):
+        """
+        Restituisce l'esecutore di una modalità, creato alla prima richiesta e
+        riutilizzato dalle chiamate successive, così che i processi worker e
+        il loro stato vengano preparati una sola volta.
+        """
+        mode = mode or self.executor_mode
+        executor = self._executors.get(mode)
+        if executor is None:
+            # I processi vengono avviati solo al primo map: un esecutore in più
+            # creato da chiamate concorrenti non costa nulla
+            executor = self._executors.setdefault(mode, ParallelExecutor(
+                mode,
+                max_workers=self.max_workers,
+                initializer=self.worker_initializer,
+                initargs=self.worker_initargs
+            ))
+        return executor
+    
+    def shutdown(self):
+        """
+        Arresta i thread e i processi worker degli esecutori.
+        """
+        for executor in self._executors.values():
+            executor.shutdown()
+    
+    @timed("batch_process", items=len)
     def batch_process(self, items, process_func, batch_size=10, *args, **kwargs):
         """
         Elabora una lista di elementi in batch per ottimizzare l'uso della memoria.
+        Per generatori o liste molto lunghe vedi iter_batch_process.
         
         Args:
             items: Lista di elementi da elaborare
@@ -171,6 +273,113 @@ class PerformanceOptimizer:
         logger.info(f"Elaborazione in batch completata in {elapsed_time:.2f} secondi")
         
         return results
+    
+    def iter_batch_process(self, items, process_func, batch_size=10, *args, load_func=None, max_in_flight=2, **kwargs):
+        """
+        Elabora un iterabile di elementi in batch, restituendo i risultati di
+        ciascun batch appena pronti.
+        
+        A differenza di batch_process gli elementi possono provenire da un
+        generatore e i risultati non vengono accumulati: la memoria occupata
+        dipende da max_in_flight e non dal numero di elementi. Mentre un batch
+        viene elaborato, in un thread separato vengono letti dall'iterabile
+        (e preparati con load_func) i batch successivi.
+        
+        Args:
+            items: Iterabile di elementi da elaborare
+            process_func: Funzione da applicare a ciascun batch
+            batch_size: Dimensione di ciascun batch
+            *args, **kwargs: Argomenti aggiuntivi da passare alla funzione
+            load_func: Funzione opzionale che prepara un batch prima
+                dell'elaborazione (es. carica i frame dai percorsi)
+            max_in_flight: Numero massimo di batch letti e non ancora
+                elaborati, compreso quello in elaborazione; con 1 lettura ed
+                elaborazione si alternano senza sovrapporsi
+            
+        Yields:
+            Lista dei risultati di ciascun batch, nell'ordine degli elementi
+        """
+        start_time = time.time()
+        max_in_flight = max(1, max_in_flight)
+        logger.info(f"Avvio elaborazione in streaming con batch di dimensione {batch_size} ({max_in_flight} batch in memoria)")
+        
+        def read_batches():
+            iterator = iter(items)
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    return
+                yield load_func(batch) if load_func is not None else batch
+        
+        if max_in_flight == 1:
+            batches = read_batches()
+        else:
+            batches = self._prefetch(read_batches(), max_in_flight)
+        
+        count = 0
+        try:
+            for batch in batches:
+                with stage_timer("iter_batch_process") as timer:
+                    batch_results = process_func(batch, *args, **kwargs)
+                    timer["items"] = len(batch_results)
+                del batch
+                
+                count += 1
+                logger.info(f"Batch {count} completato")
+                yield batch_results
+        finally:
+            batches.close()
+        
+        elapsed_time = time.time() - start_time
+        logger.info(f"Elaborazione in streaming di {count} batch completata in {elapsed_time:.2f} secondi")
+    
+    @staticmethod
+    def _prefetch(batches, max_in_flight):
+        """
+        Legge i batch in un thread separato, in anticipo rispetto al
+        consumatore, tenendone in memoria al più max_in_flight (compreso
+        quello restituito al consumatore, liberato quando chiede il
+        successivo). Un errore nella lettura viene rilanciato al consumatore;
+        la chiusura del generatore interrompe la lettura.
+        """
+        slots = threading.Semaphore(max_in_flight)
+        loaded = queue.Queue()
+        stop = threading.Event()
+        
+        def load():
+            try:
+                while True:
+                    # Un batch viene letto solo quando c'è un posto libero
+                    while not slots.acquire(timeout=_POLL_INTERVAL):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    
+                    batch = next(batches, _END)
+                    loaded.put((batch, None))
+                    if batch is _END:
+                        return
+            except BaseException as e:
+                loaded.put((None, e))
+        
+        loader = threading.Thread(target=load, name="batch-prefetch", daemon=True)
+        loader.start()
+        try:
+            while True:
+                batch, error = loaded.get()
+                if error is not None:
+                    raise error
+                if batch is _END:
+                    return
+                
+                yield batch
+                batch = None
+                slots.release()
+        finally:
+            stop.set()
+            loader.join()
+            batches.close()
 
 
 class ScalableVideoProcessor:
@@ -179,7 +388,8 @@ class ScalableVideoProcessor:
     per gestire file video di grandi dimensioni e migliorare le prestazioni.
     """
     
-    def __init__(self, upload_folder, temp_folder, output_folder, max_workers=None):
+    def __init__(self, upload_folder, temp_folder, output_folder, max_workers=None, match_mode="argmax",
+                 model_client=None, stream_scenes=True, stream_batch_size=STREAM_BATCH_SIZE, stage_workers=None):
         """
         Inizializza il processore video scalabile.
         
@@ -188,10 +398,27 @@ class ScalableVideoProcessor:
             temp_folder: Cartella per i file temporanei
             output_folder: Cartella per i file di output
             max_workers: Numero massimo di worker per l'elaborazione parallela
+            match_mode: Modalità di abbinamento predefinita tra scene e frasi
+            model_client: ModelClient opzionale del server dei modelli condiviso
+            stream_scenes: Se True la segmentazione e le didascalie vengono
+                sovrapposte (vedi segment_and_caption); se False il video
+                viene prima segmentato per intero. In entrambi i casi la
+                decodifica è divisa su max_workers processi
+            stream_batch_size: Numero di scene per gruppo di didascalie
+                durante la segmentazione
+            stage_workers: Numero di thread per stage della pipeline
+                ("captions", "embeddings"); quelli non indicati usano
+                DEFAULT_STAGE_WORKERS
         """
         self.upload_folder = upload_folder
         self.temp_folder = temp_folder
         self.output_folder = output_folder
+        self.stream_scenes = stream_scenes
+        self.stream_batch_size = stream_batch_size
+        self.stage_workers = dict(DEFAULT_STAGE_WORKERS, **(stage_workers or {}))
+        
+        # Metriche per stage dell'ultima pipeline eseguita (vedi Pipeline.metrics)
+        self.stage_metrics = {}
         
         # Crea le cartelle se non esistono
         for folder in [upload_folder, temp_folder, output_folder]:
@@ -203,20 +430,30 @@ class ScalableVideoProcessor:
         # Importa i moduli necessari
         from video_segmenter import VideoSegmenter
         from ai_models_detailed import SemanticMatchingEngine
+        from embedding_store import EmbeddingStore
         from video_processing import MontageCompiler
+        from scene_catalog import SceneCatalog
         
         # Inizializza i componenti
         self.video_segmenter = VideoSegmenter(temp_folder)
-        self.semantic_engine = SemanticMatchingEngine()
+        self.embedding_store = EmbeddingStore(os.path.join(temp_folder, "embeddings"))
+        self.semantic_engine = SemanticMatchingEngine(
+            embedding_store=self.embedding_store, match_mode=match_mode, model_client=model_client
+        )
         self.montage_compiler = MontageCompiler(temp_folder, output_folder)
+        
+        # Catalogo delle scene di tutti i job, per la ricerca (vedi /api/search)
+        self.scene_catalog = SceneCatalog(os.path.join(temp_folder, "scenes.db"))
     
-    def segment_video(self, video_path, job_id):
+    def segment_video(self, video_path, job_id, progress_callback=None):
         """
         Segmenta il video in scene con ottimizzazione delle prestazioni.
         
         Args:
             video_path: Percorso del video
             job_id: ID del job
+            progress_callback: Funzione opzionale per l'avanzamento della
+                decodifica (vedi VideoSegmenter.detect_scenes)
             
         Returns:
             Lista di scene
@@ -229,35 +466,28 @@ class ScalableVideoProcessor:
             logger.info(f"Utilizzando scene dalla cache per il job {job_id}")
             return cached_scenes
         
-        # In un'implementazione reale, qui utilizzeremmo:
-        # scenes = self.video_segmenter.detect_scenes(video_path, job_id)
-        # Per ora, utilizziamo dati simulati
-        scenes = [
-            {"id": 1, "start_time": 0, "end_time": 10, "thumbnail": os.path.join(self.temp_folder, "1.jpg")},
-            {"id": 2, "start_time": 15, "end_time": 25, "thumbnail": os.path.join(self.temp_folder, "2.jpg")},
-            {"id": 3, "start_time": 30, "end_time": 40, "thumbnail": os.path.join(self.temp_folder, "3.jpg")},
-            {"id": 4, "start_time": 45, "end_time": 55, "thumbnail": os.path.join(self.temp_folder, "4.jpg")},
-            {"id": 5, "start_time": 60, "end_time": 70, "thumbnail": os.path.join(self.temp_folder, "5.jpg")},
-            {"id": 6, "start_time": 75, "end_time": 85, "thumbnail": os.path.join(self.temp_folder, "6.jpg")}
-        ]
-        
-        # Crea i file di thumbnail simulati
-        for scene in scenes:
-            with open(scene["thumbnail"], 'w') as f:
-                f.write(f"Placeholder per thumbnail della scena {scene['id']}")
+        scenes = self.video_segmenter.detect_scenes(
+            video_path,
+            job_id,
+            num_workers=self.optimizer.max_workers,
+            progress_callback=progress_callback
+        )
         
         # Salva nella cache
         self.optimizer.save_to_cache(job_id, "segmentation", scenes)
         
         return scenes
     
-    def generate_captions(self, scenes, job_id):
+    def generate_captions(self, scenes, job_id, progress_callback=None):
         """
-        Genera didascalie per le scene con elaborazione parallela.
+        Genera didascalie per le scene con elaborazione in batch.
         
         Args:
             scenes: Lista di scene
             job_id: ID del job
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback("captions", "progress", dettagli) con
+                didascalie completate e tempo residuo stimato
             
         Returns:
             Scene con didascalie
@@ -270,24 +500,101 @@ class ScalableVideoProcessor:
             logger.info(f"Utilizzando didascalie dalla cache per il job {job_id}")
             return cached_scenes
         
-        # Funzione per generare la didascalia per una singola scena
-        def generate_caption_for_scene(scene):
-            thumbnail_path = scene.get("thumbnail", "")
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                scene["caption"] = self.semantic_engine.caption_generator.generate_caption(thumbnail_path)
-            else:
-                scene["caption"] = "Scena senza thumbnail"
-            return scene
-        
-        # Genera didascalie in parallelo
-        scenes_with_captions = self.optimizer.process_in_parallel(scenes, generate_caption_for_scene)
+        # Didascalie generate in batch, con un'unica chiamata al modello per batch:
+        # il modello usa già tutti i core, più chiamate in parallelo si
+        # contenderebbero CPU e memoria. Si lavora su copie perché le scene
+        # possono provenire dalla cache della segmentazione
+        scenes_with_captions = self.semantic_engine.process_scenes(
+            [dict(scene) for scene in scenes],
+            job_id,
+            progress_callback=progress_callback
+        )
         
         # Salva nella cache
         self.optimizer.save_to_cache(job_id, "captions", scenes_with_captions)
         
         return scenes_with_captions
     
-    def match_scenes_to_summary(self, scenes, summary_segments, job_id):
+    @timed("segment_and_caption", items=len)
+    def segment_and_caption(self, video_path, job_id, progress_callback=None):
+        """
+        Segmenta il video, genera le didascalie e calcola gli embedding dei
+        thumbnail come stage concorrenti di una Pipeline.
+        
+        Le scene restituite da VideoSegmenter.iter_scenes_parallel (thumbnail
+        compresi, scelti durante la stessa decodifica) passano al generatore di
+        didascalie a gruppi di stream_batch_size e poi a CLIP, che ne salva gli
+        embedding nell'archivio per il matching, mentre la decodifica del video
+        prosegue. Le code tra gli stage sono limitate: se uno stage rallenta,
+        quelli precedenti attendono. Il risultato viene salvato nella cache
+        della segmentazione e delle didascalie.
+        
+        Args:
+            video_path: Percorso del video
+            job_id: ID del job
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback(stage, state, details) all'inizio e alla fine
+                degli stage "segmentation" e "captions" e durante il loro
+                avanzamento; la notifica di fine delle didascalie include le
+                metriche degli stage
+            
+        Returns:
+            Scene con didascalie
+        """
+        logger.info(f"Pipeline di segmentazione e didascalie per il job {job_id}")
+        
+        self._notify(progress_callback, "segmentation", "running")
+        self._notify(progress_callback, "captions", "running")
+        
+        # Il totale delle didascalie è noto solo al termine della segmentazione
+        tracker = ProgressTracker(progress_callback, "captions", unit="captions")
+        
+        def detected_scenes():
+            # Rilevamento su più processi: le scene arrivano man mano che gli intervalli vengono ricuciti
+            scenes = []
+            for scene in self.video_segmenter.iter_scenes_parallel(video_path, job_id,
+                                                                   num_workers=self.optimizer.max_workers,
+                                                                   progress_callback=progress_callback):
+                scenes.append(scene)
+                # Copia: le didascalie non devono finire nella cache della segmentazione
+                yield dict(scene)
+            
+            self.optimizer.save_to_cache(job_id, "segmentation", scenes)
+            self._notify(progress_callback, "segmentation", "done", {"scenes_found": len(scenes)})
+        
+        def caption(scenes):
+            scenes = self.semantic_engine.process_scenes(scenes, job_id)
+            tracker.advance(len(scenes))
+            return scenes
+        
+        def embed(scenes):
+            # Embedding calcolati subito: il matching li ritrova nell'archivio
+            try:
+                self.semantic_engine.clip_model.encode_images([scene["thumbnail"] for scene in scenes])
+            except Exception as e:
+                logger.warning(f"Calcolo anticipato degli embedding non riuscito: {str(e)}")
+            return scenes
+        
+        pipeline = Pipeline(detected_scenes(), [
+            PipelineStage("captions", caption, workers=self.stage_workers["captions"],
+                          batch_size=self.stream_batch_size),
+            PipelineStage("embeddings", embed, workers=self.stage_workers["embeddings"],
+                          batch_size=EMBEDDING_BATCH_SIZE)
+        ], source_name="segmentation")
+        
+        scenes_with_captions = pipeline.run()
+        self.stage_metrics = pipeline.metrics()
+        tracker.update(len(scenes_with_captions), total=len(scenes_with_captions))
+        
+        self.optimizer.save_to_cache(job_id, "captions", scenes_with_captions)
+        self._notify(progress_callback, "captions", "done", {
+            "captions_done": len(scenes_with_captions),
+            "stage_metrics": self.stage_metrics
+        })
+        
+        return scenes_with_captions
+    
+    def match_scenes_to_summary(self, scenes, summary_segments, job_id, match_mode=None, previous_segments=None):
         """
         Abbina le scene alle frasi del riassunto con ottimizzazione delle prestazioni.
         
@@ -295,56 +602,55 @@ class ScalableVideoProcessor:
             scenes: Lista di scene con didascalie
             summary_segments: Lista di segmenti del riassunto
             job_id: ID del job
+            match_mode: Modalità di abbinamento (default: quella del motore semantico)
+            previous_segments: Segmenti abbinati di un riassunto precedente
+                dello stesso video: le frasi non modificate mantengono la
+                propria scena e solo le altre vengono abbinate (vedi
+                SemanticMatchingEngine.rematch_changed)
             
         Returns:
             Segmenti del riassunto con scene abbinate
         """
         logger.info(f"Matching semantico ottimizzato per il job {job_id}")
         
-        # Verifica se esiste una cache
-        cached_segments = self.optimizer.load_from_cache(job_id, "matching")
-        if cached_segments:
-            logger.info(f"Utilizzando matching dalla cache per il job {job_id}")
-            return cached_segments
-        
-        # Estrai i percorsi dei thumbnail e i testi dei segmenti
-        thumbnail_paths = [scene.get("thumbnail", "") for scene in scenes]
+        # Estrai i testi dei segmenti
         segment_texts = [segment.get("text", "") for segment in summary_segments]
+        match_mode = match_mode or self.semantic_engine.match_mode
         
-        # Calcola le similarità in batch per ottimizzare l'uso della memoria
-        batch_size = min(10, len(segment_texts))  # Limita la dimensione del batch
+        if previous_segments:
+            # Solo le frasi nuove o modificate vengono abbinate. Il risultato
+            # dipende dalle scene precedenti (anche scelte nella revisione):
+            # non viene letto né salvato nella cache, che vale per il solo riassunto
+            summary_segments, _ = self.semantic_engine.rematch_changed(
+                scenes, summary_segments, previous_segments, match_mode
+            )
+            return summary_segments
         
-        # Funzione per calcolare le similarità per un batch di testi
-        def calculate_similarities_for_batch(batch_texts):
-            batch_results = []
-            for text in batch_texts:
-                # Calcola la similarità per ciascuna immagine
-                similarities = []
-                for path in thumbnail_paths:
-                    similarity = self.semantic_engine.clip_model.compute_similarity(path, text)
-                    similarities.append(similarity)
-                batch_results.append(similarities)
-            return batch_results
+        cache_stage = matching_cache_stage(segment_texts, match_mode)
         
-        # Calcola le similarità in batch
-        similarity_batches = self.optimizer.batch_process(segment_texts, calculate_similarities_for_batch, batch_size)
+        # Verifica se esiste una cache
+        cached_segments = self.optimizer.load_from_cache(job_id, cache_stage)
+        if cached_segments:
+            logger.info(f"Utilizzando matching dalla cache per il job {job_id}")
+            return cached_segments
         
+        # Codifica immagini e testi una sola volta; con molte scene i candidati vengono recuperati dall'indice
+        best_matches = self.semantic_engine.find_matches(scenes, segment_texts, match_mode)
+            
         # Trova la migliore corrispondenza per ciascun segmento
         for i, segment in enumerate(summary_segments):
-            if i < len(similarity_batches):
-                similarities = similarity_batches[i]
-                best_match_index = similarities.index(max(similarities))
-                if best_match_index < len(scenes):
-                    segment["matchedSceneId"] = scenes[best_match_index]["id"]
-                elif len(scenes) > 0:
-                    segment["matchedSceneId"] = scenes[0]["id"]
+            if i < len(best_matches) and best_matches[i] < len(scenes):
+                segment["matchedSceneId"] = scenes[best_matches[i]]["id"]
+            elif len(scenes) > 0:
+                segment["matchedSceneId"] = scenes[0]["id"]
         
         # Salva nella cache
-        self.optimizer.save_to_cache(job_id, "matching", summary_segments)
+        self.optimizer.save_to_cache(job_id, cache_stage, summary_segments)
         
         return summary_segments
     
-    def process_video(self, video_path, summary, job_id):
+    @timed("process_video")
+    def process_video(self, video_path, summary, job_id, progress_callback=None, match_mode=None):
         """
         Elabora un video e un riassunto per creare un montaggio con ottimizzazione delle prestazioni.
         
@@ -352,6 +658,13 @@ class ScalableVideoProcessor:
             video_path: Percorso del video
             summary: Testo del riassunto
             job_id: ID del job
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback(stage, state, details) all'inizio ("running")
+                e alla fine ("done") di ogni stage e, durante segmentazione e
+                didascalie, con state "progress" e i dettagli dell'avanzamento
+                (unità elaborate, totale, percentuale, tempo residuo stimato)
+            match_mode: Modalità di abbinamento tra scene e frasi (default:
+                quella del processore)
             
         Returns:
             Risultati dell'elaborazione
@@ -360,36 +673,38 @@ class ScalableVideoProcessor:
         
         try:
             # Dividi il riassunto in frasi
-            import re
-            sentences = re.split(r'(?<=[.!?])\s+', summary)
+            summary_segments = split_summary(summary)
             
-            summary_segments = []
-            for i, sentence in enumerate(sentences):
-                if sentence.strip():  # Ignora le frasi vuote
-                    summary_segments.append({
-                        "id": i + 1,
-                        "text": sentence.strip()
-                    })
+            # Scene e didascalie dipendono solo dal video: sono condivise tra i
+            # job dei caricamenti dello stesso video; riassunto e abbinamenti no
+            video_id = video_id_of(job_id)
             
-            # Segmenta il video in scene
-            scenes = self.segment_video(video_path, job_id)
-            
-            # Genera didascalie per le scene
-            scenes = self.generate_captions(scenes, job_id)
+            if self.stream_scenes and not self.optimizer.cache_exists(video_id, "segmentation"):
+                # Didascalie generate man mano che le scene vengono rilevate
+                scenes = self.segment_and_caption(video_path, video_id, progress_callback)
+            else:
+                # Segmenta il video in scene
+                self._notify(progress_callback, "segmentation", "running")
+                scenes = self.segment_video(video_path, video_id, progress_callback)
+                self._notify(progress_callback, "segmentation", "done", {"scenes_found": len(scenes)})
+                
+                # Genera didascalie per le scene
+                self._notify(progress_callback, "captions", "running")
+                scenes = self.generate_captions(scenes, video_id, progress_callback)
+                self._notify(progress_callback, "captions", "done", {"captions_done": len(scenes)})
             
             # Abbina le scene alle frasi del riassunto
-            summary_segments = self.match_scenes_to_summary(scenes, summary_segments, job_id)
+            self._notify(progress_callback, "matching", "running")
+            match_mode = match_mode or self.semantic_engine.match_mode
+            summary_segments = self.match_scenes_to_summary(
+                scenes, summary_segments, job_id, match_mode, self._previous_segments(job_id, match_mode)
+            )
+            self._notify(progress_callback, "matching", "done", {"segments_matched": len(summary_segments)})
             
             # Salva i risultati
-            results = {
-                "job_id": job_id,
-                "scenes": scenes,
-                "summary_segments": summary_segments
-            }
+            results = self._save_results(job_id, scenes, summary_segments, summary, match_mode)
             
-            results_path = os.path.join(self.temp_folder, f"{job_id}_results.json")
-            with open(results_path, 'w') as f:
-                json.dump(results, f)
+            self.catalog_scenes(video_id, scenes)
             
             return results
             
@@ -397,6 +712,102 @@ class ScalableVideoProcessor:
             logger.error(f"Errore durante l'elaborazione ottimizzata del video: {str(e)}")
             return {"error": str(e)}
     
+    @timed("update_summary")
+    def update_summary(self, job_id, summary, match_mode=None):
+        """
+        Aggiorna il riassunto di un job già elaborato, abbinando solo le
+        frasi nuove o modificate: le altre mantengono la scena abbinata,
+        anche se scelta manualmente nella revisione.
+        
+        Args:
+            job_id: ID del job
+            summary: Nuovo testo del riassunto
+            match_mode: Modalità di abbinamento (default: quella dei risultati)
+            
+        Returns:
+            Risultati aggiornati, con il numero di frasi abbinate di nuovo in "rematched"
+        """
+        results_path = os.path.join(self.temp_folder, f"{job_id}_results.json")
+        if not os.path.exists(results_path):
+            raise FileNotFoundError(f"Risultati non trovati per il job {job_id}")
+        
+        with open(results_path, 'r') as f:
+            previous = json.load(f)
+        
+        previous_mode = previous.get("match_mode", "argmax")
+        match_mode = match_mode or previous_mode
+        
+        # Con una modalità diversa le scene precedenti non rispettano i nuovi vincoli
+        previous_segments = previous["summary_segments"] if match_mode == previous_mode else []
+        summary_segments, rematched = self.semantic_engine.rematch_changed(
+            previous["scenes"], split_summary(summary), previous_segments, match_mode
+        )
+        
+        results = self._save_results(job_id, previous["scenes"], summary_segments, summary, match_mode)
+        results["rematched"] = rematched
+        return results
+    
+    def _previous_segments(self, job_id, match_mode):
+        """
+        Segmenti abbinati dell'ultima elaborazione del job con la stessa
+        modalità di abbinamento, o None.
+        """
+        results_path = os.path.join(self.temp_folder, f"{job_id}_results.json")
+        try:
+            with open(results_path, 'r') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if previous.get("match_mode", "argmax") != match_mode:
+            return None
+        return previous.get("summary_segments")
+    
+    def _save_results(self, job_id, scenes, summary_segments, summary, match_mode):
+        """
+        Salva i risultati di un job in {job_id}_results.json.
+        """
+        results = {
+            "job_id": job_id,
+            "scenes": scenes,
+            "summary_segments": summary_segments,
+            "summary_sha256": hashlib.sha256(summary.encode("utf-8")).hexdigest(),
+            "match_mode": match_mode
+        }
+        
+        results_path = os.path.join(self.temp_folder, f"{job_id}_results.json")
+        with open(results_path, 'w') as f:
+            json.dump(results, f)
+        
+        return results
+    
+    def catalog_scenes(self, job_id, scenes):
+        """
+        Inserisce le scene di un video nel catalogo delle scene, con gli
+        embedding dei thumbnail già calcolati durante l'elaborazione. Un
+        errore del catalogo non interrompe il job.
+        
+        Args:
+            job_id: ID del video (vedi video_index.video_id_of), così che i
+                caricamenti dello stesso video non duplichino le scene
+            scenes: Lista di scene con didascalie
+        """
+        try:
+            embeddings = self.semantic_engine.clip_model.cached_image_embeddings(
+                [scene.get("thumbnail", "") for scene in scenes]
+            )
+            self.scene_catalog.index_job(job_id, scenes, embeddings)
+        except Exception as e:
+            logger.warning(f"Scene del job {job_id} non inserite nel catalogo: {str(e)}")
+    
+    @staticmethod
+    def _notify(progress_callback, stage, state, details=None):
+        """
+        Notifica lo stato di uno stage, se è stata fornita una callback.
+        """
+        if progress_callback is not None:
+            progress_callback(stage, state, details)
+    
     def generate_montage(self, job_id):
         """
         Genera il montaggio finale per un job con ottimizzazione delle prestazioni.
@@ -413,5 +824,37 @@ class ScalableVideoProcessor:
             # Carica i risultati
             results_path = os.path.join(self.temp_folder, f"{job_id}_results.json")
             
-            if not os.path.exists(
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+            if not os.path.exists(results_path):
+                raise FileNotFoundError(f"Risultati non trovati per il job {job_id}")
+            
+            with open(results_path, 'r') as f:
+                results = json.load(f)
+            
+            # Recupera il percorso del video, condiviso tra i caricamenti dello stesso video
+            video_id = video_id_of(job_id)
+            video_path = os.path.join(self.upload_folder, f"{video_id}.mp4")
+            
+            if not os.path.exists(video_path):
+                # Prova altre estensioni
+                for ext in ['mov', 'avi', 'mkv']:
+                    alt_path = os.path.join(self.upload_folder, f"{video_id}.{ext}")
+                    if os.path.exists(alt_path):
+                        video_path = alt_path
+                        break
+            
+            if not os.path.exists(video_path):
+                raise FileNotFoundError(f"Video non trovato per il job {job_id}")
+            
+            # Compila il montaggio
+            output_path = self.montage_compiler.compile_montage(
+                video_path, 
+                results['scenes'], 
+                results['summary_segments'], 
+                job_id
+            )
+            
+            return output_path
+            
+        except Exception as e:
+            logger.error(f"Errore durante la generazione ottimizzata del montaggio: {str(e)}")
+            return None
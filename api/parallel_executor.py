@@ -0,0 +1,187 @@
+import math
+import pickle
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modalità di esecuzione: thread per il lavoro I/O-bound o che rilascia il GIL
+# (decodifica, modelli), processi per il lavoro CPU-bound in Python, inline
+# per eseguire tutto nel chiamante (debug, test, ambienti senza processi)
+EXECUTOR_MODES = ("thread", "process", "inline")
+
+# Gruppi per worker in cui vengono divisi gli elementi quando chunk_size non è
+# indicato: abbastanza per bilanciare il carico, pochi per limitare gli invii
+CHUNKS_PER_WORKER = 4
+
+# Stato del worker corrente, restituito dall'initializer (vedi worker_state)
+_worker_state = None
+
+class ParallelExecutor:
+    """
+    Esegue una funzione su una lista di elementi in thread, in processi o nel
+    chiamante, con la stessa interfaccia.
+    
+    Gli elementi vengono inviati ai worker a gruppi (chunk), così che ogni
+    invio, che in modalità process richiede la serializzazione con pickle,
+    copra più elementi. In modalità process la funzione deve essere definita
+    a livello di modulo e gli argomenti serializzabili; i processi vengono
+    avviati con "spawn", per non duplicare lo stato del processo chiamante
+    (thread, modelli), e restano attivi tra una chiamata e l'altra.
+    
+    L'initializer viene eseguito una sola volta per processo worker (una sola
+    volta in totale nelle modalità thread e inline) e il suo risultato, ad
+    esempio un modello o una tabella precalcolata, è disponibile nei task con
+    worker_state().
+    """
+    
+    def __init__(self, mode="thread", max_workers=None, initializer=None, initargs=(), chunk_size=None):
+        """
+        Inizializza l'esecutore.
+        
+        Args:
+            mode: Modalità di esecuzione, una di EXECUTOR_MODES
+            max_workers: Numero di thread o processi (default: numero di core)
+            initializer: Funzione opzionale che prepara lo stato di ogni worker
+            initargs: Argomenti dell'initializer
+            chunk_size: Elementi per invio (default: divisi in CHUNKS_PER_WORKER
+                gruppi per worker)
+        """
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Modalità di esecuzione non valida: {mode} (valori ammessi: {', '.join(EXECUTOR_MODES)})")
+        
+        self.mode = mode
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.chunk_size = chunk_size
+        
+        self._pool = None
+        self._local_state = None
+        self._initialized = False
+        self._lock = threading.Lock()
+    
+    def map(self, func, items, *args, chunk_size=None, **kwargs):
+        """
+        Applica func(item, *args, **kwargs) a ogni elemento.
+        
+        Args:
+            func: Funzione da applicare (a livello di modulo in modalità process)
+            items: Elementi da elaborare
+            *args, **kwargs: Argomenti aggiuntivi passati a ogni chiamata
+            chunk_size: Elementi per invio, se diverso da quello dell'esecutore
+        
+        Returns:
+            Lista dei risultati, nell'ordine degli elementi; un'eccezione in un
+            task viene rilanciata
+        """
+        items = list(items)
+        if not items:
+            return []
+        
+        task = _Task(func, args, kwargs)
+        
+        if self.mode == "inline":
+            self._init_local()
+            return _run_chunk(task, items)
+        
+        chunk_size = chunk_size or self.chunk_size or math.ceil(len(items) / (self.max_workers * CHUNKS_PER_WORKER))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        
+        if self.mode == "process":
+            _check_picklable(task)
+        
+        pool = self._get_pool()
+        results = []
+        for chunk_results in pool.map(_run_chunk, [task] * len(chunks), chunks):
+            results.extend(chunk_results)
+        return results
+    
+    def shutdown(self, wait=True):
+        """
+        Arresta i worker; un esecutore arrestato li riavvia alla chiamata successiva.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        
+        if pool is not None:
+            pool.shutdown(wait=wait)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.shutdown()
+    
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.mode == "process":
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.initializer, self.initargs)
+                    )
+                else:
+                    self._init_local()
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="parallel")
+            return self._pool
+    
+    def _init_local(self):
+        # Modalità thread e inline: lo stato è quello del processo chiamante
+        global _worker_state
+        if not self._initialized:
+            self._initialized = True
+            if self.initializer is not None:
+                self._local_state = self.initializer(*self.initargs)
+        _worker_state = self._local_state
+
+
+class _Task:
+    """
+    Descrittore serializzabile di un task: funzione e argomenti aggiuntivi.
+    """
+    
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+    
+    def __call__(self, item):
+        return self.func(item, *self.args, **self.kwargs)
+
+
+def worker_state():
+    """
+    Restituisce lo stato preparato dall'initializer dell'esecutore nel worker
+    corrente (None se l'esecutore non ha un initializer).
+    """
+    return _worker_state
+
+
+def _init_worker(initializer, initargs):
+    # Eseguito una volta all'avvio di ogni processo worker
+    global _worker_state
+    if initializer is not None:
+        _worker_state = initializer(*initargs)
+
+
+def _run_chunk(task, items):
+    return [task(item) for item in items]
+
+
+def _check_picklable(task):
+    # Errore chiaro subito, invece di un errore di serializzazione nel pool
+    try:
+        pickle.dumps(task)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise TypeError(
+            f"In modalità process la funzione e gli argomenti devono essere serializzabili "
+            f"(funzioni definite a livello di modulo, non lambda o funzioni annidate): {str(e)}"
+        ) from e
@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Intervallo minimo, in secondi, tra due notifiche di avanzamento dello stesso stage
+DEFAULT_MIN_INTERVAL = 0.5
+
+class ProgressTracker:
+    """
+    Avanzamento di uno stage della pipeline.
+    
+    Tiene il conto delle unità elaborate (frame, didascalie, ...), stima il
+    tempo residuo in base alla velocità media e notifica la callback come
+    callback(stage, "progress", dettagli). Le notifiche sono limitate a una
+    ogni min_interval secondi, tranne quella che completa lo stage, così che
+    gli aggiornamenti frequenti non rallentino l'elaborazione. Può essere
+    aggiornato da più thread.
+    """
+    
+    def __init__(self, callback, stage, total=None, unit="items", min_interval=DEFAULT_MIN_INTERVAL):
+        """
+        Inizializza il tracker.
+        
+        Args:
+            callback: Funzione chiamata come callback(stage, state, details),
+                o None per non notificare nulla
+            stage: Nome dello stage
+            total: Numero totale di unità da elaborare, se noto
+            unit: Nome delle unità elaborate (es. "frames", "captions")
+            min_interval: Intervallo minimo, in secondi, tra due notifiche
+        """
+        self.callback = callback
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.min_interval = min_interval
+        self.done = 0
+        
+        self._start = time.monotonic()
+        self._last_notify = None
+        self._lock = threading.Lock()
+    
+    def update(self, done, total=None, **details):
+        """
+        Imposta il numero di unità elaborate e notifica l'avanzamento.
+        
+        Args:
+            done: Unità elaborate finora
+            total: Nuovo totale, se cambiato
+            **details: Informazioni aggiuntive da includere nella notifica
+                (es. scenes_found)
+        """
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            self._notify(details)
+    
+    def advance(self, count=1, **details):
+        """
+        Aggiunge count unità elaborate e notifica l'avanzamento.
+        """
+        with self._lock:
+            self.done += count
+            self._notify(details)
+    
+    def snapshot(self, **details):
+        """
+        Restituisce lo stato corrente: unità elaborate, totale, percentuale,
+        tempo trascorso e tempo residuo stimato (None se non stimabile).
+        """
+        elapsed = time.monotonic() - self._start
+        
+        percent = None
+        eta = None
+        if self.total:
+            percent = round(min(100.0, 100.0 * self.done / self.total), 1)
+            if self.done > 0:
+                eta = round(max(0.0, elapsed * (self.total - self.done) / self.done), 1)
+        
+        snapshot = {
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "percent": percent,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": eta
+        }
+        snapshot.update(details)
+        return snapshot
+    
+    def _notify(self, details):
+        # Da chiamare con il lock acquisito
+        if self.callback is None:
+            return
+        
+        now = time.monotonic()
+        finished = self.total is not None and self.done >= self.total
+        if not finished and self._last_notify is not None and now - self._last_notify < self.min_interval:
+            return
+        
+        self._last_notify = now
+        
+        # Un errore nella notifica non deve interrompere l'elaborazione
+        try:
+            self.callback(self.stage, "progress", self.snapshot(**details))
+        except Exception as e:
+            logger.warning(f"Notifica di avanzamento non riuscita ({self.stage}): {str(e)}")
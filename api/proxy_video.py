@@ -0,0 +1,216 @@
+import os
+import fcntl
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Parametri del video proxy: bassa risoluzione e bitrate, un keyframe al secondo
+# così che il player e il rendering smart cut si spostino rapidamente nel video
+PROXY_HEIGHT = 360
+PROXY_VIDEO_BITRATE = "600k"
+PROXY_MAX_BITRATE = "800k"
+PROXY_AUDIO_BITRATE = "64k"
+PROXY_KEYFRAME_INTERVAL = 1
+
+class ProxyGenerator:
+    """
+    Generatore dei video proxy a bassa risoluzione.
+    
+    Dopo il caricamento ogni video viene ricodificato in background in una
+    copia a 360p e basso bitrate, con la stessa durata e gli stessi tempi
+    dell'originale. Le pagine di revisione e anteprima riproducono le scene
+    dal proxy e il montaggio in bozza (MontageCompiler.compile_montage con
+    draft=True) viene generato dal proxy in pochi secondi, lasciando al solo
+    montaggio finale la codifica a piena risoluzione.
+    
+    I proxy vengono scritti in un file temporaneo e rinominati solo a
+    codifica completata; un lock sul file evita che più processi codifichino
+    lo stesso video.
+    """
+    
+    def __init__(self, proxy_folder, ffmpeg_path=None, max_workers=1, height=PROXY_HEIGHT):
+        """
+        Inizializza il generatore.
+        
+        Args:
+            proxy_folder: Cartella dei video proxy
+            ffmpeg_path: Percorso dell'eseguibile ffmpeg (default: cercato nel PATH)
+            max_workers: Numero massimo di codifiche eseguite contemporaneamente
+            height: Altezza in pixel del proxy (i video più piccoli non vengono ingranditi)
+        """
+        self.proxy_folder = proxy_folder
+        self.ffmpeg_path = ffmpeg_path or shutil.which("ffmpeg")
+        self.max_workers = max_workers
+        self.height = height
+        os.makedirs(proxy_folder, exist_ok=True)
+        
+        self._executor = None
+        self._pending = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+    
+    def is_available(self):
+        """
+        Verifica che ffmpeg sia disponibile.
+        """
+        return bool(self.ffmpeg_path)
+    
+    def proxy_path(self, job_id):
+        """
+        Percorso del video proxy di un job.
+        """
+        return os.path.join(self.proxy_folder, f"{job_id}_proxy.mp4")
+    
+    def get(self, job_id):
+        """
+        Restituisce il percorso del proxy di un job, o None se non è ancora pronto.
+        """
+        path = self.proxy_path(job_id)
+        return path if os.path.exists(path) else None
+    
+    def status(self, job_id):
+        """
+        Stato del proxy di un job: "ready", "running" (in coda o in codifica),
+        "failed", "missing" (mai richiesto) o "unavailable" (ffmpeg assente).
+        """
+        if self.get(job_id) is not None:
+            return "ready"
+        if not self.is_available():
+            return "unavailable"
+        
+        with self._lock:
+            if job_id in self._pending:
+                return "running"
+            if job_id in self._errors:
+                return "failed"
+        
+        # Codifica in corso in un altro processo
+        return "running" if self._is_locked(job_id) else "missing"
+    
+    def request(self, job_id, video_path):
+        """
+        Avvia in background la codifica del proxy di un job, se non è già
+        pronto o in corso.
+        
+        Args:
+            job_id: ID del job
+            video_path: Percorso del video caricato
+        
+        Returns:
+            Stato del proxy (vedi status)
+        """
+        status = self.status(job_id)
+        if status in ("ready", "running", "unavailable"):
+            return status
+        
+        with self._lock:
+            if job_id in self._pending:
+                return "running"
+            
+            # Il pool viene creato alla prima richiesta, non all'avvio dell'API
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="proxy")
+            
+            self._errors.pop(job_id, None)
+            self._pending[job_id] = self._executor.submit(self._generate, job_id, video_path)
+        
+        return "running"
+    
+    def transcode(self, video_path, output_path):
+        """
+        Codifica il proxy di un video.
+        
+        Args:
+            video_path: Percorso del video originale
+            output_path: Percorso del proxy da generare
+        """
+        if not self.is_available():
+            raise RuntimeError("ffmpeg non disponibile")
+        
+        temp_path = f"{output_path}.tmp.mp4"
+        command = [
+            self.ffmpeg_path, "-y", "-v", "error",
+            "-i", video_path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-vf", f"scale=-2:'min(ih,{self.height})'",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-b:v", PROXY_VIDEO_BITRATE, "-maxrate", PROXY_MAX_BITRATE, "-bufsize", PROXY_MAX_BITRATE,
+            "-force_key_frames", f"expr:gte(t,n_forced*{PROXY_KEYFRAME_INTERVAL})",
+            "-c:a", "aac", "-b:a", PROXY_AUDIO_BITRATE, "-ac", "2",
+            "-movflags", "+faststart",
+            temp_path
+        ]
+        
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Codifica del proxy fallita: {result.stderr.strip()}")
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def shutdown(self):
+        """
+        Annulla le codifiche in coda e attende quelle in corso.
+        """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def generate(self, job_id, video_path):
+        """
+        Codifica il proxy di un job e ne restituisce il percorso. Se un altro
+        processo lo sta già codificando attende che termini.
+        
+        Args:
+            job_id: ID del job
+            video_path: Percorso del video caricato
+        
+        Returns:
+            Percorso del proxy
+        """
+        output_path = self.proxy_path(job_id)
+        
+        with open(f"{output_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(output_path):
+                logger.info(f"Codifica del proxy per il job {job_id}")
+                self.transcode(video_path, output_path)
+                logger.info(f"Proxy pronto: {output_path}")
+        
+        return output_path
+    
+    def _generate(self, job_id, video_path):
+        # Codifica in background: l'errore viene registrato e restituito da status
+        try:
+            self.generate(job_id, video_path)
+        except Exception as e:
+            logger.error(f"Errore durante la codifica del proxy per il job {job_id}: {str(e)}")
+            with self._lock:
+                self._errors[job_id] = str(e)
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+    
+    def _is_locked(self, job_id):
+        lock_path = f"{self.proxy_path(job_id)}.lock"
+        if not os.path.exists(lock_path):
+            return False
+        
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
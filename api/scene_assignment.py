@@ -0,0 +1,323 @@
+import logging
+import numpy as np
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modalità di abbinamento tra frasi del riassunto e scene
+#   argmax: ogni frase riceve la scena più simile, anche se già usata
+#   unique: assegnazione uno a uno che massimizza la similarità totale
+#   ordered: le scene seguono l'ordine delle frasi (ripetizioni consentite)
+#   ordered_unique: le scene seguono l'ordine delle frasi, senza ripetizioni
+MATCH_MODES = ("argmax", "unique", "ordered", "ordered_unique")
+
+# Numero di scene candidate considerate per ogni frase
+DEFAULT_TOP_K = 10
+
+# Costo assegnato alle coppie frase-scena escluse dai candidati
+_EXCLUDED_COST = 1e9
+
+def assign_scenes(similarity, mode="argmax", top_k=DEFAULT_TOP_K, scene_order=None):
+    """
+    Assegna una scena a ogni frase del riassunto a partire dalla matrice di similarità.
+    
+    Le modalità con vincoli non usano la matrice completa: per ogni frase
+    vengono considerate solo le top_k scene più simili. Se con questi
+    candidati i vincoli non sono soddisfacibili, i candidati vengono
+    raddoppiati fino a includere, al limite, tutte le scene.
+    
+    Args:
+        similarity: Matrice di similarità (frasi x scene)
+        mode: Modalità di abbinamento, una di MATCH_MODES
+        top_k: Numero iniziale di scene candidate per frase
+        scene_order: Chiavi di ordinamento temporale delle scene (es. tempi
+            di inizio); se None si usa l'ordine della lista
+    
+    Returns:
+        Array con l'indice della scena assegnata a ogni frase
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Modalità di abbinamento non valida: {mode}")
+    
+    similarity = np.asarray(similarity, dtype=np.float64)
+    num_sentences, num_scenes = similarity.shape
+    
+    if num_sentences == 0 or num_scenes == 0:
+        return np.zeros(num_sentences, dtype=int)
+    
+    if mode == "argmax":
+        return np.argmax(similarity, axis=1)
+    
+    # Rango temporale di ogni scena
+    if scene_order is None:
+        scene_ranks = np.arange(num_scenes)
+    else:
+        scene_ranks = np.empty(num_scenes, dtype=int)
+        scene_ranks[np.argsort(np.asarray(scene_order), kind="stable")] = np.arange(num_scenes)
+    
+    unique = mode in ("unique", "ordered_unique")
+    if unique and num_scenes < num_sentences:
+        logger.warning(f"Scene insufficienti per un abbinamento uno a uno ({num_scenes} scene, {num_sentences} frasi): le scene possono ripetersi")
+        unique = False
+        if mode == "unique":
+            return np.argmax(similarity, axis=1)
+    
+    k = max(1, min(top_k, num_scenes))
+    while True:
+        candidate_indices, candidate_scores = top_k_candidates(similarity, k)
+        
+        if mode == "unique":
+            assignment = solve_unique_assignment(candidate_indices, candidate_scores)
+        else:
+            assignment = solve_ordered_assignment(candidate_indices, candidate_scores, scene_ranks, strict=unique)
+        
+        if assignment is not None and (assignment >= 0).all():
+            return assignment
+        
+        # Con tutte le scene come candidate i vincoli sono sempre soddisfacibili
+        if k >= num_scenes:
+            return np.argmax(similarity, axis=1)
+        
+        k = min(num_scenes, k * 2)
+        logger.info(f"Vincoli non soddisfacibili con i candidati correnti: ricerca con {k} candidati per frase")
+
+
+
+def assign_changed(similarity, fixed, mode="argmax", scene_order=None):
+    """
+    Assegna una scena alle sole frasi nuove o modificate di un riassunto,
+    mantenendo le scene già assegnate alle altre frasi.
+    
+    Nelle modalità ordinate le frasi da assegnare sono divise in tratti
+    consecutivi, e ogni tratto può usare solo le scene comprese, nell'ordine
+    temporale, tra quelle delle frasi mantenute che lo delimitano; nelle
+    modalità uniche le scene già assegnate sono escluse. Se per un tratto non
+    restano scene sufficienti, le sue frasi ricevono la scena più simile.
+    
+    Args:
+        similarity: Matrice di similarità (frasi da assegnare x scene), con
+            le righe nell'ordine delle frasi nel riassunto
+        fixed: Indice della scena di ogni frase del riassunto, -1 per le
+            frasi da assegnare
+        mode: Modalità di abbinamento, una di MATCH_MODES
+        scene_order: Chiavi di ordinamento temporale delle scene; se None si
+            usa l'ordine della lista
+    
+    Returns:
+        Array con l'indice della scena assegnata a ogni frase
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Modalità di abbinamento non valida: {mode}")
+    
+    similarity = np.asarray(similarity, dtype=np.float64)
+    assignment = np.asarray(fixed, dtype=int).copy()
+    changed = np.flatnonzero(assignment < 0)
+    num_scenes = similarity.shape[1]
+    
+    if len(changed) == 0 or num_scenes == 0:
+        return assignment
+    
+    rows = np.empty(len(assignment), dtype=int)
+    rows[changed] = np.arange(len(changed))
+    
+    scene_order = np.arange(num_scenes) if scene_order is None else np.asarray(scene_order)
+    scene_ranks = np.empty(num_scenes, dtype=int)
+    scene_ranks[np.argsort(scene_order, kind="stable")] = np.arange(num_scenes)
+    
+    ordered = mode in ("ordered", "ordered_unique")
+    unique = mode in ("unique", "ordered_unique")
+    
+    # Senza vincoli d'ordine le frasi da assegnare formano un unico tratto
+    if ordered:
+        blocks = np.split(changed, np.flatnonzero(np.diff(changed) > 1) + 1)
+    else:
+        blocks = [changed]
+    
+    for block in blocks:
+        allowed = np.ones(num_scenes, dtype=bool)
+        if unique:
+            allowed[assignment[assignment >= 0]] = False
+        
+        if ordered:
+            # Le frasi che delimitano un tratto hanno sempre una scena assegnata
+            if block[0] > 0:
+                previous_rank = scene_ranks[assignment[block[0] - 1]]
+                allowed &= scene_ranks > previous_rank if unique else scene_ranks >= previous_rank
+            if block[-1] + 1 < len(assignment):
+                next_rank = scene_ranks[assignment[block[-1] + 1]]
+                allowed &= scene_ranks < next_rank if unique else scene_ranks <= next_rank
+        
+        columns = np.flatnonzero(allowed)
+        block_mode = mode
+        if len(columns) < (len(block) if unique else 1):
+            logger.warning(f"Scene insufficienti per {len(block)} frasi modificate con i vincoli di {mode}: si usa la scena più simile")
+            columns = np.arange(num_scenes)
+            block_mode = "argmax"
+        
+        local = assign_scenes(similarity[rows[block]][:, columns], block_mode, scene_order=scene_order[columns])
+        assignment[block] = columns[local]
+    
+    return assignment
+
+def top_k_candidates(similarity, k):
+    """
+    Seleziona le k scene più simili per ogni frase.
+    
+    Args:
+        similarity: Matrice di similarità (frasi x scene)
+        k: Numero di candidati per frase
+    
+    Returns:
+        Coppia (indici, punteggi) di matrici (frasi x k)
+    """
+    num_scenes = similarity.shape[1]
+    if k >= num_scenes:
+        indices = np.tile(np.arange(num_scenes), (similarity.shape[0], 1))
+    else:
+        indices = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    
+    scores = np.take_along_axis(similarity, indices, axis=1)
+    return indices, scores
+
+
+def solve_unique_assignment(candidate_indices, candidate_scores):
+    """
+    Assegnazione uno a uno tra frasi e scene candidate che massimizza la
+    similarità totale, con l'algoritmo ungherese.
+    
+    Il problema è ridotto alle sole scene che compaiono tra i candidati di
+    almeno una frase; a ogni frase è affiancata una colonna fittizia, più
+    costosa di qualsiasi candidato, che rende il problema sempre risolvibile.
+    
+    Args:
+        candidate_indices: Indici delle scene candidate (frasi x k)
+        candidate_scores: Similarità delle scene candidate (frasi x k)
+    
+    Returns:
+        Array con l'indice della scena assegnata a ogni frase, -1 se la frase
+        non ha ricevuto nessuno dei suoi candidati
+    """
+    num_sentences = candidate_indices.shape[0]
+    columns, local_indices = np.unique(candidate_indices, return_inverse=True)
+    local_indices = local_indices.reshape(candidate_indices.shape)
+    
+    cost = np.full((num_sentences, len(columns) + num_sentences), _EXCLUDED_COST)
+    rows = np.repeat(np.arange(num_sentences), candidate_indices.shape[1])
+    cost[rows, local_indices.ravel()] = -candidate_scores.ravel()
+    cost[:, len(columns):] = cost[:, :len(columns)][cost[:, :len(columns)] < _EXCLUDED_COST].max() + 1.0
+    
+    assigned_columns = _hungarian(cost)
+    
+    assignment = np.full(num_sentences, -1, dtype=int)
+    real = assigned_columns < len(columns)
+    assignment[real] = columns[assigned_columns[real]]
+    return assignment
+
+
+def solve_ordered_assignment(candidate_indices, candidate_scores, scene_ranks, strict=False):
+    """
+    Assegnazione che rispetta l'ordine temporale: la scena di ogni frase non
+    precede quella della frase precedente (la segue strettamente se strict).
+    Risolta con programmazione dinamica sui candidati di ogni frase.
+    
+    Args:
+        candidate_indices: Indici delle scene candidate (frasi x k)
+        candidate_scores: Similarità delle scene candidate (frasi x k)
+        scene_ranks: Rango temporale di ogni scena
+        strict: Se True le scene devono essere tutte diverse
+    
+    Returns:
+        Array con l'indice della scena assegnata a ogni frase, o None se
+        nessuna sequenza di candidati rispetta l'ordine
+    """
+    num_sentences, k = candidate_indices.shape
+    ranks = scene_ranks[candidate_indices]
+    side = "left" if strict else "right"
+    
+    score = candidate_scores[0].copy()
+    backpointers = []
+    
+    for i in range(1, num_sentences):
+        # Miglior punteggio tra i candidati precedenti con rango compatibile:
+        # massimo cumulativo sui candidati precedenti ordinati per rango
+        order = np.argsort(ranks[i - 1], kind="stable")
+        previous_ranks = ranks[i - 1][order]
+        previous_scores = score[order]
+        
+        running_max = np.maximum.accumulate(previous_scores)
+        running_arg = np.maximum.accumulate(np.where(previous_scores == running_max, np.arange(k), 0))
+        
+        count = np.searchsorted(previous_ranks, ranks[i], side=side)
+        position = np.maximum(count - 1, 0)
+        
+        best_previous = np.where(count > 0, running_max[position], -np.inf)
+        backpointers.append(order[running_arg[position]])
+        score = best_previous + candidate_scores[i]
+    
+    if not np.isfinite(score).any():
+        return None
+    
+    # Ricostruisce la sequenza a ritroso
+    choice = int(np.argmax(score))
+    choices = [choice]
+    for backpointer in reversed(backpointers):
+        choice = int(backpointer[choice])
+        choices.append(choice)
+    choices.reverse()
+    
+    return candidate_indices[np.arange(num_sentences), choices]
+
+
+def _hungarian(cost):
+    """
+    Algoritmo ungherese (cammini aumentanti minimi con potenziali) per una
+    matrice di costo rettangolare con righe <= colonne. Il ciclo interno è
+    vettorializzato sulle colonne.
+    
+    Returns:
+        Array con la colonna assegnata a ogni riga
+    """
+    num_rows, num_columns = cost.shape
+    u = np.zeros(num_rows + 1)
+    v = np.zeros(num_columns + 1)
+    owner = np.zeros(num_columns + 1, dtype=int)  # riga (da 1) assegnata a ogni colonna, 0 se libera
+    way = np.zeros(num_columns + 1, dtype=int)
+    
+    for row in range(1, num_rows + 1):
+        owner[0] = row
+        column = 0
+        min_reduced = np.full(num_columns + 1, np.inf)
+        used = np.zeros(num_columns + 1, dtype=bool)
+        
+        while owner[column] != 0:
+            used[column] = True
+            current_row = owner[column]
+            free = ~used[1:]
+            
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+            improved = free & (reduced < min_reduced[1:])
+            min_reduced[1:][improved] = reduced[improved]
+            way[1:][improved] = column
+            
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            
+            used_columns = np.nonzero(used)[0]
+            u[owner[used_columns]] += delta
+            v[used_columns] -= delta
+            min_reduced[1:][free] -= delta
+            
+            column = next_column
+        
+        # Inverte il cammino aumentante
+        while column != 0:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+    
+    assignment = np.full(num_rows, -1, dtype=int)
+    assigned = np.nonzero(owner[1:])[0]
+    assignment[owner[1:][assigned] - 1] = assigned
+    return assignment
@@ -0,0 +1,260 @@
+import logging
+import numpy as np
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Backend dell'indice
+#   exact: confronto con tutte le scene, a blocchi di righe
+#   ivf: confronto con le sole scene dei gruppi (k-means) più vicini alla query
+#   auto: exact fino a IVF_MIN_SIZE scene, ivf oltre
+INDEX_BACKENDS = ("auto", "exact", "ivf")
+
+# Numero di scene oltre il quale il backend auto usa ivf
+IVF_MIN_SIZE = 50000
+
+# Righe confrontate insieme dal backend exact: la memoria della matrice dei
+# punteggi dipende da questo valore e non dal numero di scene
+EXACT_BLOCK_SIZE = 65536
+
+# Gruppi esplorati per ogni query dal backend ivf
+DEFAULT_NPROBE = 16
+
+# Iterazioni del k-means e scene campionate per gruppo durante l'addestramento
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+
+# Crescita dell'indice, rispetto alla dimensione di addestramento, oltre la
+# quale i gruppi vengono ricalcolati
+RETRAIN_GROWTH = 4
+
+class SceneIndex:
+    """
+    Indice degli embedding delle scene per la ricerca delle k scene più
+    simili (prodotto scalare, cioè similarità coseno per embedding
+    normalizzati) a un insieme di testi.
+    
+    Il backend exact confronta ogni query con tutte le scene, un blocco di
+    righe alla volta, senza costruire la matrice completa testi x scene. Il
+    backend ivf divide le scene in gruppi con un k-means sferico e confronta
+    ogni query solo con le scene dei nprobe gruppi con il centroide più
+    vicino: il risultato è approssimato, con un costo proporzionale a una
+    frazione delle scene. Le scene possono provenire da video diversi: gli
+    ID sono valori qualsiasi scelti dal chiamante (es. coppie job, scena).
+    """
+    
+    def __init__(self, backend="auto", nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+        """
+        Inizializza l'indice.
+        
+        Args:
+            backend: Backend di ricerca, uno di INDEX_BACKENDS
+            nlist: Numero di gruppi del backend ivf (default: radice quadrata
+                del numero di scene)
+            nprobe: Gruppi esplorati per ogni query dal backend ivf
+            seed: Seme del k-means, per risultati riproducibili
+        """
+        if backend not in INDEX_BACKENDS:
+            raise ValueError(f"Backend dell'indice non valido: {backend}")
+        
+        self.backend = backend
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        
+        self._ids = []
+        self._vectors = None
+        self._size = 0
+        
+        # Stato del backend ivf
+        self._centroids = None
+        self._assignments = None
+        self._lists = None
+        self._trained_size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    @property
+    def ids(self):
+        return list(self._ids)
+    
+    @property
+    def active_backend(self):
+        """
+        Backend effettivamente usato dalle query.
+        """
+        if self.backend == "auto":
+            return "ivf" if self._size >= IVF_MIN_SIZE else "exact"
+        return self.backend
+    
+    def add(self, ids, embeddings):
+        """
+        Aggiunge scene all'indice.
+        
+        Args:
+            ids: ID delle scene
+            embeddings: Matrice (len(ids) x dim) degli embedding delle scene
+        """
+        ids = list(ids)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(ids):
+            raise ValueError(f"Attesi {len(ids)} embedding, ricevuta una matrice {embeddings.shape}")
+        if not ids:
+            return
+        
+        if self._vectors is None:
+            self._vectors = np.zeros((max(1024, len(ids)), embeddings.shape[1]), dtype=np.float32)
+        elif embeddings.shape[1] != self._vectors.shape[1]:
+            raise ValueError(f"Dimensione degli embedding non valida: {embeddings.shape[1]} invece di {self._vectors.shape[1]}")
+        
+        # La capacità raddoppia, così che aggiunte ripetute non copino ogni volta l'intero indice
+        required = self._size + len(ids)
+        if required > self._vectors.shape[0]:
+            vectors = np.zeros((max(required, self._vectors.shape[0] * 2), self._vectors.shape[1]), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+        
+        self._vectors[self._size:required] = embeddings
+        self._ids.extend(ids)
+        start = self._size
+        self._size = required
+        
+        # Le nuove scene entrano nei gruppi esistenti finché l'indice non
+        # cresce abbastanza da richiedere un nuovo addestramento
+        if self._centroids is not None:
+            if self._size > self._trained_size * RETRAIN_GROWTH:
+                self._centroids = None
+            else:
+                new_assignments = self._nearest_centroid(self._vectors[start:required])
+                self._assignments = np.concatenate([self._assignments, new_assignments])
+                self._lists = None
+    
+    def query(self, text_embeddings, k):
+        """
+        Cerca le k scene più simili a ogni testo.
+        
+        Args:
+            text_embeddings: Matrice (testi x dim) degli embedding dei testi
+            k: Numero di scene restituite per ogni testo
+        
+        Returns:
+            Coppia (ids, scores): per ogni testo la lista degli ID delle scene
+            e la matrice (testi x min(k, scene)) dei punteggi, in ordine di
+            similarità decrescente
+        """
+        queries = np.atleast_2d(np.asarray(text_embeddings, dtype=np.float32))
+        k = min(k, self._size)
+        if k <= 0:
+            return [[] for _ in range(len(queries))], np.zeros((len(queries), 0), dtype=np.float32)
+        
+        if self.active_backend == "ivf":
+            positions, scores = self._query_ivf(queries, k)
+        else:
+            positions, scores = self._query_exact(queries, k)
+        
+        ids = [[self._ids[position] for position in row] for row in positions]
+        return ids, scores
+    
+    def train(self):
+        """
+        Calcola i gruppi del backend ivf (chiamato automaticamente dalla
+        prima query ivf).
+        """
+        if self._size == 0:
+            return
+        
+        nlist = self.nlist or int(np.sqrt(self._size))
+        nlist = max(1, min(nlist, self._size))
+        vectors = self._vectors[:self._size]
+        rng = np.random.default_rng(self.seed)
+        
+        # Il k-means usa un campione delle scene; tutte vengono poi assegnate ai gruppi
+        sample_size = min(self._size, nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = vectors[rng.choice(self._size, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            
+            # I gruppi rimasti vuoti conservano il centroide precedente
+            filled = counts > 0
+            centroids[filled] = _normalize(sums[filled])
+        
+        self._centroids = centroids
+        self._assignments = self._nearest_centroid(vectors)
+        self._lists = None
+        self._trained_size = self._size
+        logger.info(f"Indice delle scene addestrato: {self._size} scene in {nlist} gruppi")
+    
+    def _query_exact(self, queries, k, rows=None):
+        # Migliori k per blocco di righe, uniti ai migliori dei blocchi precedenti
+        best_positions = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        total = self._size if rows is None else len(rows)
+        
+        for start in range(0, total, EXACT_BLOCK_SIZE):
+            if rows is None:
+                block_positions = np.arange(start, min(total, start + EXACT_BLOCK_SIZE))
+                block = self._vectors[start:start + len(block_positions)]
+            else:
+                block_positions = rows[start:start + EXACT_BLOCK_SIZE]
+                block = self._vectors[block_positions]
+            
+            scores = queries @ block.T
+            top = _top_k(scores, k)
+            best_positions = np.concatenate([best_positions, block_positions[top]], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            
+            top = _top_k(best_scores, k)
+            best_positions = np.take_along_axis(best_positions, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+        
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_positions, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+    
+    def _query_ivf(self, queries, k):
+        if self._centroids is None:
+            self.train()
+        if self._lists is None:
+            order = np.argsort(self._assignments, kind="stable")
+            bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._centroids))]
+        
+        nprobe = max(1, min(self.nprobe, len(self._centroids)))
+        probes = _top_k(queries @ self._centroids.T, nprobe)
+        
+        positions = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.zeros((len(queries), k), dtype=np.float32)
+        for i, query in enumerate(queries):
+            rows = np.concatenate([self._lists[probe] for probe in probes[i]])
+            
+            # Gruppi troppo piccoli per k risultati: ricerca su tutte le scene
+            if len(rows) < k:
+                rows = None
+            
+            row_positions, row_scores = self._query_exact(query[np.newaxis], k, rows=rows)
+            positions[i] = row_positions[0]
+            scores[i] = row_scores[0]
+        
+        return positions, scores
+    
+    def _nearest_centroid(self, vectors):
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+
+def _top_k(scores, k):
+    # Indici (non ordinati) dei k punteggi più alti di ogni riga
+    if k >= scores.shape[1]:
+        return np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
@@ -7,9 +7,24 @@ from unittest.mock import patch, MagicMock
 # Aggiungi la directory del backend al path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from video_segmenter import VideoSegmenter
+from video_segmenter import VideoSegmenter, ThumbnailCollector, choose_thumbnail, plan_chunk_ranges, merge_chunk_cuts
 from ai_models_detailed import CaptionGeneratorDetailed, CLIPModelIntegration, SemanticMatchingEngine
 from video_processing import MontageCompiler, VideoProcessingPipeline
+from embedding_store import EmbeddingStore
+from job_queue import JobQueue, run_job, worker_identity
+from montage_renderer import plan_smart_cut, copy_end
+from proxy_video import ProxyGenerator
+from chunked_upload import ChunkedUploadManager
+from video_index import VideoIndex, save_stream_with_hash, video_id_of
+from scene_assignment import assign_scenes, assign_changed
+from scene_index import SceneIndex
+from scene_catalog import SceneCatalog
+from tiered_cache import TieredCache
+from progress import ProgressTracker
+from model_server import ModelServer, ModelClient
+from pipeline import Pipeline, PipelineStage
+from parallel_executor import ParallelExecutor, worker_state
+from metrics import MetricsRegistry, timed
 
 class TestVideoSegmenter(unittest.TestCase):
     def setUp(self):
@@ -20,8 +35,7 @@ class TestVideoSegmenter(unittest.TestCase):
     @patch('scenedetect.VideoManager')
     @patch('scenedetect.SceneManager')
     @patch('scenedetect.StatsManager')
-    @patch('scenedetect.scene_manager.save_images')
-    def test_detect_scenes(self, mock_save_images, mock_stats_manager, mock_scene_manager, mock_video_manager):
+    def test_detect_scenes(self, mock_stats_manager, mock_scene_manager, mock_video_manager):
         # Configura i mock
         mock_video_instance = MagicMock()
         mock_video_manager.return_value = mock_video_instance
@@ -33,10 +47,11 @@ class TestVideoSegmenter(unittest.TestCase):
         mock_scene_manager.return_value = mock_scene_instance
         
         # Configura il mock per restituire una lista di scene
-        mock_scene = MagicMock()
-        mock_scene[0].get_seconds.return_value = 0
-        mock_scene[1].get_seconds.return_value = 10
-        mock_scene_instance.get_scene_list.return_value = [mock_scene]
+        mock_start = MagicMock()
+        mock_start.get_seconds.return_value = 0
+        mock_end = MagicMock()
+        mock_end.get_seconds.return_value = 10
+        mock_scene_instance.get_scene_list.return_value = [(mock_start, mock_end)]
         
         # Esegui il test
         scenes = self.segmenter.detect_scenes("test_video.mp4", "test_job", threshold=30.0)
@@ -47,6 +62,117 @@ class TestVideoSegmenter(unittest.TestCase):
         self.assertEqual(scenes[0]["end_time"], 10)
         self.assertEqual(scenes[0]["duration"], 10)
     
+    def test_iter_scenes(self):
+        import cv2
+        import numpy as np
+        
+        # Video sintetico con tre scene di trama diversa
+        video_path = os.path.join(self.temp_folder, "three_scenes.mp4")
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), 24, (160, 120))
+        rng = np.random.default_rng(0)
+        for _ in range(3):
+            texture = cv2.resize(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8), (160, 120),
+                                 interpolation=cv2.INTER_NEAREST)
+            for frame_num in range(36):
+                writer.write(np.roll(texture, frame_num, axis=1))
+        writer.release()
+        
+        # Le scene restituite una alla volta coincidono con quelle di detect_scenes
+        scenes = list(self.segmenter.iter_scenes(video_path, "iter_job"))
+        self.assertEqual(scenes, self.segmenter.detect_scenes(video_path, "iter_job"))
+        self.assertEqual([scene["id"] for scene in scenes], [1, 2, 3])
+        self.assertAlmostEqual(scenes[1]["start_time"], 1.5)
+        self.assertTrue(all(os.path.exists(scene["thumbnail"]) for scene in scenes))
+        
+        # Il chiamante può interrompere l'iterazione prima della fine del video
+        iterator = self.segmenter.iter_scenes(video_path, "iter_job_closed")
+        self.assertEqual(next(iterator)["id"], 1)
+        iterator.close()
+    
+    def test_iter_scenes_parallel(self):
+        import cv2
+        import numpy as np
+        
+        # Video sintetico con sei scene di trama diversa, diviso in più intervalli
+        video_path = os.path.join(self.temp_folder, "six_scenes.mp4")
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), 24, (160, 120))
+        rng = np.random.default_rng(1)
+        for _ in range(6):
+            texture = cv2.resize(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8), (160, 120),
+                                 interpolation=cv2.INTER_NEAREST)
+            for frame_num in range(36):
+                writer.write(np.roll(texture, frame_num, axis=1))
+        writer.release()
+        
+        # Le scene restituite man mano che gli intervalli terminano sono quelle di un unico passaggio,
+        # anche con i tagli sui bordi degli intervalli e una sovrapposizione più corta di min_scene_len
+        scenes = list(self.segmenter.iter_scenes_parallel(video_path, "parallel_job", num_workers=3,
+                                                          overlap_seconds=0.5, min_chunk_seconds=1.0))
+        single = self.segmenter.detect_scenes(video_path, "single_job")
+        self.assertEqual([scene["id"] for scene in scenes], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([scene["start_time"] for scene in scenes], [scene["start_time"] for scene in single])
+        
+        # Restano solo i thumbnail delle scene, senza candidati scartati
+        thumbnails_dir = os.path.join(self.temp_folder, "parallel_job_thumbnails")
+        self.assertEqual(sorted(os.listdir(thumbnails_dir)), [f"{i:03d}.jpg" for i in range(1, 7)])
+    
+    def test_thumbnail_collector(self):
+        import numpy as np
+        
+        chosen = []
+        collector = ThumbnailCollector(
+            lambda scene_number, start_frame, end_frame, sample: chosen.append((scene_number, sample[0])),
+            buffer_size=4, min_stride=1
+        )
+        
+        # Frame 5 è l'unico con dettagli (nitido); i frame 100-199 sono uniformi
+        for frame_num in range(200):
+            frame = np.zeros((8, 8, 3), dtype=np.uint8)
+            if frame_num == 5:
+                frame[::2, ::2] = 255
+            collector.add_frame(frame_num, frame)
+            
+            # Il buffer resta limitato qualunque sia la durata della scena
+            self.assertLessEqual(len(collector._samples), 4)
+            
+            if frame_num == 100:
+                collector.close_scene(100)
+        collector.finish()
+        
+        # Il frame nitido della prima scena è vicino al bordo e viene escluso:
+        # il thumbnail di ogni scena cade nella sua metà centrale
+        self.assertEqual([number for number, _ in chosen], [1, 2])
+        self.assertTrue(25 <= chosen[0][1] <= 75)
+        self.assertTrue(125 <= chosen[1][1] <= 175)
+        
+        # Tra più candidati nella metà centrale vince il più nitido
+        self.assertEqual(choose_thumbnail([(40, 1.0, None), (50, 9.0, None), (60, 3.0, None)], 0, 100)[0], 50)
+        self.assertEqual(choose_thumbnail([(5, 9.0, None), (40, 1.0, None)], 0, 100)[0], 40)
+    
+    def test_plan_chunk_ranges(self):
+        ranges = plan_chunk_ranges(1000, 4, overlap_frames=10)
+        
+        # Gli intervalli di competenza coprono tutto il video senza sovrapporsi
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], 1000)
+        for previous, current in zip(ranges, ranges[1:]):
+            self.assertEqual(previous[1], current[0])
+            self.assertEqual(current[2], current[0] - 10)
+        
+        # Un video corto non viene diviso in intervalli più piccoli del minimo
+        self.assertEqual(len(plan_chunk_ranges(100, 8, overlap_frames=10, min_chunk_frames=60)), 1)
+    
+    def test_merge_chunk_cuts(self):
+        ranges = [(0, 100, 0, 110), (100, 200, 90, 200)]
+        
+        # 105 è visto da entrambi gli intervalli ma appartiene solo al secondo;
+        # 95 cade nella sovrapposizione letta dal secondo ma appartiene al primo;
+        # 108 è troppo vicino a 105 e viene scartato come farebbe il detector
+        chunk_cuts = [[40, 105], [95, 105, 108, 150]]
+        
+        self.assertEqual(merge_chunk_cuts(ranges, chunk_cuts, min_gap_frames=15), [40, 105, 150])
+    
     def tearDown(self):
         # Pulisci i file temporanei
         import shutil
@@ -90,6 +216,41 @@ class TestCaptionGenerator(unittest.TestCase):
         self.assertIsInstance(caption, str)
         self.assertTrue(len(caption) > 0)
     
+    @patch('transformers.AutoTokenizer.from_pretrained')
+    @patch('transformers.AutoModelForSeq2SeqLM.from_pretrained')
+    def test_generate_captions_batch(self, mock_model, mock_tokenizer):
+        image_paths = []
+        for i in range(5):
+            image_path = os.path.join(self.temp_folder, f"{i+1:03d}.jpg")
+            with open(image_path, 'w') as f:
+                f.write("test image")
+            image_paths.append(image_path)
+        
+        # Un nome di file senza numero di scena non interrompe il batch
+        image_paths[2] = os.path.join(self.temp_folder, "scena.jpg")
+        
+        batches = []
+        original = self.caption_generator._generate_batch
+        
+        def generate_batch(paths):
+            batches.append(len(paths))
+            return original(paths)
+        
+        progress = []
+        with patch.object(self.caption_generator, "_generate_batch", side_effect=generate_batch), \
+                patch('PIL.Image.open') as image_open:
+            captions = self.caption_generator.generate_captions_batch(
+                image_paths, batch_size=2, progress_callback=lambda *args: progress.append(args[2]["done"])
+            )
+        
+        # Una chiamata al modello per batch; senza un modello che le usi le immagini non vengono lette
+        self.assertEqual(batches, [2, 2, 1])
+        image_open.assert_not_called()
+        self.assertEqual(len(captions), 5)
+        self.assertEqual(captions[0], self.caption_generator.generate_caption(image_paths[0]))
+        self.assertEqual(captions[2], "Scena non identificata")
+        self.assertEqual(progress[-1], 5)
+    
     def tearDown(self):
         # Pulisci i file temporanei
         import shutil
@@ -154,6 +315,90 @@ class TestCLIPIntegration(unittest.TestCase):
         for match in best_matches:
             self.assertTrue(0 <= match < 3)
     
+    def test_find_best_match_batched(self):
+        import numpy as np
+        
+        image_paths = [os.path.join(self.temp_folder, f"{i+1}.jpg") for i in range(3)]
+        texts = ["Prima frase", "Seconda frase"]
+        
+        # Embedding simulati: ogni testo è allineato a una sola immagine
+        image_features = np.eye(3, dtype=np.float32)
+        text_features = np.array([[0, 0, 1], [1, 0, 0]], dtype=np.float32)
+        
+        with patch.object(self.clip_model, 'encode_images', return_value=image_features) as mock_images, \
+             patch.object(self.clip_model, 'encode_texts', return_value=text_features) as mock_texts:
+            similarity_matrix, best_matches = self.clip_model.find_best_match(image_paths, texts)
+        
+        # Immagini e testi vengono codificati una sola volta
+        mock_images.assert_called_once()
+        mock_texts.assert_called_once_with(texts)
+        
+        self.assertEqual(similarity_matrix.shape, (2, 3))
+        self.assertEqual(list(best_matches), [2, 0])
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = "/tmp/test_movie_montage"
+        self.store_folder = os.path.join(self.temp_folder, "embeddings")
+        os.makedirs(self.temp_folder, exist_ok=True)
+        self.store = EmbeddingStore(self.store_folder, initial_capacity=2)
+    
+    def test_put_and_get(self):
+        import numpy as np
+        
+        vectors = np.random.rand(5, 4).astype(np.float32)
+        keys = [f"hash{i}" for i in range(5)]
+        
+        # La capacità iniziale è di 2 righe: l'array deve crescere
+        self.store.put_many("ViT-B/32", keys, vectors)
+        
+        # Un nuovo archivio sulla stessa cartella legge gli embedding persistiti
+        reopened = EmbeddingStore(self.store_folder)
+        found = reopened.get_many("ViT-B/32", keys + ["sconosciuto"])
+        
+        self.assertEqual(set(found.keys()), set(keys))
+        for i, key in enumerate(keys):
+            np.testing.assert_allclose(found[key], vectors[i], atol=1e-3)
+        
+        # Gli embedding sono separati per modello
+        self.assertEqual(reopened.get_many("RN50", keys), {})
+        self.assertEqual(reopened.count("ViT-B/32"), 5)
+        
+        # Le righe aggiunte da un'altra istanza (es. un altro processo), oltre
+        # la capacità già aperta, sono visibili senza rileggere l'intero indice
+        more = np.random.rand(10, 4).astype(np.float32)
+        self.store.put_many("ViT-B/32", [f"altro{i}" for i in range(10)], more)
+        found = reopened.get_many("ViT-B/32", ["altro9", "hash0"])
+        np.testing.assert_allclose(found["altro9"], more[9], atol=1e-3)
+        self.assertEqual(reopened.count("ViT-B/32"), 15)
+    
+    def test_encode_images_uses_store(self):
+        import numpy as np
+        
+        image_paths = []
+        for i in range(2):
+            path = os.path.join(self.temp_folder, f"{i+1}.jpg")
+            with open(path, 'w') as f:
+                f.write(f"test image {i+1}")
+            image_paths.append(path)
+        
+        clip_model = CLIPModelIntegration(embedding_store=self.store)
+        encoded = (np.array([[1, 0], [0, 1]], dtype=np.float32), [True, True])
+        
+        with patch.object(clip_model, '_encode_image_files', return_value=encoded) as mock_encode:
+            first = clip_model.encode_images(image_paths)
+            second = clip_model.encode_images(image_paths)
+        
+        # La seconda chiamata recupera tutti gli embedding dall'archivio
+        mock_encode.assert_called_once()
+        np.testing.assert_allclose(first, second, atol=1e-3)
+    
     def tearDown(self):
         # Pulisci i file temporanei
         import shutil
@@ -275,15 +520,118 @@ class TestMontageCompiler(unittest.TestCase):
             {"id": 3, "text": "Terza frase.", "matchedSceneId": 3}
         ]
         
+        def render(video_path, segments, output_path):
+            open(output_path, 'w').close()
+        
         # Esegui il test
-        output_path = self.montage_compiler.compile_montage("test_video.mp4", scenes, summary_segments, "test_job")
+        with patch.object(self.montage_compiler.renderer, "is_available", return_value=True), \
+                patch.object(self.montage_compiler.renderer, "render", side_effect=render) as mock_render:
+            output_path = self.montage_compiler.compile_montage("test_video.mp4", scenes, summary_segments, "test_job")
         
         # Verifica i risultati
         self.assertTrue(os.path.exists(output_path))
+        mock_render.assert_called_once_with("test_video.mp4", [(15, 25), (0, 10), (30, 40)], output_path)
         
         # Verifica che sia stato creato anche il file di descrizione
         description_path = os.path.join(self.output_folder, "test_job_montage_description.txt")
         self.assertTrue(os.path.exists(description_path))
+        
+        # Un video non leggibile non produce un montaggio
+        self.assertIsNone(self.montage_compiler.compile_montage("test_video.mp4", scenes, summary_segments, "test_job"))
+    
+    def test_generate_endpoint(self):
+        with patch.dict(os.environ, {"JOB_WORKERS": "0"}):
+            import main
+        
+        video_path = os.path.join(self.output_folder, "job1.mp4")
+        open(video_path, "wb").close()
+        scenes = [{"id": 1, "start_time": 0.0, "end_time": 5.0}]
+        summary_segments = [{"id": 1, "text": "Un uomo cammina.", "matchedSceneId": 1}]
+        with open(os.path.join(self.output_folder, "job1_results.json"), "w") as f:
+            json.dump({"scenes": scenes, "summary_segments": summary_segments}, f)
+        
+        with patch.object(main, "TEMP_FOLDER", self.output_folder), \
+                patch.dict(main.app.config, {"UPLOAD_FOLDER": self.output_folder}), \
+                patch.object(main.montage_compiler, "compile_montage") as compile_montage:
+            client = main.app.test_client()
+            
+            # Il montaggio finale viene renderizzato dal video originale con MontageCompiler
+            compile_montage.return_value = os.path.join(self.output_folder, "job1_montage.mp4")
+            response = client.post("/api/generate/job1")
+            self.assertEqual(response.status_code, 200)
+            compile_montage.assert_called_once_with(video_path, scenes, summary_segments, "job1")
+            
+            # Un montaggio non compilato è un errore, non un percorso da scaricare
+            compile_montage.return_value = None
+            self.assertEqual(client.post("/api/generate/job1").status_code, 500)
+    
+    def test_plan_smart_cut(self):
+        keyframes = [0.0, 2.0, 4.0, 6.0, 8.0]
+        
+        # Testa e coda ricodificate, parte centrale copiata tra i keyframe
+        parts = plan_smart_cut(1.5, 6.5, keyframes)
+        self.assertEqual(parts, [(1.5, 2.0, False), (2.0, 6.0, True), (6.0, 6.5, False)])
+        
+        # Scena allineata ai keyframe: copiata interamente
+        self.assertEqual(plan_smart_cut(2.0, 6.0, keyframes), [(2.0, 6.0, True)])
+        
+        # Nessun intervallo tra due keyframe: ricodifica completa
+        self.assertEqual(plan_smart_cut(2.5, 3.5, keyframes), [(2.5, 3.5, False)])
+        
+        # La fine di una parte copiata viene anticipata del ritardo di decodifica del keyframe
+        decode_delays = [0.0, 0.08, 0.08, 0.08, 0.08]
+        self.assertAlmostEqual(copy_end(6.0, keyframes, decode_delays), 5.92, places=2)
+        self.assertEqual(copy_end(6.5, keyframes, decode_delays), 6.5)
+    
+    def test_draft_montage_from_proxy(self):
+        import shutil
+        import subprocess
+        if not self.montage_compiler.renderer.is_available():
+            self.skipTest("ffmpeg non disponibile")
+        
+        # Video sintetico a 720p con audio
+        video_path = os.path.join(self.temp_folder, "video.mp4")
+        subprocess.run([
+            shutil.which("ffmpeg"), "-y", "-v", "error",
+            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=25:duration=6",
+            "-f", "lavfi", "-i", "sine=duration=6",
+            "-c:v", "libx264", "-g", "250", "-c:a", "aac", "-shortest", video_path
+        ], check=True)
+        
+        proxy_generator = ProxyGenerator(os.path.join(self.temp_folder, "proxies"))
+        self.assertEqual(proxy_generator.status("test_job"), "missing")
+        proxy_path = proxy_generator.generate("test_job", video_path)
+        self.assertEqual(proxy_generator.status("test_job"), "ready")
+        
+        def probe(path, entries):
+            return subprocess.run(
+                [shutil.which("ffprobe"), "-v", "error", "-select_streams", "v:0", "-show_entries", entries,
+                 "-of", "csv=p=0", path],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        
+        # Proxy a 360p con la stessa durata e un keyframe al secondo
+        self.assertEqual(probe(proxy_path, "stream=height"), "360")
+        self.assertAlmostEqual(float(probe(proxy_path, "format=duration")), 6.0, delta=0.1)
+        _, keyframes, _ = self.montage_compiler.renderer._probe(proxy_path)
+        self.assertEqual(len(keyframes), 6)
+        
+        scenes = [
+            {"id": 1, "start_time": 0.5, "end_time": 2.5, "caption": "Didascalia 1"},
+            {"id": 2, "start_time": 3.0, "end_time": 5.5, "caption": "Didascalia 2"}
+        ]
+        summary_segments = [
+            {"id": 1, "text": "Prima frase.", "matchedSceneId": 2},
+            {"id": 2, "text": "Seconda frase.", "matchedSceneId": 1}
+        ]
+        output_path = self.montage_compiler.compile_montage(proxy_path, scenes, summary_segments, "test_job", draft=True)
+        
+        # La bozza non sovrascrive il montaggio finale
+        self.assertEqual(output_path, os.path.join(self.output_folder, "test_job_draft.mp4"))
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, "test_job_montage.mp4")))
+        
+        # Le parti copiate tra i keyframe del proxy possono includere qualche frame in più
+        self.assertAlmostEqual(float(probe(output_path, "format=duration")), 4.5, delta=0.3)
     
     def tearDown(self):
         # Pulisci i file temporanei
@@ -338,5 +686,1064 @@ class TestVideoProcessingPipeline(unittest.TestCase):
         if os.path.exists("/tmp/test_movie_montage"):
             shutil.rmtree("/tmp/test_movie_montage")
 
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = "/tmp/test_movie_montage"
+        os.makedirs(self.temp_folder, exist_ok=True)
+        self.queue = JobQueue(os.path.join(self.temp_folder, "jobs.db"))
+    
+    def test_enqueue_and_claim(self):
+        status = self.queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        
+        self.assertEqual(status["state"], "queued")
+        self.assertEqual(set(status["stages"].values()), {"pending"})
+        
+        # Un job già in coda non viene duplicato
+        self.queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        
+        job = self.queue.claim_next("worker1")
+        self.assertEqual(job["job_id"], "job1")
+        self.assertEqual(job["payload"]["video_path"], "video.mp4")
+        self.assertEqual(self.queue.get_status("job1")["state"], "running")
+        self.assertIsNone(self.queue.claim_next("worker1"))
+    
+    def test_run_job(self):
+        self.queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        job = self.queue.claim_next("worker1")
+        
+        # Il processore notifica l'avanzamento degli stage tramite la callback
+        def process_video(video_path, summary, job_id, progress_callback=None, match_mode=None):
+            progress_callback("segmentation", "running")
+            progress_callback("segmentation", "done")
+            progress_callback("captions", "running")
+            return {"error": "Errore simulato"}
+        
+        processor = MagicMock()
+        processor.process_video.side_effect = process_video
+        
+        run_job(self.queue, processor, job)
+        
+        status = self.queue.get_status("job1")
+        self.assertEqual(status["state"], "failed")
+        self.assertEqual(status["error"], "Errore simulato")
+        self.assertEqual(status["stages"], {"segmentation": "done", "captions": "failed", "matching": "pending"})
+        
+        # Un job terminato può essere accodato di nuovo
+        self.assertEqual(self.queue.enqueue("job1", job["payload"])["state"], "queued")
+    
+    def test_events(self):
+        self.queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        job = self.queue.claim_next("worker1")
+        
+        def process_video(video_path, summary, job_id, progress_callback=None, match_mode=None):
+            progress_callback("segmentation", "running")
+            progress_callback("segmentation", "progress", {"done": 50, "total": 100})
+            progress_callback("segmentation", "progress", {"done": 100, "total": 100})
+            progress_callback("segmentation", "done", {"scenes_found": 3})
+            return {"scenes": [], "summary_segments": []}
+        
+        processor = MagicMock()
+        processor.process_video.side_effect = process_video
+        run_job(self.queue, processor, job)
+        
+        events = self.queue.get_events("job1")
+        self.assertEqual(
+            [(event["stage"], event["state"]) for event in events],
+            [("job", "queued"), ("job", "running"), ("segmentation", "running"),
+             ("segmentation", "progress"), ("segmentation", "progress"),
+             ("segmentation", "done"), ("job", "done")]
+        )
+        self.assertEqual(events[5]["details"], {"scenes_found": 3})
+        
+        # Gli eventi di avanzamento non cambiano lo stato dello stage
+        self.assertEqual(self.queue.get_status("job1")["stages"]["segmentation"], "done")
+        self.assertEqual(self.queue.get_progress("job1"), {"segmentation": {"done": 100, "total": 100}})
+        
+        # Un client che si riconnette riceve solo gli eventi successivi
+        after = self.queue.get_events("job1", after_id=events[4]["id"])
+        self.assertEqual([event["id"] for event in after], [event["id"] for event in events[5:]])
+    
+    def test_worker_killed(self):
+        import time
+        import signal
+        import multiprocessing
+        
+        self.queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        context = multiprocessing.get_context("fork")
+        started = context.Event()
+        
+        def worker(db_path):
+            # Worker che si blocca a metà del job, finché non viene terminato
+            queue = JobQueue(db_path)
+            job = queue.claim_next(worker_identity())
+            
+            def process_video(video_path, summary, job_id, progress_callback=None, match_mode=None):
+                progress_callback("segmentation", "running")
+                started.set()
+                time.sleep(60)
+            
+            processor = MagicMock()
+            processor.process_video.side_effect = process_video
+            run_job(queue, processor, job)
+        
+        process = context.Process(target=worker, args=(self.queue.db_path,))
+        process.start()
+        self.assertTrue(started.wait(10))
+        self.assertEqual(self.queue.get_status("job1")["stages"]["segmentation"], "running")
+        
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+        
+        # Il job del worker terminato viene rimesso in coda e prelevato da un altro worker
+        job = self.queue.claim_next("worker2")
+        self.assertEqual(job["job_id"], "job1")
+        status = self.queue.get_status("job1")
+        self.assertEqual(status["state"], "running")
+        self.assertEqual(status["attempts"], 2)
+        self.assertEqual(set(status["stages"].values()), {"pending"})
+        
+        requeued = [event for event in self.queue.get_events("job1") if event["details"].get("requeued")]
+        self.assertEqual(requeued[0]["details"]["reason"], "worker terminato")
+    
+    def test_lease_expired(self):
+        import time
+        
+        queue = JobQueue(self.queue.db_path, lease_timeout=0.2, max_attempts=2)
+        queue.enqueue("job1", {"video_path": "video.mp4", "summary": "Riassunto."})
+        
+        # Worker di un altro host: il PID non è verificabile, vale il lease
+        job = queue.claim_next("altro-host:1")
+        time.sleep(0.1)
+        self.assertTrue(queue.heartbeat("job1", job["worker"]))
+        time.sleep(0.15)
+        self.assertIsNone(queue.claim_next("worker2"))
+        
+        # Senza heartbeat il lease scade e il job passa a un altro worker
+        time.sleep(0.3)
+        self.assertEqual(queue.claim_next("worker2")["job_id"], "job1")
+        self.assertFalse(queue.heartbeat("job1", job["worker"]))
+        
+        # Superato max_attempts il job viene segnato come fallito
+        time.sleep(0.3)
+        self.assertIsNone(queue.claim_next("worker3"))
+        status = queue.get_status("job1")
+        self.assertEqual(status["state"], "failed")
+        self.assertIn("lease scaduto", status["error"])
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+class TestProgressTracker(unittest.TestCase):
+    def test_throttle_and_eta(self):
+        notifications = []
+        tracker = ProgressTracker(
+            lambda stage, state, details: notifications.append((stage, state, details)),
+            "captions", total=4, unit="captions", min_interval=60
+        )
+        
+        # Entro min_interval viene notificato solo il primo aggiornamento e quello finale
+        for _ in range(4):
+            tracker.advance()
+        
+        self.assertEqual([details["done"] for _, _, details in notifications], [1, 4])
+        self.assertEqual(notifications[0][:2], ("captions", "progress"))
+        self.assertEqual(notifications[0][2]["percent"], 25.0)
+        self.assertIsNotNone(notifications[0][2]["eta_seconds"])
+        self.assertEqual(notifications[-1][2]["eta_seconds"], 0.0)
+        
+        # Senza totale non si stimano percentuale e tempo residuo
+        tracker = ProgressTracker(lambda *args: notifications.append(args), "segmentation")
+        tracker.update(10, scenes_found=2)
+        self.assertIsNone(notifications[-1][2]["eta_seconds"])
+        self.assertEqual(notifications[-1][2]["scenes_found"], 2)
+
+
+class TestPipeline(unittest.TestCase):
+    def test_ordered_results_and_metrics(self):
+        import time
+        import random
+        
+        def double(items):
+            time.sleep(random.random() * 0.005 * len(items))
+            return [item * 2 for item in items]
+        
+        pipeline = Pipeline(range(50), [
+            PipelineStage("double", double, workers=4, batch_size=3, queue_size=4),
+            PipelineStage("increment", lambda items: [item + 1 for item in items], batch_size=8)
+        ])
+        
+        # Gli stage completano gli elementi in ordine sparso, i risultati seguono la sorgente
+        self.assertEqual(pipeline.run(), [item * 2 + 1 for item in range(50)])
+        
+        metrics = pipeline.metrics()
+        self.assertEqual(set(metrics), {"source", "double", "increment"})
+        self.assertEqual(metrics["double"]["items"], 50)
+        self.assertLessEqual(metrics["double"]["calls"], 50)
+        self.assertEqual(metrics["double"]["workers"], 4)
+    
+    def test_error_stops_pipeline(self):
+        closed = []
+        
+        def endless():
+            try:
+                item = 0
+                while True:
+                    yield item
+                    item += 1
+            finally:
+                closed.append(True)
+        
+        def fail_at_20(items):
+            if 20 in items:
+                raise RuntimeError("errore nello stage")
+            return items
+        
+        # L'errore viene rilanciato e la sorgente smette di produrre
+        pipeline = Pipeline(endless(), [PipelineStage("fail", fail_at_20, workers=2, queue_size=2)])
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+        self.assertEqual(closed, [True])
+        self.assertLess(pipeline.metrics()["source"]["items"], 100)
+    
+    def test_process_video_parallel_scenes(self):
+        import tempfile
+        from optimized_processing import ScalableVideoProcessor
+        
+        scenes = [{"id": i + 1, "start_time": i * 5.0, "end_time": i * 5.0 + 5, "thumbnail": ""} for i in range(3)]
+        
+        def caption(scenes, job_id, progress_callback=None):
+            return [dict(scene, caption="Scena.") for scene in scenes]
+        
+        with tempfile.TemporaryDirectory() as temp_folder:
+            processor = ScalableVideoProcessor(temp_folder, temp_folder, temp_folder, max_workers=4)
+            segmenter = processor.video_segmenter
+            
+            with patch.object(segmenter, "iter_scenes_parallel", return_value=iter(scenes)) as iter_scenes_parallel, \
+                    patch.object(segmenter, "iter_scenes") as iter_scenes, \
+                    patch.object(segmenter, "detect_scenes") as detect_scenes, \
+                    patch.object(processor.semantic_engine, "process_scenes", side_effect=caption), \
+                    patch.object(processor.semantic_engine.clip_model, "encode_images"), \
+                    patch.object(processor.semantic_engine, "find_matches", return_value=[2]), \
+                    patch.object(processor, "catalog_scenes"):
+                results = processor.process_video("video.mp4", "Un uomo cammina.", "job1")
+            
+            # La pipeline riceve le scene dal rilevamento su più processi, non da quello a processo singolo
+            iter_scenes_parallel.assert_called_once()
+            self.assertEqual(iter_scenes_parallel.call_args.kwargs["num_workers"], 4)
+            iter_scenes.assert_not_called()
+            detect_scenes.assert_not_called()
+            self.assertEqual([scene["caption"] for scene in results["scenes"]], ["Scena."] * 3)
+            self.assertEqual(results["summary_segments"][0]["matchedSceneId"], 3)
+
+
+class TestParallelExecutor(unittest.TestCase):
+    def test_modes_preserve_order(self):
+        items = list(range(37))
+        expected = [pow(item, 2, 1000) for item in items]
+        
+        for mode in ("inline", "thread", "process"):
+            with ParallelExecutor(mode, max_workers=2, chunk_size=5) as executor:
+                self.assertEqual(executor.map(pow, items, 2, 1000), expected, mode)
+        
+        # In modalità process la funzione deve essere serializzabile
+        with ParallelExecutor("process", max_workers=1) as executor:
+            with self.assertRaises(TypeError):
+                executor.map(lambda item: item, items)
+        
+        with self.assertRaises(ValueError):
+            ParallelExecutor("gpu")
+    
+    def test_initializer_runs_once(self):
+        calls = []
+        
+        def load_model(scale):
+            calls.append(scale)
+            return {"scale": scale}
+        
+        def scale(item):
+            return item * worker_state()["scale"]
+        
+        for mode in ("inline", "thread"):
+            calls.clear()
+            with ParallelExecutor(mode, max_workers=3, initializer=load_model, initargs=(10,)) as executor:
+                self.assertEqual(executor.map(scale, range(6)), [0, 10, 20, 30, 40, 50])
+                self.assertEqual(executor.map(scale, [7]), [70])
+            self.assertEqual(calls, [10], mode)
+    
+    def test_optimizer_modes(self):
+        import tempfile
+        from optimized_processing import PerformanceOptimizer
+        
+        with tempfile.TemporaryDirectory() as temp_folder:
+            optimizer = PerformanceOptimizer(temp_folder, max_workers=2, executor_mode="inline")
+            try:
+                self.assertEqual(optimizer.process_in_parallel([1, 2, 3], lambda item, offset: item + offset, 1), [2, 3, 4])
+                self.assertEqual(optimizer.process_in_parallel([3, 4], divmod, 2, mode="process"), [(1, 1), (2, 0)])
+                self.assertEqual(set(optimizer._executors), {"inline", "process"})
+            finally:
+                optimizer.shutdown()
+
+class TestBatchProcessing(unittest.TestCase):
+    def test_iter_batch_process_bounded(self):
+        import time
+        import tempfile
+        import threading
+        from optimized_processing import PerformanceOptimizer
+        
+        loaded = []
+        processed = []
+        in_flight = []
+        
+        def frames():
+            for index in range(23):
+                yield index
+        
+        def load(batch):
+            loaded.append(len(batch))
+            return [item * 10 for item in batch]
+        
+        def embed(batch):
+            time.sleep(0.01)
+            in_flight.append(len(loaded) - len(processed))
+            processed.append(len(batch))
+            return [item + 1 for item in batch]
+        
+        with tempfile.TemporaryDirectory() as temp_folder:
+            optimizer = PerformanceOptimizer(temp_folder, max_workers=2)
+            
+            batches = list(optimizer.iter_batch_process(frames(), embed, 5, load_func=load, max_in_flight=2))
+            self.assertEqual([len(batch) for batch in batches], [5, 5, 5, 5, 3])
+            self.assertEqual(sum(batches, []), [index * 10 + 1 for index in range(23)])
+            # Al più un batch letto in anticipo rispetto a quello in elaborazione
+            self.assertLessEqual(max(in_flight), 2)
+            
+            # Un errore nella sorgente viene rilanciato al consumatore
+            def broken():
+                yield 1
+                raise RuntimeError("frame non leggibile")
+            
+            with self.assertRaises(RuntimeError):
+                list(optimizer.iter_batch_process(broken(), embed, 1))
+            
+            # Interrompere il consumo ferma la lettura in anticipo
+            stream = optimizer.iter_batch_process(frames(), embed, 2)
+            next(stream)
+            stream.close()
+            self.assertFalse([thread for thread in threading.enumerate() if thread.name == "batch-prefetch"])
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics_dir = "/tmp/test_movie_montage/metrics"
+    
+    def test_stage_metrics_prometheus(self):
+        registry = MetricsRegistry(role="worker", metrics_dir=self.metrics_dir)
+        registry.observe("detect_scenes", 0.3, items=12)
+        registry.observe("detect_scenes", 4.0, items=8, error=True)
+        registry.flush(force=True)
+        
+        # Il processo dell'API riunisce le metriche degli altri processi attivi
+        api = MetricsRegistry(role="api", metrics_dir=self.metrics_dir)
+        with open(os.path.join(self.metrics_dir, f"{os.getpid()}.json")) as f:
+            snapshot = json.load(f)
+        snapshot["pid"] = os.getppid()
+        with open(os.path.join(self.metrics_dir, f"{os.getppid()}.json"), "w") as f:
+            json.dump(snapshot, f)
+        
+        # File di un processo terminato: eliminato
+        dead_path = os.path.join(self.metrics_dir, "999999999.json")
+        with open(dead_path, "w") as f:
+            json.dump(snapshot, f)
+        
+        text = api.render_prometheus()
+        labels = f'role="worker",pid="{os.getppid()}",stage="detect_scenes"'
+        self.assertIn(f'montage_stage_duration_seconds_bucket{{{labels},le="0.5"}} 1', text)
+        self.assertIn(f'montage_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f"montage_stage_duration_seconds_count{{{labels}}} 2", text)
+        self.assertIn(f"montage_stage_items_total{{{labels}}} 20", text)
+        self.assertIn(f"montage_stage_errors_total{{{labels}}} 1", text)
+        self.assertIn(f'montage_process_peak_resident_memory_bytes{{role="api",pid="{os.getpid()}"}}', text)
+        self.assertFalse(os.path.exists(dead_path))
+    
+    def test_timed_decorator(self):
+        from metrics import registry
+        
+        @timed("test_stage", items=len)
+        def stage(items):
+            if not items:
+                raise ValueError("nessun elemento")
+            return items
+        
+        stage([1, 2, 3])
+        with self.assertRaises(ValueError):
+            stage([])
+        
+        metrics = registry.snapshot()["stages"]["test_stage"]
+        self.assertEqual((metrics["count"], metrics["items"], metrics["errors"]), (2, 3, 1))
+    
+    def test_metrics_endpoint(self):
+        with patch.dict(os.environ, {"JOB_WORKERS": "0"}):
+            import main
+        
+        response = main.app.test_client().get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn("# TYPE montage_stage_duration_seconds histogram", response.get_data(as_text=True))
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+
+class TestColdStart(unittest.TestCase):
+    def test_lazy_model_imports(self):
+        import subprocess
+        
+        # Importare i moduli e creare il motore semantico non deve caricare i modelli
+        code = (
+            "import sys, json\n"
+            "import ai_modules, ai_models_detailed, video_segmenter, video_processing\n"
+            "ai_models_detailed.SemanticMatchingEngine()\n"
+            "print(json.dumps([name for name in ('torch', 'transformers', 'clip', 'cv2', 'scenedetect', 'moviepy') "
+            "if name in sys.modules]))\n"
+        )
+        api_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        result = subprocess.run([sys.executable, "-c", code], cwd=api_folder, capture_output=True, text=True)
+        
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout.strip().splitlines()[-1]), [])
+
+
+class TestModelServer(unittest.TestCase):
+    def setUp(self):
+        import threading
+        import numpy as np
+        
+        self.temp_folder = "/tmp/test_movie_montage"
+        os.makedirs(self.temp_folder, exist_ok=True)
+        self.socket_path = os.path.join(self.temp_folder, "models.sock")
+        
+        # Attesa lunga, così le richieste concorrenti finiscono nello stesso batch
+        self.server = ModelServer(self.socket_path, max_wait=0.5)
+        self.batches = []
+        
+        def generate_captions_batch(image_paths):
+            self.batches.append(list(image_paths))
+            return [f"didascalia di {path}" for path in image_paths]
+        
+        self.server.caption_generator.generate_captions_batch = generate_captions_batch
+        self.server.clip_model._encode_image_files = lambda paths, batch_size: (
+            np.arange(len(paths) * 2, dtype=np.float32).reshape(-1, 2), [True] * len(paths)
+        )
+        
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+    
+    def test_micro_batching(self):
+        import threading
+        
+        results = {}
+        
+        def run_job(name):
+            client = ModelClient(self.socket_path, connect_timeout=10)
+            results[name] = client.generate_captions([f"{name}_{i}.jpg" for i in range(3)])
+        
+        jobs = [threading.Thread(target=run_job, args=(name,)) for name in ("a", "b")]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+        
+        # Le richieste dei due job sono servite con un'unica chiamata al modello
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 6)
+        self.assertEqual(results["a"], [f"didascalia di a_{i}.jpg" for i in range(3)])
+        self.assertEqual(results["b"], [f"didascalia di b_{i}.jpg" for i in range(3)])
+        
+        # Le richieste più grandi di chunk_size vengono divise e ricomposte
+        client = ModelClient(self.socket_path, chunk_size=2)
+        features, valid = client.encode_image_files(["x.jpg", "y.jpg", "z.jpg"])
+        self.assertEqual(features.shape, (3, 2))
+        self.assertEqual(valid, [True, True, True])
+        self.assertEqual(client.stats()["requests"], 4)
+    
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists(self.temp_folder):
+            shutil.rmtree(self.temp_folder)
+
+class TestChunkedUpload(unittest.TestCase):
+    def setUp(self):
+        self.upload_folder = "/tmp/test_movie_montage/uploads"
+        os.makedirs(self.upload_folder, exist_ok=True)
+        self.manager = ChunkedUploadManager(self.upload_folder)
+    
+    def test_upload_out_of_order(self):
+        import io
+        import hashlib
+        
+        data = os.urandom(3000)
+        status = self.manager.initiate("video.mp4", len(data), "Riassunto.")
+        upload_id = status["upload_id"]
+        
+        # Il secondo chunk arriva prima del primo
+        status = self.manager.write_chunk(upload_id, 1000, io.BytesIO(data[1000:2000]), 1000)
+        self.assertEqual(status["next_offset"], 0)
+        status = self.manager.write_chunk(upload_id, 0, io.BytesIO(data[:1000]), 1000)
+        self.assertEqual(status["next_offset"], 2000)
+        
+        # Il caricamento non può essere concluso finché mancano dei byte
+        with self.assertRaises(ValueError):
+            self.manager.finalize(upload_id)
+        
+        self.manager.write_chunk(upload_id, 2000, io.BytesIO(data[2000:]), 1000)
+        result = self.manager.finalize(upload_id, hashlib.sha256(data).hexdigest())
+        
+        self.assertEqual(result["sha256"], hashlib.sha256(data).hexdigest())
+        self.assertEqual(result["summary"], "Riassunto.")
+        with open(result["file_path"], 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertIsNone(self.manager.get_status(upload_id))
+    
+    def test_resume_interrupted_chunk(self):
+        import io
+        import hashlib
+        
+        data = os.urandom(2000)
+        upload_id = self.manager.initiate("video.mp4", len(data))["upload_id"]
+        
+        # Connessione interrotta dopo 700 byte: vengono registrati i byte scritti
+        with self.assertRaises(ValueError):
+            self.manager.write_chunk(upload_id, 0, io.BytesIO(data[:700]), 1000)
+        
+        # Un nuovo gestore (es. dopo un riavvio) riprende dal primo byte mancante
+        manager = ChunkedUploadManager(self.upload_folder)
+        offset = manager.get_status(upload_id)["next_offset"]
+        self.assertEqual(offset, 700)
+        
+        manager.write_chunk(upload_id, offset, io.BytesIO(data[offset:]), len(data) - offset)
+        result = manager.finalize(upload_id)
+        self.assertEqual(result["sha256"], hashlib.sha256(data).hexdigest())
+    
+    def test_size_limit_and_cleanup(self):
+        import time
+        
+        manager = ChunkedUploadManager(self.upload_folder, session_ttl=60, max_size=1000)
+        with self.assertRaises(ValueError):
+            manager.initiate("video.mp4", 1001)
+        
+        active = manager.initiate("video.mp4", 1000)["upload_id"]
+        abandoned = manager.initiate("video.mp4", 1000)["upload_id"]
+        
+        # File preallocato rimasto senza sessione (avvio interrotto)
+        orphan = os.path.join(manager.sessions_folder, f"{'0' * 32}.part")
+        open(orphan, 'wb').close()
+        
+        old = time.time() - 120
+        for path in (manager._session_path(abandoned), manager._part_path(abandoned), orphan):
+            os.utime(path, (old, old))
+        
+        # Le sessioni abbandonate vengono rimosse all'avvio del gestore
+        ChunkedUploadManager(self.upload_folder, session_ttl=60)
+        self.assertEqual(sorted(os.listdir(manager.sessions_folder)), [f"{active}.json", f"{active}.part"])
+        self.assertIsNone(manager.get_status(abandoned))
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+class TestVideoIndex(unittest.TestCase):
+    def setUp(self):
+        self.upload_folder = "/tmp/test_movie_montage/uploads"
+        os.makedirs(self.upload_folder, exist_ok=True)
+        self.index = VideoIndex("/tmp/test_movie_montage/videos.db", self.upload_folder)
+    
+    def test_register_deduplicates(self):
+        import io
+        
+        data = os.urandom(1000)
+        
+        first_path = os.path.join(self.upload_folder, "first.tmp")
+        sha256 = save_stream_with_hash(io.BytesIO(data), first_path)
+        video = self.index.register(sha256, first_path, "movie.mp4")
+        
+        # L'ID del video deriva dall'hash del contenuto, non dal nome del file
+        self.assertEqual(video["video_id"], sha256[:16])
+        self.assertEqual(video["video_path"], os.path.join(self.upload_folder, f"{sha256[:16]}.mp4"))
+        self.assertFalse(video["deduplicated"])
+        self.assertEqual(video_id_of(video["job_id"]), video["video_id"])
+        
+        # Lo stesso contenuto con un altro nome viene collegato al video esistente
+        second_path = os.path.join(self.upload_folder, "second.tmp")
+        save_stream_with_hash(io.BytesIO(data), second_path)
+        duplicate = self.index.register(sha256, second_path, "trailer.mp4")
+        
+        self.assertTrue(duplicate["deduplicated"])
+        self.assertEqual(duplicate["video_id"], video["video_id"])
+        self.assertFalse(os.path.exists(second_path))
+        self.assertEqual(self.index.lookup(sha256)["upload_count"], 2)
+        
+        # Ogni caricamento ha un proprio job: riassunti e risultati non sono condivisi
+        self.assertNotEqual(duplicate["job_id"], video["job_id"])
+        self.assertEqual(video_id_of(duplicate["job_id"]), video["video_id"])
+        
+        # Un ID senza il suffisso del caricamento è già l'ID del video
+        self.assertEqual(video_id_of(video["video_id"]), video["video_id"])
+        self.assertEqual(video_id_of("test_job"), "test_job")
+    
+    def test_uploads_share_scenes(self):
+        from optimized_processing import ScalableVideoProcessor
+        
+        temp_folder = "/tmp/test_movie_montage/temp"
+        processor = ScalableVideoProcessor(self.upload_folder, temp_folder, temp_folder)
+        scenes = [{"id": i + 1, "start_time": i * 5.0, "end_time": i * 5.0 + 5, "thumbnail": "", "caption": "Scena."} for i in range(2)]
+        
+        # Scene e didascalie del video calcolate dal caricamento precedente
+        video_id = "0123456789abcdef"
+        processor.optimizer.save_to_cache(video_id, "segmentation", scenes)
+        processor.optimizer.save_to_cache(video_id, "captions", scenes)
+        
+        with patch.object(processor.semantic_engine, "find_matches", return_value=[1]), \
+                patch.object(processor, "catalog_scenes") as catalog_scenes, \
+                patch.object(processor.video_segmenter, "detect_scenes") as detect_scenes:
+            results = processor.process_video("video.mp4", "Un uomo cammina.", f"{video_id}-0a1b2c3d")
+        
+        # Il nuovo job riusa le scene del video ma salva risultati propri
+        detect_scenes.assert_not_called()
+        self.assertEqual(results["summary_segments"][0]["matchedSceneId"], 2)
+        self.assertTrue(os.path.exists(os.path.join(temp_folder, f"{video_id}-0a1b2c3d_results.json")))
+        self.assertFalse(os.path.exists(os.path.join(temp_folder, f"{video_id}_results.json")))
+        catalog_scenes.assert_called_once_with(video_id, results["scenes"])
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+class TestSceneAssignment(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        
+        # Le prime due frasi preferiscono entrambe la scena 0
+        self.similarity = np.array([
+            [0.9, 0.8, 0.1, 0.2],
+            [0.8, 0.2, 0.1, 0.3],
+            [0.1, 0.2, 0.3, 0.9]
+        ])
+    
+    def test_argmax(self):
+        self.assertEqual(list(assign_scenes(self.similarity, "argmax")), [0, 0, 3])
+    
+    def test_unique(self):
+        # Assegnazione uno a uno che massimizza la similarità totale
+        self.assertEqual(list(assign_scenes(self.similarity, "unique", top_k=2)), [1, 0, 3])
+    
+    def test_ordered(self):
+        scene_order = [0, 10, 20, 30]
+        
+        # Le scene seguono l'ordine delle frasi, con ripetizioni consentite
+        self.assertEqual(list(assign_scenes(self.similarity, "ordered", scene_order=scene_order)), [0, 0, 3])
+        
+        # Senza ripetizioni: con 2 candidati per frase non esiste una sequenza
+        # valida e i candidati vengono ampliati
+        self.assertEqual(list(assign_scenes(self.similarity, "ordered_unique", top_k=2, scene_order=scene_order)), [0, 1, 3])
+    
+    def test_sparse_candidates_at_scale(self):
+        import time
+        import numpy as np
+        
+        similarity = np.random.default_rng(0).normal(0.25, 0.05, (100, 2000))
+        
+        start = time.time()
+        assignment = assign_scenes(similarity, "unique")
+        self.assertEqual(len(set(assignment.tolist())), 100)
+        
+        assignment = assign_scenes(similarity, "ordered_unique")
+        self.assertTrue((np.diff(assignment) > 0).all())
+        self.assertLess(time.time() - start, 5)
+    
+    def test_assign_changed(self):
+        # Solo la seconda frase è cambiata: le altre mantengono le scene 0 e 3
+        changed = self.similarity[[1]]
+        self.assertEqual(list(assign_changed(changed, [0, -1, 3], "argmax")), [0, 0, 3])
+        self.assertEqual(list(assign_changed(changed, [0, -1, 3], "unique")), [0, 1, 3])
+        
+        # Nelle modalità ordinate la scena è compresa tra quelle delle frasi vicine
+        self.assertEqual(list(assign_changed(changed, [1, -1, 3], "ordered")), [1, 3, 3])
+        self.assertEqual(list(assign_changed(changed, [1, -1, 3], "ordered_unique")), [1, 2, 3])
+        
+        # Nessuna scena tra quelle delle frasi vicine: la più simile
+        self.assertEqual(list(assign_changed(changed, [2, -1, 1], "ordered_unique")), [2, 0, 1])
+
+class TestSceneIndex(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        
+        # Scene raggruppate intorno a 40 "ambientazioni", di due video diversi
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(40, 64))
+        self.vectors = centers[rng.integers(0, 40, 3000)] + rng.normal(scale=0.5, size=(3000, 64))
+        self.vectors /= np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        self.ids = [("job1" if i < 1500 else "job2", i % 1500) for i in range(3000)]
+        self.queries = self.vectors[[5, 1700, 2999]] + rng.normal(scale=0.1, size=(3, 64))
+    
+    def test_exact_matches_brute_force(self):
+        import numpy as np
+        
+        index = SceneIndex("exact")
+        index.add(self.ids[:1000], self.vectors[:1000])
+        index.add(self.ids[1000:], self.vectors[1000:])
+        
+        with patch("scene_index.EXACT_BLOCK_SIZE", 700):
+            ids, scores = index.query(self.queries, 5)
+        
+        similarity = self.queries @ self.vectors.T
+        for row, expected in enumerate(np.argsort(-similarity, axis=1)[:, :5]):
+            self.assertEqual(ids[row], [self.ids[i] for i in expected])
+            np.testing.assert_allclose(scores[row], similarity[row, expected], rtol=1e-5)
+        
+        self.assertEqual(index.query(self.queries[0], 5000)[1].shape, (1, 3000))
+    
+    def test_ivf_recall(self):
+        exact = SceneIndex("exact")
+        exact.add(self.ids, self.vectors)
+        approximate = SceneIndex("ivf", nlist=30, nprobe=6)
+        approximate.add(self.ids, self.vectors)
+        
+        expected, _ = exact.query(self.queries, 10)
+        found, scores = approximate.query(self.queries, 10)
+        recall = sum(len(set(a) & set(b)) for a, b in zip(expected, found)) / 30
+        self.assertGreaterEqual(recall, 0.8)
+        self.assertTrue((scores[:, :-1] >= scores[:, 1:]).all())
+        
+        # Le scene aggiunte dopo l'addestramento entrano nei gruppi esistenti
+        approximate.add([("job3", 0)], self.queries[:1])
+        self.assertEqual(approximate.query(self.queries[:1], 1)[0], [[("job3", 0)]])
+    
+    def test_engine_candidates_match_dense(self):
+        import numpy as np
+        from ai_models_detailed import SemanticMatchingEngine
+        
+        engine = SemanticMatchingEngine()
+        scenes = [{"id": i, "thumbnail": f"scene_{i}.jpg", "start_time": float(i)} for i in range(3000)]
+        texts = ["frase uno", "frase due", "frase tre"]
+        
+        with patch.object(engine.clip_model, "encode_images", return_value=self.vectors), \
+                patch.object(engine.clip_model, "encode_texts", return_value=self.queries), \
+                patch("ai_models_detailed.INDEX_MIN_SCENES", 100):
+            for mode in ("argmax", "unique", "ordered_unique"):
+                dense = assign_scenes(self.queries @ self.vectors.T, mode, scene_order=list(range(3000)))
+                self.assertEqual(list(engine.find_matches(scenes, texts, mode)), list(dense), mode)
+
+class TestSceneCatalog(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        
+        self.catalog_path = "/tmp/test_movie_montage/scenes.db"
+        self.thumbnail_path = "/tmp/test_movie_montage/scene_2.jpg"
+        os.makedirs(os.path.dirname(self.thumbnail_path), exist_ok=True)
+        with open(self.thumbnail_path, "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        
+        self.film1 = [
+            {"id": 0, "start_time": 0.0, "end_time": 5.0, "caption": "Un uomo cammina lungo una strada deserta", "thumbnail": ""},
+            {"id": 1, "start_time": 5.0, "end_time": 9.0, "caption": "Una donna guarda fuori dalla finestra", "thumbnail": ""},
+            {"id": 2, "start_time": 9.0, "end_time": 12.0, "caption": "Un'auto rossa sfreccia in città, di notte", "thumbnail": self.thumbnail_path}
+        ]
+        self.film2 = [
+            {"id": 0, "start_time": 0.0, "end_time": 4.0, "caption": "Auto della polizia in una strada bagnata di notte", "thumbnail": ""},
+            {"id": 1, "start_time": 4.0, "end_time": 8.0, "caption": "Una festa in giardino", "thumbnail": ""}
+        ]
+        self.embeddings = np.eye(4, dtype=np.float32)
+    
+    def test_text_and_semantic_search(self):
+        import numpy as np
+        
+        catalog = SceneCatalog(self.catalog_path)
+        catalog.index_job("film1", self.film1, self.embeddings[:3])
+        catalog.index_job("film2", self.film2, np.stack([self.embeddings[3], np.zeros(4)]))
+        self.assertEqual(catalog.count(), 5)
+        
+        # Indice invertito: solo le scene con i termini della query, senza accenti e parole vuote
+        results = catalog.search("auto di notte in citta", mode="text")
+        self.assertEqual([(r["job_id"], r["scene_id"]) for r in results], [("film1", 2), ("film2", 0)])
+        self.assertIsNone(results[0]["semantic_score"])
+        
+        # Classifica semantica e fusione delle due classifiche
+        results = catalog.search("qualsiasi", mode="semantic", query_embedding=self.embeddings[3])
+        self.assertEqual((results[0]["job_id"], results[0]["scene_id"]), ("film2", 0))
+        self.assertEqual(len(results), 4)
+        
+        results = catalog.search("strada", mode="hybrid", query_embedding=self.embeddings[0])
+        self.assertEqual((results[0]["job_id"], results[0]["scene_id"]), ("film1", 0))
+        
+        # Una nuova elaborazione sostituisce le scene del job, anche nell'indice semantico
+        catalog.index_job("film1", self.film1[:1], self.embeddings[3:4])
+        self.assertEqual(catalog.count(), 3)
+        self.assertEqual(catalog.search("finestra", mode="text"), [])
+        results = SceneCatalog(self.catalog_path).search("x", mode="semantic", query_embedding=self.embeddings[3])
+        self.assertEqual(len(results), 2)
+    
+    def test_search_endpoint(self):
+        import json
+        
+        with patch.dict(os.environ, {"JOB_WORKERS": "0", "MODEL_SERVER": "0"}):
+            import main
+        
+        catalog = SceneCatalog(self.catalog_path)
+        catalog.index_job("film1", self.film1)
+        
+        with patch.object(main, "scene_catalog", catalog), patch.object(main, "catalog_backfilled", True):
+            client = main.app.test_client()
+            
+            response = client.get("/api/search?q=auto%20rossa")
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data["mode"], "text")
+            self.assertEqual(data["results"][0]["thumbnail_url"], "/api/thumbnail/film1/2")
+            self.assertNotIn("thumbnail", data["results"][0])
+            
+            response = client.get(data["results"][0]["thumbnail_url"])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b"\xff\xd8\xff\xd9")
+            
+            self.assertEqual(client.get("/api/thumbnail/film1/0").status_code, 404)
+            self.assertEqual(client.get("/api/search").status_code, 400)
+            self.assertEqual(client.get("/api/search?q=auto&mode=other").status_code, 400)
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+class TestIncrementalMatching(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = "/tmp/test_movie_montage"
+        os.makedirs(self.temp_folder, exist_ok=True)
+    
+    def test_text_embeddings_cached(self):
+        import numpy as np
+        from ai_models_detailed import CLIPModelIntegration
+        
+        clip_model = CLIPModelIntegration(embedding_store=EmbeddingStore(os.path.join(self.temp_folder, "embeddings")))
+        encoded = []
+        
+        def fake_encode(texts):
+            encoded.append(list(texts))
+            return np.array([[len(text), 1.0, 0.0] for text in texts])
+        
+        with patch.object(clip_model, "_encode_text_list", side_effect=fake_encode):
+            first = clip_model.encode_texts(["Un uomo cammina.", "Piove."])
+            second = clip_model.encode_texts(["Piove.", "Una donna corre.", "Piove."])
+        
+        # Le frasi già codificate vengono lette dall'archivio
+        self.assertEqual(encoded, [["Un uomo cammina.", "Piove."], ["Una donna corre."]])
+        np.testing.assert_allclose(second[0], first[1], atol=1e-3)
+        np.testing.assert_allclose(second[2], first[1], atol=1e-3)
+    
+    def test_update_summary(self):
+        import json
+        import numpy as np
+        from optimized_processing import ScalableVideoProcessor
+        
+        processor = ScalableVideoProcessor(self.temp_folder, self.temp_folder, self.temp_folder)
+        scenes = [{"id": i + 1, "start_time": i * 5.0, "end_time": i * 5.0 + 5, "thumbnail": "", "caption": ""} for i in range(4)]
+        
+        # La terza frase ha una scena scelta manualmente nella revisione
+        with open(os.path.join(self.temp_folder, "job1_results.json"), "w") as f:
+            json.dump({
+                "job_id": "job1",
+                "scenes": scenes,
+                "summary_segments": [
+                    {"id": 1, "text": "Un uomo cammina.", "matchedSceneId": 1},
+                    {"id": 2, "text": "Una donna guarda fuori.", "matchedSceneId": 2},
+                    {"id": 3, "text": "Un'auto sfreccia.", "matchedSceneId": 4}
+                ],
+                "match_mode": "ordered"
+            }, f)
+        
+        def find_best_match(image_paths, texts):
+            # Solo la frase modificata viene confrontata con le scene
+            self.assertEqual(texts, ["Una donna corre sotto la pioggia."])
+            return np.array([[0.1, 0.2, 0.9, 0.3]]), None
+        
+        with patch.object(processor.semantic_engine.clip_model, "find_best_match", side_effect=find_best_match):
+            results = processor.update_summary("job1", "Un uomo cammina. Una donna corre sotto la pioggia. Un'auto sfreccia.")
+        
+        self.assertEqual(results["rematched"], 1)
+        self.assertEqual([segment["matchedSceneId"] for segment in results["summary_segments"]], [1, 3, 4])
+        
+        with open(os.path.join(self.temp_folder, "job1_results.json")) as f:
+            saved = json.load(f)
+        self.assertEqual(saved["summary_segments"], results["summary_segments"])
+        self.assertEqual(saved["match_mode"], "ordered")
+        
+        # Endpoint di modifica del riassunto
+        with patch.dict(os.environ, {"JOB_WORKERS": "0"}):
+            import main
+        
+        with patch.object(main, "TEMP_FOLDER", self.temp_folder), \
+                patch.object(main, "inline_processor", processor), \
+                patch.dict(main.app.config, {"UPLOAD_FOLDER": self.temp_folder}):
+            client = main.app.test_client()
+            
+            response = client.post("/api/summary/job1", json={"summary": "Un uomo cammina. Una donna corre sotto la pioggia."})
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data["rematched"], 0)
+            self.assertEqual([segment["matchedSceneId"] for segment in data["summary_segments"]], [1, 3])
+            
+            self.assertEqual(client.post("/api/summary/job2", json={"summary": "Testo."}).status_code, 404)
+            self.assertEqual(client.post("/api/summary/job1", json={"summary": ""}).status_code, 400)
+    
+    def test_reprocess_keeps_overrides(self):
+        from optimized_processing import ScalableVideoProcessor, split_summary, matching_cache_stage
+        
+        processor = ScalableVideoProcessor(self.temp_folder, self.temp_folder, self.temp_folder)
+        scenes = [{"id": i + 1, "start_time": i * 5.0, "end_time": i * 5.0 + 5, "thumbnail": "", "caption": ""} for i in range(3)]
+        summary_segments = split_summary("Un uomo cammina. Piove.")
+        
+        # Matching della prima elaborazione in cache; la revisione ha poi scelto la scena 3
+        cache_stage = matching_cache_stage([segment["text"] for segment in summary_segments], "argmax")
+        processor.optimizer.save_to_cache("job1", cache_stage, [dict(segment, matchedSceneId=1) for segment in summary_segments])
+        previous_segments = [dict(segment, matchedSceneId=3) for segment in summary_segments]
+        
+        with patch.object(processor.semantic_engine, "find_matches") as find_matches:
+            matched = processor.match_scenes_to_summary(
+                scenes, split_summary("Un uomo cammina. Piove."), "job1", "argmax", previous_segments
+            )
+        
+        # Lo stesso riassunto rielaborato mantiene le scene della revisione, non quelle in cache
+        find_matches.assert_not_called()
+        self.assertEqual([segment["matchedSceneId"] for segment in matched], [3, 3])
+        
+        # Le corrispondenze salvate con /api/matches invalidano il matching in cache
+        with open(os.path.join(self.temp_folder, "job1_results.json"), "w") as f:
+            json.dump({"job_id": "job1", "scenes": scenes, "summary_segments": matched, "match_mode": "argmax"}, f)
+        
+        with patch.dict(os.environ, {"JOB_WORKERS": "0"}):
+            import main
+        
+        with patch.object(main, "TEMP_FOLDER", self.temp_folder), \
+                patch.object(main, "performance_optimizer", processor.optimizer):
+            response = main.app.test_client().post("/api/matches/job1", json={"matches": [{"segmentId": 1, "sceneId": 2}]})
+            self.assertEqual(response.status_code, 200)
+        
+        self.assertIsNone(processor.optimizer.load_from_cache("job1", cache_stage))
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+class TestTieredCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_folder = "/tmp/test_movie_montage/cache"
+    
+    def test_memory_and_disk_tiers(self):
+        cache = TieredCache(self.cache_folder)
+        cache.put("job1_segmentation", [{"id": 1}])
+        
+        # Primo accesso dalla memoria
+        self.assertEqual(cache.get("job1_segmentation"), [{"id": 1}])
+        
+        # Un'altra istanza (es. un altro processo) legge dal disco
+        other = TieredCache(self.cache_folder)
+        self.assertEqual(other.get("job1_segmentation"), [{"id": 1}])
+        self.assertIsNone(other.get("job2_segmentation"))
+        
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+        stats = other.stats()
+        self.assertEqual((stats["disk_hits"], stats["misses"]), (1, 1))
+        
+        # Una voce rimossa da un'altra istanza non viene più restituita dalla memoria
+        cache.put("job1_matching", [{"id": 1}])
+        other.delete("job1_matching")
+        self.assertIsNone(cache.get("job1_matching"))
+        
+        # Nessun file temporaneo rimasto dopo le scritture atomiche
+        self.assertEqual(os.listdir(self.cache_folder), ["job1_segmentation_cache.json"])
+    
+    def test_budgets_and_ttl(self):
+        cache = TieredCache(self.cache_folder, memory_budget=100, disk_budget=250)
+        
+        for i in range(5):
+            cache.put(f"key{i}", "x" * 60)
+        
+        # In memoria restano solo le voci più recenti entro il budget
+        self.assertLessEqual(cache.stats()["memory_bytes"], 100)
+        
+        # Su disco vengono eliminate le voci meno recenti oltre il budget
+        self.assertLessEqual(cache.stats()["disk_bytes"], 250)
+        self.assertFalse(os.path.exists(cache.path("key0")))
+        self.assertTrue(os.path.exists(cache.path("key4")))
+        
+        # Le voci scadute non vengono restituite
+        expired = TieredCache(self.cache_folder, ttl=0)
+        self.assertIsNone(expired.get("key4"))
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
+class TestStreamEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = "/tmp/test_movie_montage/output"
+        os.makedirs(self.output_folder, exist_ok=True)
+        with open(os.path.join(self.output_folder, "job1_montage.mp4"), "wb") as f:
+            f.write(bytes(range(256)) * 4)
+    
+    def test_range_and_etag(self):
+        with patch.dict(os.environ, {"JOB_WORKERS": "0"}):
+            import main
+        
+        with patch.object(main, "OUTPUT_FOLDER", self.output_folder):
+            client = main.app.test_client()
+            
+            response = client.get("/api/stream/job1")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "video/mp4")
+            self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+            self.assertEqual(len(response.data), 1024)
+            etag = response.headers["ETag"]
+            
+            # Solo i byte richiesti
+            response = client.get("/api/stream/job1", headers={"Range": "bytes=100-199"})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.headers["Content-Range"], "bytes 100-199/1024")
+            self.assertEqual(response.data, bytes(range(100, 200)))
+            
+            # File non modificato
+            response = client.get("/api/stream/job1", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+            
+            response = client.get("/api/stream/job1?download=1")
+            self.assertIn("attachment", response.headers["Content-Disposition"])
+            
+            self.assertEqual(client.get("/api/stream/job2").status_code, 404)
+            self.assertEqual(client.get("/api/stream/job1?file=other").status_code, 400)
+    
+    def tearDown(self):
+        # Pulisci i file temporanei
+        import shutil
+        if os.path.exists("/tmp/test_movie_montage"):
+            shutil.rmtree("/tmp/test_movie_montage")
+
 if __name__ == '__main__':
     unittest.main()
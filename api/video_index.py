@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import secrets
+import hashlib
+import sqlite3
+import logging
+from contextlib import closing
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Numero di caratteri dell'hash usati per l'ID del video
+VIDEO_ID_LENGTH = 16
+
+# Caratteri casuali che distinguono i caricamenti dello stesso video
+UPLOAD_TOKEN_LENGTH = 8
+
+# ID del job di un caricamento: ID del video e suffisso casuale
+_JOB_ID_PATTERN = re.compile(r"^([0-9a-f]{16,64})-[0-9a-f]{%d}$" % UPLOAD_TOKEN_LENGTH)
+
+class VideoIndex:
+    """
+    Indice di deduplicazione dei video caricati, basato su SQLite.
+    
+    Ogni video è identificato dall'hash SHA-256 del contenuto: l'ID del video
+    deriva dall'hash e il file viene salvato una sola volta come
+    "<video_id>.<estensione>" nella cartella dei caricamenti. Un nuovo
+    caricamento degli stessi byte viene collegato al video già presente, e
+    quindi alla sua segmentazione, ai thumbnail, agli embedding e al proxy
+    già calcolati. Ogni caricamento riceve invece un proprio ID del job
+    ("<video_id>-<suffisso>"), a cui appartengono riassunto, corrispondenze,
+    risultati e montaggi: utenti diversi che caricano lo stesso video non
+    modificano i job l'uno dell'altro.
+    """
+    
+    def __init__(self, db_path, upload_folder):
+        """
+        Inizializza l'indice dei video.
+        
+        Args:
+            db_path: Percorso del database SQLite
+            upload_folder: Cartella dei file caricati
+        """
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    sha256 TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL UNIQUE,
+                    video_path TEXT NOT NULL,
+                    filename TEXT,
+                    size INTEGER NOT NULL,
+                    upload_count INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_upload_at REAL NOT NULL
+                )
+            """)
+    
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+    
+    def register(self, sha256, file_path, filename):
+        """
+        Registra un file caricato. Se lo stesso contenuto è già presente il
+        nuovo file viene eliminato e si restituisce il video esistente,
+        altrimenti il file viene spostato nel percorso definitivo.
+        
+        Args:
+            sha256: Hash SHA-256 esadecimale del contenuto
+            file_path: Percorso del file appena caricato
+            filename: Nome originale del file
+        
+        Returns:
+            Dizionario con video_id, job_id (nuovo per ogni caricamento),
+            video_path e deduplicated (True se il contenuto era già presente)
+        """
+        sha256 = sha256.lower()
+        size = os.path.getsize(file_path)
+        now = time.time()
+        
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT video_id, video_path FROM videos WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            
+            if row is not None and os.path.exists(row[1]):
+                video_id, video_path = row
+                conn.execute(
+                    "UPDATE videos SET upload_count = upload_count + 1, last_upload_at = ? WHERE sha256 = ?",
+                    (now, sha256)
+                )
+                conn.execute("COMMIT")
+                
+                if os.path.abspath(file_path) != os.path.abspath(video_path):
+                    os.remove(file_path)
+                
+                logger.info(f"Video già presente ({video_id}): caricamento deduplicato")
+                return {"video_id": video_id, "job_id": new_job_id(video_id), "video_path": video_path, "deduplicated": True}
+            
+            video_id = row[0] if row is not None else self._new_video_id(conn, sha256)
+            extension = os.path.splitext(filename)[1].lower()
+            video_path = os.path.join(self.upload_folder, f"{video_id}{extension}")
+            
+            os.replace(file_path, video_path)
+            
+            conn.execute(
+                "INSERT OR REPLACE INTO videos "
+                "(sha256, video_id, video_path, filename, size, upload_count, created_at, last_upload_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
+                (sha256, video_id, video_path, filename, size, now, now)
+            )
+            conn.execute("COMMIT")
+        
+        logger.info(f"Nuovo video registrato: {filename} -> {video_id}")
+        return {"video_id": video_id, "job_id": new_job_id(video_id), "video_path": video_path, "deduplicated": False}
+    
+    def lookup(self, sha256):
+        """
+        Cerca un video per hash del contenuto.
+        
+        Returns:
+            Dizionario con i dati del video, o None se non è presente
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sha256, video_id, video_path, filename, size, upload_count FROM videos WHERE sha256 = ?",
+                (sha256.lower(),)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        
+        return {
+            "sha256": row[0],
+            "video_id": row[1],
+            "video_path": row[2],
+            "filename": row[3],
+            "size": row[4],
+            "upload_count": row[5]
+        }
+    
+    @staticmethod
+    def _new_video_id(conn, sha256):
+        # In caso (improbabile) di collisione del prefisso, usa più caratteri dell'hash
+        length = VIDEO_ID_LENGTH
+        while length < len(sha256):
+            video_id = sha256[:length]
+            if conn.execute("SELECT 1 FROM videos WHERE video_id = ?", (video_id,)).fetchone() is None:
+                return video_id
+            length += 8
+        return sha256
+
+
+def new_job_id(video_id):
+    """
+    Restituisce un nuovo ID del job per un caricamento del video.
+    """
+    return f"{video_id}-{secrets.token_hex(UPLOAD_TOKEN_LENGTH // 2)}"
+
+
+def video_id_of(job_id):
+    """
+    Restituisce l'ID del video di un job, che identifica i dati condivisi tra
+    i caricamenti dello stesso video (file, segmentazione, didascalie,
+    proxy). Un ID senza il suffisso del caricamento è già l'ID di un video.
+    """
+    match = _JOB_ID_PATTERN.match(job_id)
+    return match.group(1) if match else job_id
+
+
+def save_stream_with_hash(stream, file_path, block_size=1024 * 1024):
+    """
+    Scrive uno stream su file calcolando l'hash SHA-256 durante la copia,
+    senza rileggere il file dal disco.
+    
+    Args:
+        stream: Oggetto file da cui leggere (es. FileStorage.stream)
+        file_path: Percorso del file da scrivere
+        block_size: Dimensione dei blocchi copiati
+    
+    Returns:
+        Hash SHA-256 esadecimale del contenuto
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        for block in iter(lambda: stream.read(block_size), b''):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
@@ -2,7 +2,9 @@ import os
 import logging
 import numpy as np
 import json
-from moviepy.editor import VideoFileClip, concatenate_videoclips
+from montage_renderer import SmartCutRenderer
+from metrics import timed
+from video_index import video_id_of
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +27,9 @@ class MontageCompiler:
         self.temp_folder = temp_folder
         self.output_folder = output_folder
         os.makedirs(output_folder, exist_ok=True)
+        
+        # Rendering con ffmpeg (smart cut); moviepy viene usato solo se ffmpeg non è disponibile
+        self.renderer = SmartCutRenderer(temp_folder)
     
     def extract_scene_clips(self, video_path, scenes, selected_scene_ids):
         """
@@ -41,6 +46,9 @@ class MontageCompiler:
         logger.info(f"Estrazione di {len(selected_scene_ids)} clip da {video_path}")
         
         try:
+            # moviepy serve solo per questo rendering di riserva: importato quando viene usato
+            from moviepy.editor import VideoFileClip
+            
             # Carica il video
             video = VideoFileClip(video_path)
             
@@ -66,7 +74,32 @@ class MontageCompiler:
             logger.error(f"Errore durante l'estrazione dei clip: {str(e)}")
             return []
     
-    def compile_montage(self, video_path, scenes, summary_segments, job_id):
+    def render_with_moviepy(self, video_path, scenes, selected_scene_ids, output_path):
+        """
+        Renderizza il montaggio con moviepy, ricodificando ogni frame.
+        
+        Args:
+            video_path: Percorso del video originale
+            scenes: Lista di tutte le scene con timestamp
+            selected_scene_ids: Lista degli ID delle scene selezionate
+            output_path: Percorso del montaggio da generare
+        """
+        clips = self.extract_scene_clips(video_path, scenes, selected_scene_ids)
+        if not clips:
+            raise ValueError("Nessuna clip estratta per il montaggio")
+        
+        from moviepy.editor import concatenate_videoclips
+        
+        montage = concatenate_videoclips(clips)
+        try:
+            montage.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None)
+        finally:
+            montage.close()
+            for clip in clips:
+                clip.close()
+    
+    @timed("compile_montage")
+    def compile_montage(self, video_path, scenes, summary_segments, job_id, draft=False):
         """
         Compila il montaggio finale basato sulle scene selezionate e sull'ordine del riassunto.
         
@@ -75,11 +108,15 @@ class MontageCompiler:
             scenes: Lista di tutte le scene con timestamp
             summary_segments: Lista dei segmenti del riassunto con scene abbinate
             job_id: ID del job
+            draft: Se True genera un montaggio in bozza ({job_id}_draft.mp4);
+                video_path è in questo caso il proxy a bassa risoluzione (vedi
+                proxy_video.ProxyGenerator), che ha gli stessi tempi
+                dell'originale, e il montaggio finale non viene sovrascritto
             
         Returns:
-            Percorso del montaggio finale
+            Percorso del montaggio finale, o None se la compilazione non è riuscita
         """
-        logger.info(f"Compilazione del montaggio per il job {job_id}")
+        logger.info(f"Compilazione del montaggio {'in bozza ' if draft else ''}per il job {job_id}")
         
         try:
             # Ordina i segmenti del riassunto per ID
@@ -88,13 +125,10 @@ class MontageCompiler:
             # Estrai gli ID delle scene selezionate nell'ordine del riassunto
             selected_scene_ids = [segment["matchedSceneId"] for segment in sorted_segments]
             
-            # In un'implementazione reale, qui estrarremmo i clip e creeremmo il montaggio
-            # Per ora, creiamo un file di testo che descrive il montaggio
-            
-            output_path = os.path.join(self.output_folder, f"{job_id}_montage.mp4")
+            output_path = os.path.join(self.output_folder, f"{job_id}_{'draft' if draft else 'montage'}.mp4")
             
             # Crea un file di testo che descrive il montaggio
-            description_path = os.path.join(self.output_folder, f"{job_id}_montage_description.txt")
+            description_path = os.path.join(self.output_folder, f"{job_id}_{'draft' if draft else 'montage'}_description.txt")
             with open(description_path, 'w') as f:
                 f.write(f"Montaggio video per il job {job_id}\n\n")
                 f.write("Sequenza di scene:\n")
@@ -108,22 +142,25 @@ class MontageCompiler:
                         f.write(f"  Scena: {scene['id']}, {scene['start_time']:.2f}s - {scene['end_time']:.2f}s\n")
                         f.write(f"  Didascalia: {scene.get('caption', 'Nessuna didascalia')}\n\n")
             
-            # Simula la creazione del file video
-            with open(output_path, 'w') as f:
-                f.write("Placeholder per il montaggio video")
+            # Renderizza il montaggio
+            if self.renderer.is_available():
+                scenes_by_id = {scene["id"]: scene for scene in scenes}
+                segments = [
+                    (scenes_by_id[scene_id]["start_time"], scenes_by_id[scene_id]["end_time"])
+                    for scene_id in selected_scene_ids
+                    if scene_id in scenes_by_id
+                ]
+                self.renderer.render(video_path, segments, output_path)
+            else:
+                logger.warning("ffmpeg non disponibile: rendering del montaggio con moviepy")
+                self.render_with_moviepy(video_path, scenes, selected_scene_ids, output_path)
             
             logger.info(f"Montaggio compilato: {output_path}")
             return output_path
             
         except Exception as e:
             logger.error(f"Errore durante la compilazione del montaggio: {str(e)}")
-            
-            # Crea un file di errore
-            error_path = os.path.join(self.output_folder, f"{job_id}_error.txt")
-            with open(error_path, 'w') as f:
-                f.write(f"Errore durante la compilazione del montaggio: {str(e)}")
-            
-            return error_path
+            return None
 
 
 class VideoProcessingPipeline:
@@ -146,13 +183,17 @@ class VideoProcessingPipeline:
         self.output_folder = output_folder
         
         # Importa i moduli necessari
+        from proxy_video import ProxyGenerator
         from video_segmenter import VideoSegmenter
         from ai_models_detailed import SemanticMatchingEngine
+        from embedding_store import EmbeddingStore
         
         # Inizializza i componenti
         self.video_segmenter = VideoSegmenter(temp_folder)
-        self.semantic_engine = SemanticMatchingEngine()
+        self.embedding_store = EmbeddingStore(os.path.join(temp_folder, "embeddings"))
+        self.semantic_engine = SemanticMatchingEngine(embedding_store=self.embedding_store)
         self.montage_compiler = MontageCompiler(temp_folder, output_folder)
+        self.proxy_generator = ProxyGenerator(os.path.join(temp_folder, "proxies"))
     
     def process_video(self, video_path, summary, job_id):
         """
@@ -222,15 +263,16 @@ class VideoProcessingPipeline:
             logger.error(f"Errore durante l'elaborazione del video: {str(e)}")
             return {"error": str(e)}
     
-    def generate_montage(self, job_id):
+    def generate_montage(self, job_id, draft=False):
         """
         Genera il montaggio finale per un job.
         
         Args:
             job_id: ID del job
+            draft: Se True genera il montaggio in bozza dal video proxy
             
         Returns:
-            Percorso del montaggio finale
+            Percorso del montaggio finale, o None se la compilazione non è riuscita
         """
         logger.info(f"Generazione del montaggio per il job {job_id}")
         
@@ -244,13 +286,14 @@ class VideoProcessingPipeline:
             with open(results_path, 'r') as f:
                 results = json.load(f)
             
-            # Recupera il percorso del video
-            video_path = os.path.join(self.upload_folder, f"{job_id}.mp4")
+            # Recupera il percorso del video, condiviso tra i caricamenti dello stesso video
+            video_id = video_id_of(job_id)
+            video_path = os.path.join(self.upload_folder, f"{video_id}.mp4")
             
             if not os.path.exists(video_path):
                 # Prova altre estensioni
                 for ext in ['mov', 'avi', 'mkv']:
-                    alt_path = os.path.join(self.upload_folder, f"{job_id}.{ext}")
+                    alt_path = os.path.join(self.upload_folder, f"{video_id}.{ext}")
                     if os.path.exists(alt_path):
                         video_path = alt_path
                         break
@@ -258,12 +301,17 @@ class VideoProcessingPipeline:
             if not os.path.exists(video_path):
                 raise FileNotFoundError(f"Video non trovato per il job {job_id}")
             
+            if draft:
+                # La bozza viene generata dal proxy, codificato ora se non è ancora pronto
+                video_path = self.proxy_generator.generate(video_id, video_path)
+            
             # Compila il montaggio
             output_path = self.montage_compiler.compile_montage(
                 video_path, 
                 results['scenes'], 
                 results['summary_segments'], 
-                job_id
+                job_id,
+                draft=draft
             )
             
             return output_path
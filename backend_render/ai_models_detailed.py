@@ -1,38 +1,58 @@
 import os
 import logging
+import hashlib
+import functools
+from collections import defaultdict
 import numpy as np
 from PIL import Image
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import clip
+from scene_assignment import assign_scenes, assign_changed, DEFAULT_TOP_K
+from scene_index import SceneIndex
+from progress import ProgressTracker
+from metrics import timed
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Numero di scene oltre il quale il matching recupera le scene candidate da
+# un SceneIndex invece di calcolare l'intera matrice di similarità
+INDEX_MIN_SCENES = 512
+
 class CaptionGeneratorDetailed:
     """
     Classe per la generazione di didascalie dettagliate per le scene video
     utilizzando un modello di visione-linguaggio pre-addestrato.
     """
     
-    def __init__(self, model_name="google/flan-t5-base"):
+    def __init__(self, model_name="google/flan-t5-base", batch_size=32, model_client=None):
         """
         Inizializza il generatore di didascalie.
         
         Args:
             model_name: Nome del modello Hugging Face da utilizzare
+            batch_size: Numero di immagini per chiamata al modello
+            model_client: ModelClient opzionale: se indicato, le didascalie
+                vengono generate dal server dei modelli condiviso invece che
+                da un modello caricato in questo processo
         """
         self.model_name = model_name
         self.model = None
         self.tokenizer = None
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Utilizzo del dispositivo: {self.device}")
+        self.batch_size = batch_size
+        self.model_client = model_client
+    
+    @property
+    def device(self):
+        return _select_device()
     
     def load_model(self):
         """
         Carica il modello di generazione delle didascalie.
         """
+        # Importato qui: transformers (e torch) rallentano l'avvio e occupano
+        # memoria anche nei processi che non caricano mai il modello
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+        
         try:
             logger.info(f"Caricamento del modello {self.model_name}...")
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
@@ -42,6 +62,7 @@ class CaptionGeneratorDetailed:
             logger.error(f"Errore durante il caricamento del modello: {str(e)}")
             raise
     
+    @timed("generate_caption")
     def generate_caption(self, image_path):
         """
         Genera una didascalia per un'immagine.
@@ -59,32 +80,107 @@ class CaptionGeneratorDetailed:
             # In un'implementazione reale, qui utilizzeremmo un modello di visione-linguaggio
             # per generare una didascalia basata sull'immagine
             # Per ora, restituiamo una didascalia predefinita basata sul nome del file
-            
-            # Estrai il nome del file senza estensione
-            filename = os.path.basename(image_path)
-            scene_number = int(os.path.splitext(filename)[0])
-            
-            # Didascalie predefinite per la simulazione
-            captions = [
-                "Un uomo cammina lungo una strada deserta al tramonto, con lo sguardo pensieroso",
-                "Una donna guarda fuori dalla finestra con espressione preoccupata, tenendo un telefono in mano",
-                "Due persone conversano animatamente in un caffè affollato, gesticolando con enfasi",
-                "Un'auto sportiva rossa sfreccia lungo un'autostrada di notte, con i fari che illuminano la strada",
-                "Un telefono squilla insistentemente in una stanza vuota, mentre la luce del sole filtra dalle tende",
-                "Un gruppo di amici festeggia con entusiasmo a una festa in giardino, alzando i bicchieri in un brindisi",
-                "Un bambino gioca spensierato in un parco soleggiato, lanciando un aquilone colorato nel cielo",
-                "Una coppia cammina mano nella mano sulla spiaggia al tramonto, lasciando impronte sulla sabbia",
-                "Un uomo in abito formale entra con determinazione in un imponente edificio d'ufficio in vetro e acciaio",
-                "Una donna legge assorta un libro in una biblioteca silenziosa, circondata da scaffali pieni di volumi"
-            ]
-            
-            # Seleziona una didascalia in base al numero della scena
-            caption_index = (scene_number - 1) % len(captions)
-            return captions[caption_index]
+            return _simulated_caption(image_path)
             
         except Exception as e:
             logger.error(f"Errore durante la generazione della didascalia: {str(e)}")
             return "Scena non identificata"
+    
+    @timed("generate_captions", items=len)
+    def generate_captions_batch(self, image_paths, batch_size=None, progress_callback=None):
+        """
+        Genera le didascalie per una lista di immagini, in batch.
+        
+        Il modello viene chiamato una sola volta per ogni batch di immagini
+        (vedi _generate_batch) invece che una volta per immagine.
+        
+        Args:
+            image_paths: Lista dei percorsi delle immagini
+            batch_size: Numero di immagini per chiamata al modello (default:
+                quello del generatore)
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback("captions", "progress", dettagli) con
+                didascalie completate e tempo residuo stimato
+        
+        Returns:
+            Lista delle didascalie, nello stesso ordine delle immagini
+        """
+        if self.model_client is not None:
+            return self.model_client.generate_captions(image_paths, progress_callback=progress_callback)
+        
+        if self.model is None:
+            self.load_model()
+        
+        batch_size = batch_size or self.batch_size
+        tracker = ProgressTracker(progress_callback, "captions", len(image_paths), unit="captions")
+        logger.info(f"Generazione di {len(image_paths)} didascalie in batch da {batch_size}")
+        
+        captions = []
+        for batch_start in range(0, len(image_paths), batch_size):
+            batch_paths = image_paths[batch_start:batch_start + batch_size]
+            captions.extend(self._generate_batch(batch_paths))
+            tracker.advance(len(batch_paths))
+        
+        return captions
+    
+    def _generate_batch(self, image_paths):
+        """
+        Genera le didascalie di un batch con un'unica chiamata al modello.
+        
+        Args:
+            image_paths: Percorsi delle immagini del batch
+        
+        Returns:
+            Lista delle didascalie, una per immagine
+        """
+        # In un'implementazione reale, qui le immagini del batch verrebbero lette,
+        # impilate in un unico tensore e passate al modello di visione-linguaggio
+        # con una sola chiamata model.generate. Il modello caricato riceve solo
+        # testo: le immagini non vengono decodificate finché nessuno le usa e,
+        # come in generate_caption, le didascalie sono predefinite
+        captions = []
+        for image_path in image_paths:
+            try:
+                captions.append(_simulated_caption(image_path))
+            except ValueError:
+                captions.append("Scena non identificata")
+        return captions
+
+
+# Didascalie predefinite per la simulazione
+_SIMULATED_CAPTIONS = [
+    "Un uomo cammina lungo una strada deserta al tramonto, con lo sguardo pensieroso",
+    "Una donna guarda fuori dalla finestra con espressione preoccupata, tenendo un telefono in mano",
+    "Due persone conversano animatamente in un caffè affollato, gesticolando con enfasi",
+    "Un'auto sportiva rossa sfreccia lungo un'autostrada di notte, con i fari che illuminano la strada",
+    "Un telefono squilla insistentemente in una stanza vuota, mentre la luce del sole filtra dalle tende",
+    "Un gruppo di amici festeggia con entusiasmo a una festa in giardino, alzando i bicchieri in un brindisi",
+    "Un bambino gioca spensierato in un parco soleggiato, lanciando un aquilone colorato nel cielo",
+    "Una coppia cammina mano nella mano sulla spiaggia al tramonto, lasciando impronte sulla sabbia",
+    "Un uomo in abito formale entra con determinazione in un imponente edificio d'ufficio in vetro e acciaio",
+    "Una donna legge assorta un libro in una biblioteca silenziosa, circondata da scaffali pieni di volumi"
+]
+
+def _simulated_caption(image_path):
+    """
+    Didascalia predefinita in base al numero della scena nel nome del file.
+    """
+    filename = os.path.basename(image_path)
+    scene_number = int(os.path.splitext(filename)[0])
+    return _SIMULATED_CAPTIONS[(scene_number - 1) % len(_SIMULATED_CAPTIONS)]
+
+
+@functools.lru_cache(maxsize=None)
+def _select_device():
+    """
+    Dispositivo su cui eseguire i modelli. torch viene importato solo al
+    primo utilizzo, cioè quando un modello viene caricato o usato.
+    """
+    import torch
+    
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Utilizzo del dispositivo: {device}")
+    return device
 
 
 class CLIPModelIntegration:
@@ -93,23 +189,34 @@ class CLIPModelIntegration:
     tra testo e immagini.
     """
     
-    def __init__(self, model_name="ViT-B/32"):
+    def __init__(self, model_name="ViT-B/32", embedding_store=None, model_client=None):
         """
         Inizializza l'integrazione CLIP.
         
         Args:
             model_name: Nome del modello CLIP da utilizzare
+            embedding_store: EmbeddingStore opzionale in cui riutilizzare gli
+                embedding delle immagini già calcolati
+            model_client: ModelClient opzionale: se indicato, gli embedding
+                vengono calcolati dal server dei modelli condiviso
         """
         self.model_name = model_name
+        self.embedding_store = embedding_store
+        self.model_client = model_client
         self.model = None
         self.preprocess = None
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Utilizzo del dispositivo: {self.device}")
+    
+    @property
+    def device(self):
+        return _select_device()
     
     def load_model(self):
         """
         Carica il modello CLIP.
         """
+        # Importato qui, come transformers per il generatore di didascalie
+        import clip
+        
         try:
             logger.info(f"Caricamento del modello CLIP {self.model_name}...")
             self.model, self.preprocess = clip.load(self.model_name, device=self.device)
@@ -118,6 +225,205 @@ class CLIPModelIntegration:
             logger.error(f"Errore durante il caricamento del modello CLIP: {str(e)}")
             raise
     
+    @timed("encode_images", items=len)
+    def encode_images(self, image_paths, batch_size=32):
+        """
+        Calcola gli embedding CLIP normalizzati per un insieme di immagini.
+        
+        Ogni immagine viene letta una sola volta e le immagini vengono elaborate
+        in batch con un'unica chiamata al modello per batch. Se è configurato un
+        archivio degli embedding, le immagini già codificate con lo stesso
+        modello vengono recuperate dall'archivio tramite l'hash del contenuto.
+        
+        Args:
+            image_paths: Lista di percorsi delle immagini
+            batch_size: Numero di immagini elaborate per ogni chiamata al modello
+            
+        Returns:
+            Matrice numpy (len(image_paths) x dim) di embedding normalizzati;
+            le immagini non leggibili hanno un embedding nullo
+        """
+        if self.embedding_store is None:
+            features, _ = self._encode_image_files(image_paths, batch_size)
+            return self._normalize(features)
+        
+        # Calcola l'hash del contenuto di ogni immagine
+        keys = []
+        for image_path in image_paths:
+            try:
+                keys.append(self.embedding_store.content_hash(image_path))
+            except OSError:
+                keys.append(None)
+        
+        cached = self.embedding_store.get_many(self.model_name, [key for key in keys if key])
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        logger.info(f"Embedding recuperati dall'archivio: {len(image_paths) - len(missing)}/{len(image_paths)}")
+        
+        # Codifica solo le immagini non presenti nell'archivio
+        if missing or not cached:
+            missing_features, valid = self._encode_image_files([image_paths[i] for i in missing], batch_size)
+            embedding_dim = missing_features.shape[1]
+            
+            # Salva nell'archivio i nuovi embedding delle immagini leggibili
+            store_rows = [j for j, i in enumerate(missing) if valid[j] and keys[i]]
+            if store_rows:
+                self.embedding_store.put_many(
+                    self.model_name,
+                    [keys[missing[j]] for j in store_rows],
+                    self._normalize(missing_features[store_rows])
+                )
+        else:
+            embedding_dim = len(next(iter(cached.values())))
+        
+        features = np.zeros((len(image_paths), embedding_dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                features[i] = cached[key]
+        if missing:
+            features[missing] = missing_features
+        
+        return self._normalize(features)
+    
+    def cached_image_embeddings(self, image_paths):
+        """
+        Recupera dall'archivio degli embedding, senza codificare, gli embedding
+        delle immagini già codificate con il modello.
+        
+        Args:
+            image_paths: Lista di percorsi delle immagini
+            
+        Returns:
+            Matrice numpy (len(image_paths) x dim) di embedding normalizzati,
+            con righe nulle per le immagini non presenti nell'archivio, o None
+            se nessuna immagine è presente
+        """
+        if self.embedding_store is None:
+            return None
+        
+        keys = []
+        for image_path in image_paths:
+            try:
+                keys.append(self.embedding_store.content_hash(image_path))
+            except OSError:
+                keys.append(None)
+        
+        cached = self.embedding_store.get_many(self.model_name, [key for key in keys if key])
+        if not cached:
+            return None
+        
+        features = np.zeros((len(image_paths), len(next(iter(cached.values())))), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                features[i] = cached[key]
+        
+        return self._normalize(features)
+    
+    def _encode_image_files(self, image_paths, batch_size):
+        """
+        Codifica le immagini con il modello CLIP, in batch.
+        
+        Returns:
+            Matrice di embedding non normalizzati e lista di flag che indicano
+            quali immagini sono state lette correttamente
+        """
+        if self.model_client is not None:
+            return self.model_client.encode_image_files(image_paths)
+        
+        if self.model is None:
+            self.load_model()
+        
+        import torch
+        
+        embedding_dim = self.model.visual.output_dim
+        features = np.zeros((len(image_paths), embedding_dim), dtype=np.float32)
+        valid = [False] * len(image_paths)
+        
+        for batch_start in range(0, len(image_paths), batch_size):
+            batch_paths = image_paths[batch_start:batch_start + batch_size]
+            
+            # Pre-elabora le immagini del batch, saltando quelle non leggibili
+            tensors = []
+            indices = []
+            for offset, image_path in enumerate(batch_paths):
+                try:
+                    with Image.open(image_path) as image:
+                        tensors.append(self.preprocess(image.convert("RGB")))
+                    indices.append(batch_start + offset)
+                except Exception as e:
+                    logger.warning(f"Impossibile leggere l'immagine {image_path}: {str(e)}")
+            
+            if not tensors:
+                continue
+            
+            with torch.no_grad():
+                batch = torch.stack(tensors).to(self.device)
+                batch_features = self.model.encode_image(batch).float().cpu().numpy()
+            
+            features[indices] = batch_features
+            for index in indices:
+                valid[index] = True
+        
+        return features, valid
+    
+    @timed("encode_texts", items=len)
+    def encode_texts(self, texts):
+        """
+        Calcola gli embedding CLIP normalizzati per un insieme di testi.
+        
+        Se è configurato un archivio degli embedding, i testi già codificati
+        con lo stesso modello (ad esempio le frasi non modificate di un
+        riassunto) vengono recuperati dall'archivio tramite l'hash del testo.
+        
+        Args:
+            texts: Lista di testi
+            
+        Returns:
+            Matrice numpy (len(texts) x dim) di embedding normalizzati
+        """
+        if self.embedding_store is None or not texts:
+            return self._encode_text_list(texts)
+        
+        store_name = f"{self.model_name}:text"
+        keys = [sentence_hash(text) for text in texts]
+        cached = self.embedding_store.get_many(store_name, list(dict.fromkeys(keys)))
+        
+        # Codifica una sola volta ogni testo non presente nell'archivio
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        logger.info(f"Embedding dei testi recuperati dall'archivio: {len(texts) - sum(key in missing for key in keys)}/{len(texts)}")
+        if missing:
+            missing_features = self._encode_text_list(list(missing.values()))
+            self.embedding_store.put_many(store_name, list(missing), missing_features)
+            cached.update(zip(missing, missing_features))
+        
+        return self._normalize(np.stack([np.asarray(cached[key], dtype=np.float32) for key in keys]))
+    
+    def _encode_text_list(self, texts):
+        if self.model_client is not None:
+            return self.model_client.encode_texts(texts)
+        
+        if self.model is None:
+            self.load_model()
+        
+        import clip
+        import torch
+        
+        with torch.no_grad():
+            tokens = clip.tokenize(texts, truncate=True).to(self.device)
+            features = self.model.encode_text(tokens).float().cpu().numpy()
+        
+        return self._normalize(features)
+    
+    @staticmethod
+    def _normalize(features):
+        """
+        Normalizza le righe di una matrice di embedding (norma L2 unitaria).
+        Le righe nulle restano nulle.
+        """
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return features / norms
+    
+    @timed("compute_similarity")
     def compute_similarity(self, image_path, text):
         """
         Calcola la similarità semantica tra un'immagine e un testo.
@@ -129,24 +435,11 @@ class CLIPModelIntegration:
         Returns:
             Punteggio di similarità
         """
-        if self.model is None:
-            self.load_model()
-        
         try:
-            # In un'implementazione reale, qui utilizzeremmo CLIP per calcolare
-            # la similarità tra l'immagine e il testo
-            # Per ora, simuliamo il calcolo della similarità
-            
-            # Estrai il numero della scena dal nome del file
-            filename = os.path.basename(image_path)
-            scene_number = int(os.path.splitext(filename)[0])
-            
-            # Calcola una similarità simulata basata sulla lunghezza del testo e sul numero della scena
-            text_length = len(text)
-            similarity = 0.5 + 0.3 * np.sin(scene_number * 0.5 + text_length * 0.01)
+            similarity_matrix, _ = self.find_best_match_batched([image_path], [text])
             
             # Limita il valore tra 0 e 1
-            similarity = max(0, min(1, similarity))
+            similarity = max(0.0, min(1.0, float(similarity_matrix[0, 0])))
             
             return similarity
             
@@ -154,6 +447,37 @@ class CLIPModelIntegration:
             logger.error(f"Errore durante il calcolo della similarità: {str(e)}")
             return 0.0
     
+    def find_best_match_batched(self, image_paths, texts, batch_size=32):
+        """
+        Trova la migliore corrispondenza tra un insieme di immagini e testi
+        calcolando l'intera matrice di similarità con un unico prodotto matriciale.
+        
+        Le immagini e i testi vengono codificati una sola volta ciascuno, invece
+        di una chiamata al modello per ogni coppia immagine-testo.
+        
+        Args:
+            image_paths: Lista di percorsi delle immagini
+            texts: Lista di testi
+            batch_size: Numero di immagini codificate per ogni chiamata al modello
+            
+        Returns:
+            Matrice di similarità (len(texts) x len(image_paths)) e indici
+            delle migliori corrispondenze per ogni testo
+        """
+        if not texts or not image_paths:
+            return np.zeros((len(texts), len(image_paths))), []
+        
+        image_features = self.encode_images(image_paths, batch_size=batch_size)
+        text_features = self.encode_texts(texts)
+        
+        # Similarità coseno tra tutti i testi e tutte le immagini
+        similarity_matrix = text_features @ image_features.T
+        
+        # Trova la migliore corrispondenza per ogni testo
+        best_matches = np.argmax(similarity_matrix, axis=1)
+        
+        return similarity_matrix, best_matches
+    
     def find_best_match(self, image_paths, texts):
         """
         Trova la migliore corrispondenza tra un insieme di immagini e testi.
@@ -165,22 +489,8 @@ class CLIPModelIntegration:
         Returns:
             Matrice di similarità e indici delle migliori corrispondenze
         """
-        if self.model is None:
-            self.load_model()
-        
         try:
-            # Crea una matrice di similarità
-            similarity_matrix = np.zeros((len(texts), len(image_paths)))
-            
-            # Calcola la similarità per ogni coppia immagine-testo
-            for i, text in enumerate(texts):
-                for j, image_path in enumerate(image_paths):
-                    similarity_matrix[i, j] = self.compute_similarity(image_path, text)
-            
-            # Trova la migliore corrispondenza per ogni testo
-            best_matches = np.argmax(similarity_matrix, axis=1)
-            
-            return similarity_matrix, best_matches
+            return self.find_best_match_batched(image_paths, texts)
             
         except Exception as e:
             logger.error(f"Errore durante la ricerca delle migliori corrispondenze: {str(e)}")
@@ -194,37 +504,187 @@ class SemanticMatchingEngine:
     e l'embedding cross-modale per associare scene a frasi del riassunto.
     """
     
-    def __init__(self):
+    def __init__(self, embedding_store=None, match_mode="argmax", model_client=None):
         """
         Inizializza il motore di matching semantico.
+        
+        Args:
+            embedding_store: EmbeddingStore opzionale condiviso tra i job, per
+                non ricodificare i thumbnail quando si ripete il matching
+            match_mode: Modalità di abbinamento predefinita (vedi
+                scene_assignment.MATCH_MODES)
+            model_client: ModelClient opzionale del server dei modelli
+                condiviso; se None i modelli vengono caricati in questo processo
         """
-        self.caption_generator = CaptionGeneratorDetailed()
-        self.clip_model = CLIPModelIntegration()
+        self.caption_generator = CaptionGeneratorDetailed(model_client=model_client)
+        self.clip_model = CLIPModelIntegration(embedding_store=embedding_store, model_client=model_client)
+        self.match_mode = match_mode
     
-    def process_scenes(self, scenes, job_id):
+    def assign(self, similarity, best_matches, scenes, match_mode=None):
+        """
+        Applica la modalità di abbinamento alla matrice di similarità.
+        
+        Args:
+            similarity: Matrice di similarità (frasi x scene)
+            best_matches: Migliori corrispondenze indipendenti per ogni frase
+            scenes: Lista di scene, usata per l'ordine temporale
+            match_mode: Modalità di abbinamento (default: quella del motore)
+            
+        Returns:
+            Indice della scena assegnata a ogni frase
+        """
+        match_mode = match_mode or self.match_mode
+        if match_mode == "argmax" or len(best_matches) == 0:
+            return best_matches
+        
+        scene_order = [scene.get("start_time", i) for i, scene in enumerate(scenes)]
+        return assign_scenes(similarity, match_mode, scene_order=scene_order)
+    
+    def build_scene_index(self, scenes, backend="auto"):
+        """
+        Costruisce l'indice degli embedding dei thumbnail delle scene.
+        
+        Args:
+            scenes: Lista di scene con percorsi dei thumbnail, anche di video diversi
+            backend: Backend dell'indice (vedi scene_index.INDEX_BACKENDS)
+            
+        Returns:
+            SceneIndex con ID uguali alla posizione delle scene nella lista, e
+            la matrice degli embedding
+        """
+        image_features = self.clip_model.encode_images([scene.get("thumbnail", "") for scene in scenes])
+        index = SceneIndex(backend)
+        index.add(range(len(scenes)), image_features)
+        return index, image_features
+    
+    def find_matches(self, scenes, texts, match_mode=None, top_k=DEFAULT_TOP_K):
+        """
+        Trova la scena da assegnare a ogni testo.
+        
+        Fino a INDEX_MIN_SCENES scene la modalità di abbinamento viene
+        applicata all'intera matrice di similarità. Oltre, ad esempio per un
+        riassunto confrontato con tutti gli episodi di una stagione, le top_k
+        scene candidate di ogni testo vengono recuperate da un SceneIndex e
+        la modalità di abbinamento viene applicata alla sola matrice tra i
+        testi e l'unione delle scene candidate.
+        
+        Args:
+            scenes: Lista di scene con percorsi dei thumbnail
+            texts: Lista di testi
+            match_mode: Modalità di abbinamento (default: quella del motore)
+            top_k: Scene candidate recuperate dall'indice per ogni testo
+            
+        Returns:
+            Indice nella lista delle scene della scena assegnata a ogni testo
+        """
+        if len(scenes) <= INDEX_MIN_SCENES or not texts:
+            thumbnail_paths = [scene.get("thumbnail", "") for scene in scenes]
+            similarity, best_matches = self.clip_model.find_best_match(thumbnail_paths, texts)
+            return self.assign(similarity, best_matches, scenes, match_mode)
+        
+        index, image_features = self.build_scene_index(scenes)
+        text_features = self.clip_model.encode_texts(texts)
+        candidate_ids, _ = index.query(text_features, top_k)
+        
+        # Matrice di similarità ridotta alle scene candidate di almeno un testo
+        columns = np.unique(np.asarray(candidate_ids).ravel())
+        similarity = text_features @ image_features[columns].T
+        logger.info(f"Scene candidate dall'indice: {len(columns)} su {len(scenes)}")
+        
+        best_matches = self.assign(
+            similarity,
+            np.argmax(similarity, axis=1),
+            [scenes[column] for column in columns],
+            match_mode
+        )
+        return columns[best_matches]
+    
+    @timed("rematch_changed", items=lambda result: result[1])
+    def rematch_changed(self, scenes, summary_segments, previous_segments, match_mode=None):
+        """
+        Abbina le scene alle frasi del riassunto riutilizzando le scene già
+        abbinate (anche manualmente) alle frasi non modificate.
+        
+        Le frasi sono confrontate tramite l'hash del testo; solo quelle nuove
+        o modificate vengono codificate e abbinate (vedi
+        scene_assignment.assign_changed), così che la modifica di una frase
+        non richieda di abbinare di nuovo l'intero riassunto.
+        
+        Args:
+            scenes: Lista di scene con percorsi dei thumbnail
+            summary_segments: Segmenti del nuovo riassunto
+            previous_segments: Segmenti abbinati del riassunto precedente
+            match_mode: Modalità di abbinamento (default: quella del motore)
+            
+        Returns:
+            Coppia (segmenti del riassunto con scene abbinate, numero di
+            frasi abbinate di nuovo)
+        """
+        if not scenes:
+            return summary_segments, 0
+        
+        match_mode = match_mode or self.match_mode
+        scene_positions = {scene["id"]: i for i, scene in enumerate(scenes)}
+        
+        # Scene delle frasi precedenti, per hash del testo (una frase può ripetersi)
+        previous = defaultdict(list)
+        for segment in previous_segments:
+            if segment.get("matchedSceneId") in scene_positions:
+                previous[sentence_hash(segment["text"])].append(scene_positions[segment["matchedSceneId"]])
+        
+        fixed = []
+        for segment in summary_segments:
+            reused = previous.get(sentence_hash(segment["text"]))
+            fixed.append(reused.pop(0) if reused else -1)
+        
+        changed = [segment["text"] for segment, position in zip(summary_segments, fixed) if position < 0]
+        logger.info(f"Frasi modificate da abbinare: {len(changed)} su {len(summary_segments)}")
+        
+        assignment = fixed
+        if changed:
+            thumbnail_paths = [scene.get("thumbnail", "") for scene in scenes]
+            similarity, _ = self.clip_model.find_best_match(thumbnail_paths, changed)
+            scene_order = [scene.get("start_time", i) for i, scene in enumerate(scenes)]
+            assignment = assign_changed(similarity, fixed, match_mode, scene_order=scene_order)
+        
+        for segment, position in zip(summary_segments, assignment):
+            segment["matchedSceneId"] = scenes[position]["id"]
+        
+        return summary_segments, len(changed)
+    
+    @timed("process_scenes", items=len)
+    def process_scenes(self, scenes, job_id, progress_callback=None):
         """
         Elabora le scene generando didascalie.
         
         Args:
             scenes: Lista di scene con percorsi dei thumbnail
             job_id: ID del job
+            progress_callback: Funzione opzionale per l'avanzamento (vedi
+                CaptionGeneratorDetailed.generate_captions_batch)
             
         Returns:
             Scene con didascalie
         """
         logger.info(f"Elaborazione di {len(scenes)} scene per il job {job_id}")
         
-        for scene in scenes:
-            # Genera una didascalia per la scena
-            thumbnail_path = scene.get("thumbnail", "")
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                scene["caption"] = self.caption_generator.generate_caption(thumbnail_path)
-            else:
-                scene["caption"] = "Scena senza thumbnail"
+        # Genera le didascalie per le scene con un thumbnail
+        has_thumbnail = [
+            bool(scene.get("thumbnail", "")) and os.path.exists(scene["thumbnail"])
+            for scene in scenes
+        ]
+        captions = iter(self.caption_generator.generate_captions_batch(
+            [scene["thumbnail"] for scene, has in zip(scenes, has_thumbnail) if has],
+            progress_callback=progress_callback
+        ))
+        
+        for scene, has in zip(scenes, has_thumbnail):
+            scene["caption"] = next(captions) if has else "Scena senza thumbnail"
         
         return scenes
     
-    def match_scenes_to_summary(self, scenes, summary_segments, job_id):
+    @timed("match_scenes", items=len)
+    def match_scenes_to_summary(self, scenes, summary_segments, job_id, match_mode=None):
         """
         Abbina le scene alle frasi del riassunto.
         
@@ -232,6 +692,7 @@ class SemanticMatchingEngine:
             scenes: Lista di scene con didascalie
             summary_segments: Lista di segmenti del riassunto
             job_id: ID del job
+            match_mode: Modalità di abbinamento (default: quella del motore)
             
         Returns:
             Segmenti del riassunto con scene abbinate
@@ -239,12 +700,11 @@ class SemanticMatchingEngine:
         logger.info(f"Abbinamento di {len(scenes)} scene a {len(summary_segments)} segmenti per il job {job_id}")
         
         try:
-            # Estrai i percorsi dei thumbnail e i testi dei segmenti
-            thumbnail_paths = [scene.get("thumbnail", "") for scene in scenes]
+            # Estrai i testi dei segmenti
             segment_texts = [segment.get("text", "") for segment in summary_segments]
             
             # Trova le migliori corrispondenze
-            _, best_matches = self.clip_model.find_best_match(thumbnail_paths, segment_texts)
+            best_matches = self.find_matches(scenes, segment_texts, match_mode)
             
             # Assegna le scene ai segmenti
             for i, segment in enumerate(summary_segments):
@@ -267,3 +727,11 @@ class SemanticMatchingEngine:
                     segment["matchedSceneId"] = scenes[0]["id"]
             
             return summary_segments
+
+
+def sentence_hash(text):
+    """
+    Hash di una frase, usato per riconoscere le frasi non modificate di un
+    riassunto (gli spazi iniziali e finali non contano).
+    """
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
@@ -1,10 +1,5 @@
 import os
 import logging
-import torch
-from transformers import AutoProcessor, AutoModelForCausalLM
-import clip
-from PIL import Image
-import numpy as np
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
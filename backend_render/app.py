@@ -1,9 +1,12 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import tempfile
 import logging
 import json
 from werkzeug.utils import secure_filename
+from chunked_upload import ChunkedUploadManager
+from video_index import VideoIndex, save_stream_with_hash
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
@@ -27,9 +30,30 @@ app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max
 # Estensioni consentite
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
 
+# Caricamenti a chunk, riprendibili
+upload_manager = ChunkedUploadManager(UPLOAD_FOLDER, max_size=app.config['MAX_CONTENT_LENGTH'])
+
+# Indice dei video per hash del contenuto: l'ID del video deriva dall'hash e
+# ogni caricamento riceve un proprio ID del job ("<video_id>-<suffisso>")
+video_index = VideoIndex(os.path.join(TEMP_FOLDER, 'videos.db'), UPLOAD_FOLDER)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_summary(job_id, summary):
+    # Salva il riassunto accanto al video caricato
+    summary_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_summary.txt")
+    with open(summary_path, 'w') as f:
+        f.write(summary)
+    return summary_path
+
+def new_upload_path(filename):
+    # File provvisorio per un caricamento: VideoIndex.register lo sposta nel
+    # percorso definitivo, derivato dall'hash del contenuto
+    fd, path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], prefix='.', suffix=f"_{filename}")
+    os.close(fd)
+    return path
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Backend server is running"}), 200
@@ -56,27 +80,127 @@ def upload_file():
     
     summary = request.form['summary']
     
-    # Salva il file
+    # Salva il file calcolandone l'hash durante la copia
     filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
+    upload_path = new_upload_path(filename)
+    sha256 = save_stream_with_hash(file.stream, upload_path)
     
-    # Salva il riassunto
-    summary_filename = f"{os.path.splitext(filename)[0]}_summary.txt"
-    summary_path = os.path.join(app.config['UPLOAD_FOLDER'], summary_filename)
-    with open(summary_path, 'w') as f:
-        f.write(summary)
+    # L'ID del video deriva dal contenuto: lo stesso video caricato più volte
+    # viene salvato una sola volta, ma ogni caricamento ha un proprio job
+    video = video_index.register(sha256, upload_path, filename)
+    job_id = video["job_id"]
     
-    # Crea un ID per il job
-    job_id = os.path.splitext(filename)[0]
+    # Salva il riassunto
+    summary_path = save_summary(job_id, summary)
     
     # In un'implementazione reale, qui si avvierebbe il processo di elaborazione in background
     
     return jsonify({
         "message": "Upload successful",
         "job_id": job_id,
-        "video_path": file_path,
-        "summary_path": summary_path
+        "video_id": video["video_id"],
+        "video_path": video["video_path"],
+        "summary_path": summary_path,
+        "sha256": sha256,
+        "deduplicated": video["deduplicated"]
+    }), 200
+
+@app.route('/api/upload/init', methods=['POST'])
+def init_chunked_upload():
+    # Apre un caricamento a chunk: il file viene inviato con PUT /api/upload/<upload_id>
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    
+    data = request.json
+    filename = secure_filename(data.get('filename', ''))
+    
+    if filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({"error": f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
+    
+    if 'summary' not in data:
+        return jsonify({"error": "No summary provided"}), 400
+    
+    try:
+        total_size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid size"}), 400
+    
+    # Stesso limite dei caricamenti in un'unica richiesta
+    if total_size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({"error": f"File too large. Maximum size: {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+    
+    try:
+        status = upload_manager.initiate(filename, total_size, data['summary'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(status), 201
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    # Stato del caricamento: next_offset indica da dove riprendere
+    status = upload_manager.get_status(upload_id)
+    
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    
+    return jsonify(status), 200
+
+@app.route('/api/upload/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # Il corpo della richiesta contiene i byte del chunk, scritti a partire da ?offset=
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"error": "Missing or invalid offset"}), 400
+    
+    if not request.content_length:
+        return jsonify({"error": "Empty chunk"}), 400
+    
+    try:
+        status = upload_manager.write_chunk(upload_id, offset, request.stream, request.content_length)
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(status), 200
+
+@app.route('/api/upload/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    # Conclude il caricamento, verificando l'hash SHA-256 se fornito dal client
+    expected_sha256 = request.json.get('sha256') if request.is_json else None
+    
+    status = upload_manager.get_status(upload_id)
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    
+    upload_path = new_upload_path(status["filename"])
+    
+    try:
+        result = upload_manager.finalize(upload_id, expected_sha256, destination=upload_path)
+    except KeyError:
+        os.remove(upload_path)
+        return jsonify({"error": "Upload not found"}), 404
+    except ValueError as e:
+        os.remove(upload_path)
+        return jsonify({"error": str(e)}), 400
+    
+    video = video_index.register(result["sha256"], upload_path, result["filename"])
+    job_id = video["job_id"]
+    summary_path = save_summary(job_id, result["summary"])
+    
+    return jsonify({
+        "message": "Upload successful",
+        "job_id": job_id,
+        "video_id": video["video_id"],
+        "video_path": video["video_path"],
+        "summary_path": summary_path,
+        "sha256": result["sha256"],
+        "deduplicated": video["deduplicated"]
     }), 200
 
 @app.route('/api/process/<job_id>', methods=['POST'])
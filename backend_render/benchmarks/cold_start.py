@@ -0,0 +1,95 @@
+"""
+Benchmark dell'avvio a freddo dell'API.
+
+Avvia più volte un nuovo processo Python che importa main e risponde a
+/api/health, e misura il tempo dall'avvio del processo alla risposta. Il
+benchmark fallisce se la latenza supera il limite indicato o se l'avvio
+importa i moduli dei modelli (torch, transformers, clip), che devono essere
+caricati solo dai processi che eseguono un modello.
+
+Uso:
+    python benchmarks/cold_start.py [--runs 10] [--budget 2.0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Cartella dell'API (contiene main.py)
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduli che non devono essere importati all'avvio
+HEAVY_MODULES = ("torch", "transformers", "clip", "cv2", "scenedetect", "moviepy")
+
+# Codice eseguito nel processo misurato: l'istante di avvio arriva come argomento
+CHILD_CODE = """
+import sys, time, json
+start = float(sys.argv[1])
+import main
+response = main.app.test_client().get('/api/health')
+print(json.dumps({
+    "status": response.status_code,
+    "latency": time.time() - start,
+    "heavy_modules": [name for name in %r if name in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+def measure_cold_start():
+    """
+    Avvia un processo Python e misura il tempo fino alla risposta di /api/health.
+    
+    Returns:
+        Dizionario con status, latency (secondi) e heavy_modules importati
+    """
+    # Nessun worker in background: il benchmark misura solo l'avvio dell'app
+    env = dict(os.environ, JOB_WORKERS="0")
+    
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE, repr(time.time())],
+        cwd=API_FOLDER, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Avvio dell'API fallito: {result.stderr.strip()}")
+    
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'avvio a freddo dell'API")
+    parser.add_argument("--runs", type=int, default=10, help="Numero di avvii misurati")
+    parser.add_argument("--warmup", type=int, default=1, help="Avvii iniziali non misurati (cache del disco e bytecode)")
+    parser.add_argument("--budget", type=float, default=2.0, help="Latenza massima ammessa, in secondi")
+    args = parser.parse_args()
+    
+    for _ in range(args.warmup):
+        measure_cold_start()
+    
+    runs = [measure_cold_start() for _ in range(args.runs)]
+    latencies = sorted(run["latency"] for run in runs)
+    
+    print(f"Avvii misurati: {len(latencies)}")
+    print(f"Latenza /api/health dall'avvio del processo: "
+          f"mediana {statistics.median(latencies):.3f}s, massima {latencies[-1]:.3f}s")
+    
+    failures = []
+    if any(run["status"] != 200 for run in runs):
+        failures.append("/api/health non ha risposto 200")
+    
+    heavy_modules = sorted({name for run in runs for name in run["heavy_modules"]})
+    if heavy_modules:
+        failures.append(f"moduli pesanti importati all'avvio: {', '.join(heavy_modules)}")
+    
+    if latencies[-1] > args.budget:
+        failures.append(f"latenza massima {latencies[-1]:.3f}s oltre il limite di {args.budget:.3f}s")
+    
+    for failure in failures:
+        print(f"FALLITO: {failure}")
+    
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
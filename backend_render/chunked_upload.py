@@ -0,0 +1,396 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Dimensione consigliata ai client per ogni chunk
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Dimensione dei blocchi letti dal corpo della richiesta e scritti su disco
+READ_BLOCK_SIZE = 1024 * 1024
+
+class ChunkedUploadManager:
+    """
+    Gestisce i caricamenti a chunk, riprendibili, dei video.
+    
+    Il client apre una sessione indicando nome e dimensione del file, invia i
+    chunk con il relativo offset e infine conclude il caricamento. Ogni chunk
+    viene letto dal corpo della richiesta a blocchi e scritto direttamente
+    nella posizione finale del file con os.pwrite, senza file temporanei
+    intermedi. L'hash SHA-256 viene calcolato mentre i chunk arrivano; se un
+    chunk arriva fuori ordine, o da un altro processo, l'hash recupera i byte
+    mancanti rileggendoli dal file.
+    
+    Le sessioni (intervalli ricevuti, dimensione, riassunto) sono salvate su
+    disco, quindi un caricamento interrotto può riprendere anche dopo un
+    riavvio del server, dal primo byte non ricevuto. Le sessioni abbandonate,
+    con i relativi file preallocati, vengono rimosse all'avvio e all'apertura
+    di ogni nuova sessione.
+    """
+    
+    def __init__(self, upload_folder, chunk_size=DEFAULT_CHUNK_SIZE, session_ttl=24 * 3600, max_size=None):
+        """
+        Inizializza il gestore dei caricamenti.
+        
+        Args:
+            upload_folder: Cartella in cui salvare i file caricati
+            chunk_size: Dimensione dei chunk consigliata ai client
+            session_ttl: Durata, in secondi, di una sessione inattiva prima della rimozione
+            max_size: Dimensione massima di un file, in byte (None: nessun limite)
+        """
+        self.upload_folder = upload_folder
+        self.sessions_folder = os.path.join(upload_folder, "chunked")
+        self.chunk_size = chunk_size
+        self.session_ttl = session_ttl
+        self.max_size = max_size
+        os.makedirs(self.sessions_folder, exist_ok=True)
+        
+        # Stato dell'hash incrementale per ogni sessione: upload_id -> _HashState
+        self._hash_states = {}
+        self._lock = threading.Lock()
+        
+        self.cleanup_expired()
+    
+    def initiate(self, filename, total_size, summary=None):
+        """
+        Apre una sessione di caricamento e prealloca il file di destinazione.
+        
+        Args:
+            filename: Nome (già validato) del file da caricare
+            total_size: Dimensione totale del file, in byte
+            summary: Riassunto associato al video
+        
+        Returns:
+            Stato della sessione
+        """
+        if total_size <= 0:
+            raise ValueError("Dimensione del file non valida")
+        if self.max_size is not None and total_size > self.max_size:
+            raise ValueError(f"File troppo grande: {total_size} byte (massimo {self.max_size})")
+        
+        self.cleanup_expired()
+        
+        upload_id = uuid.uuid4().hex
+        
+        with open(self._part_path(upload_id), 'wb') as f:
+            f.truncate(total_size)
+        
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "total_size": total_size,
+            "summary": summary,
+            "received": [],
+            "created_at": time.time()
+        }
+        self._save_session(session)
+        
+        logger.info(f"Caricamento {upload_id} avviato: {filename} ({total_size} byte)")
+        return self._describe(session)
+    
+    def get_status(self, upload_id):
+        """
+        Restituisce lo stato di una sessione di caricamento.
+        
+        Returns:
+            Dizionario con byte ricevuti e offset da cui riprendere, o None se
+            la sessione non esiste
+        """
+        session = self._load_session(upload_id)
+        if session is None:
+            return None
+        return self._describe(session)
+    
+    def write_chunk(self, upload_id, offset, stream, length):
+        """
+        Scrive un chunk nella sua posizione del file di destinazione.
+        
+        Args:
+            upload_id: ID della sessione di caricamento
+            offset: Posizione del chunk nel file, in byte
+            stream: Oggetto file da cui leggere il chunk (es. request.stream)
+            length: Lunghezza del chunk, in byte
+        
+        Returns:
+            Stato aggiornato della sessione
+        """
+        session = self._load_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        
+        if offset < 0 or length <= 0 or offset + length > session["total_size"]:
+            raise ValueError(f"Chunk non valido: offset {offset}, lunghezza {length}, dimensione {session['total_size']}")
+        
+        hash_state = self._get_hash_state(upload_id)
+        
+        # Se il chunk prosegue esattamente la parte già inclusa nell'hash, l'hash
+        # viene aggiornato durante la scrittura, senza rileggere i dati dal disco
+        hashing = hash_state.lock.acquire(blocking=False)
+        if hashing and hash_state.offset != offset:
+            hash_state.lock.release()
+            hashing = False
+        
+        position = offset
+        fd = os.open(self._part_path(upload_id), os.O_WRONLY)
+        try:
+            while position < offset + length:
+                block = stream.read(min(READ_BLOCK_SIZE, offset + length - position))
+                if not block:
+                    break
+                
+                view = memoryview(block)
+                while view:
+                    written = os.pwrite(fd, view, position)
+                    position += written
+                    view = view[written:]
+                
+                if hashing:
+                    hash_state.hasher.update(block)
+                    hash_state.offset = position
+        finally:
+            os.close(fd)
+            if hashing:
+                hash_state.lock.release()
+            
+            # Anche un chunk interrotto registra i byte effettivamente scritti
+            if position > offset:
+                session = self._record_range(upload_id, offset, position)
+        
+        if position < offset + length:
+            raise ValueError(f"Chunk incompleto: ricevuti {position - offset} byte su {length}")
+        
+        return self._describe(session)
+    
+    def finalize(self, upload_id, expected_sha256=None, destination=None):
+        """
+        Conclude un caricamento: verifica che tutti i byte siano stati ricevuti,
+        completa l'hash e sposta il file nella cartella dei caricamenti.
+        
+        Args:
+            upload_id: ID della sessione di caricamento
+            expected_sha256: Hash SHA-256 calcolato dal client, se disponibile
+            destination: Percorso finale del file (default: nome originale
+                nella cartella dei caricamenti)
+        
+        Returns:
+            Dizionario con percorso, nome, dimensione, hash e riassunto del file
+        """
+        session = self._load_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        
+        total_size = session["total_size"]
+        if self._contiguous_end(session) < total_size:
+            raise ValueError(f"Caricamento incompleto: ricevuti {self._received_bytes(session)} byte su {total_size}")
+        
+        sha256 = self._advance_hash(upload_id, total_size)
+        
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise ValueError("L'hash SHA-256 del file non corrisponde a quello atteso")
+        
+        file_path = destination or os.path.join(self.upload_folder, session["filename"])
+        os.replace(self._part_path(upload_id), file_path)
+        self._remove_session(upload_id)
+        
+        logger.info(f"Caricamento {upload_id} completato: {file_path} (sha256 {sha256})")
+        return {
+            "file_path": file_path,
+            "filename": session["filename"],
+            "size": total_size,
+            "sha256": sha256,
+            "summary": session["summary"]
+        }
+    
+    def cleanup_expired(self):
+        """
+        Rimuove le sessioni inattive da più di session_ttl secondi, insieme ai
+        file preallocati; rimuove anche i file rimasti senza sessione (es. un
+        avvio interrotto prima del salvataggio della sessione).
+        
+        Returns:
+            Numero di caricamenti rimossi
+        """
+        now = time.time()
+        
+        # Ultima attività di ogni caricamento: quella della sessione, aggiornata
+        # a ogni chunk, o dei file rimasti se la sessione non esiste
+        last_activity = {}
+        sessions = set()
+        for name in os.listdir(self.sessions_folder):
+            upload_id, ext = os.path.splitext(name)
+            if ext not in (".json", ".part", ".lock", ".tmp"):
+                continue
+            if ext == ".tmp":
+                upload_id = os.path.splitext(upload_id)[0]
+            
+            try:
+                mtime = os.stat(os.path.join(self.sessions_folder, name)).st_mtime
+            except FileNotFoundError:
+                continue
+            
+            if ext == ".json":
+                sessions.add(upload_id)
+                last_activity[upload_id] = mtime
+            elif upload_id not in sessions:
+                last_activity[upload_id] = max(last_activity.get(upload_id, 0), mtime)
+        
+        removed = 0
+        for upload_id, mtime in last_activity.items():
+            if now - mtime <= self.session_ttl:
+                continue
+            
+            try:
+                logger.info(f"Rimozione del caricamento scaduto {upload_id}")
+                self._remove_session(upload_id, remove_part=True)
+                removed += 1
+            except KeyError:
+                # File estranei alle sessioni
+                continue
+        
+        return removed
+    
+    def _advance_hash(self, upload_id, target):
+        """
+        Porta l'hash incrementale fino al byte target, rileggendo dal file i
+        byte non ancora inclusi. Restituisce l'hash esadecimale corrente.
+        """
+        hash_state = self._get_hash_state(upload_id)
+        
+        with hash_state.lock:
+            if hash_state.offset < target:
+                fd = os.open(self._part_path(upload_id), os.O_RDONLY)
+                try:
+                    while hash_state.offset < target:
+                        block = os.pread(fd, min(READ_BLOCK_SIZE, target - hash_state.offset), hash_state.offset)
+                        if not block:
+                            break
+                        hash_state.hasher.update(block)
+                        hash_state.offset += len(block)
+                finally:
+                    os.close(fd)
+            
+            return hash_state.hasher.hexdigest()
+    
+    def _get_hash_state(self, upload_id):
+        with self._lock:
+            if upload_id not in self._hash_states:
+                self._hash_states[upload_id] = _HashState()
+            return self._hash_states[upload_id]
+    
+    def _record_range(self, upload_id, start, end):
+        """
+        Aggiunge un intervallo ricevuto alla sessione, unendo quelli adiacenti.
+        Le sessioni sono condivise tra processi: l'aggiornamento avviene sotto lock.
+        """
+        with open(self._lock_path(upload_id), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                session = self._load_session(upload_id)
+                if session is None:
+                    raise KeyError(upload_id)
+                
+                merged = []
+                for range_start, range_end in sorted(session["received"] + [[start, end]]):
+                    if merged and range_start <= merged[-1][1]:
+                        merged[-1][1] = max(merged[-1][1], range_end)
+                    else:
+                        merged.append([range_start, range_end])
+                
+                session["received"] = merged
+                self._save_session(session)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        
+        # I chunk arrivati fuori ordine possono aver completato la parte iniziale del file
+        contiguous_end = self._contiguous_end(session)
+        hash_state = self._get_hash_state(upload_id)
+        if hash_state.offset < contiguous_end and not hash_state.lock.locked():
+            self._advance_hash(upload_id, contiguous_end)
+        
+        return session
+    
+    def _describe(self, session):
+        return {
+            "upload_id": session["upload_id"],
+            "filename": session["filename"],
+            "total_size": session["total_size"],
+            "received_bytes": self._received_bytes(session),
+            "next_offset": self._contiguous_end(session),
+            "received": session["received"],
+            "chunk_size": self.chunk_size,
+            "complete": self._contiguous_end(session) >= session["total_size"]
+        }
+    
+    @staticmethod
+    def _contiguous_end(session):
+        received = session["received"]
+        if received and received[0][0] == 0:
+            return received[0][1]
+        return 0
+    
+    @staticmethod
+    def _received_bytes(session):
+        return sum(end - start for start, end in session["received"])
+    
+    def _load_session(self, upload_id):
+        try:
+            with open(self._session_path(upload_id), 'r') as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError, ValueError):
+            return None
+    
+    def _save_session(self, session):
+        session_path = self._session_path(session["upload_id"])
+        temp_path = f"{session_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(temp_path, session_path)
+    
+    def _remove_session(self, upload_id, remove_part=False):
+        paths = [self._session_path(upload_id), self._lock_path(upload_id), f"{self._session_path(upload_id)}.tmp"]
+        if remove_part:
+            paths.append(self._part_path(upload_id))
+        
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        
+        with self._lock:
+            self._hash_states.pop(upload_id, None)
+    
+    def _session_path(self, upload_id):
+        return os.path.join(self.sessions_folder, f"{self._check_id(upload_id)}.json")
+    
+    def _part_path(self, upload_id):
+        return os.path.join(self.sessions_folder, f"{self._check_id(upload_id)}.part")
+    
+    def _lock_path(self, upload_id):
+        return os.path.join(self.sessions_folder, f"{self._check_id(upload_id)}.lock")
+    
+    @staticmethod
+    def _check_id(upload_id):
+        # Gli ID sono generati con uuid4().hex: qualsiasi altro valore viene rifiutato
+        if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        return upload_id
+
+
+class _HashState:
+    """
+    Hash SHA-256 incrementale di un caricamento e numero di byte già inclusi.
+    """
+    
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.lock = threading.Lock()
@@ -1,11 +1,25 @@
 import os
+import time
+import mimetypes
+import atexit
+import hashlib
+import tempfile
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_cors import CORS
 import json
 from werkzeug.utils import secure_filename
 from video_segmenter import VideoSegmenter
-from ai_modules import CaptionGenerator, SemanticMatcher, MontageGenerator
+from job_queue import JobQueue, JobWorkerPool, run_job, worker_identity
+from chunked_upload import ChunkedUploadManager
+from video_index import VideoIndex, save_stream_with_hash, video_id_of
+from scene_assignment import MATCH_MODES
+from proxy_video import ProxyGenerator
+from video_processing import MontageCompiler
+from metrics import registry as metrics_registry
+from scene_catalog import SceneCatalog, SEARCH_MODES
+from model_server import ModelClient
+from optimized_processing import PerformanceOptimizer, matching_cache_stage
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
@@ -24,24 +38,159 @@ for folder in [UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+# Cartella in cui ogni processo (API, worker, server dei modelli) scrive le
+# metriche degli stage, riunite da /api/metrics; ereditata dai processi avviati
+os.environ.setdefault('METRICS_DIR', os.path.join(TEMP_FOLDER, 'metrics'))
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max
 
+# Con USE_X_SENDFILE=1 i video vengono inviati dal proxy (nginx, Apache) tramite
+# l'header X-Sendfile, che gestisce anche le richieste Range senza passare da Python
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
 # Estensioni consentite
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
 
+# Numero di processi worker per l'elaborazione in background.
+# Con 0 i job vengono eseguiti in modo sincrono nella richiesta (default su Vercel,
+# dove non possono restare processi attivi tra una richiesta e l'altra)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 0 if os.environ.get('VERCEL') else 2))
+
+# Socket Unix del server dei modelli condiviso dai worker: i modelli vengono
+# caricati una sola volta invece che in ogni worker. Con MODEL_SERVER=0 ogni
+# worker carica i propri modelli
+MODEL_SERVER = os.environ.get('MODEL_SERVER', '1') != '0'
+MODEL_SERVER_SOCKET = os.environ.get('MODEL_SERVER_SOCKET', os.path.join(TEMP_FOLDER, 'models.sock'))
+
+# Modalità predefinita di abbinamento tra scene e frasi (vedi scene_assignment.MATCH_MODES);
+# può essere scelta per ogni job con il campo "match_mode" di /api/process/<job_id>
+MATCH_MODE = os.environ.get('MATCH_MODE', 'argmax')
+
+# Intervallo, in secondi, tra due letture degli eventi di un job per lo stream SSE,
+# e intervallo massimo senza dati prima di un commento di keepalive
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+# Durata, in secondi, per cui il browser può riusare un video scaricato prima di
+# riconvalidarlo con l'ETag (il montaggio cambia quando viene rigenerato)
+STREAM_MAX_AGE = int(os.environ.get('STREAM_MAX_AGE', 60))
+
+# Con PROXY_VIDEOS=0 non viene generato il proxy a 360p dopo il caricamento
+PROXY_VIDEOS = os.environ.get('PROXY_VIDEOS', '1') != '0'
+
+# Risultati restituiti da /api/search: predefiniti e massimi
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
 # Inizializzazione dei moduli
 video_segmenter = VideoSegmenter(TEMP_FOLDER)
-caption_generator = CaptionGenerator(TEMP_FOLDER)
-semantic_matcher = SemanticMatcher(TEMP_FOLDER)
-montage_generator = MontageGenerator(TEMP_FOLDER, OUTPUT_FOLDER)
+
+# Montaggi finali e in bozza, renderizzati con ffmpeg (smart cut e concat)
+montage_compiler = MontageCompiler(TEMP_FOLDER, OUTPUT_FOLDER)
+
+# Proxy a bassa risoluzione per anteprima, revisione e montaggi in bozza
+proxy_generator = ProxyGenerator(os.path.join(TEMP_FOLDER, 'proxies'))
+atexit.register(proxy_generator.shutdown)
+
+# Catalogo delle scene di tutti i job, aggiornato dai worker a fine elaborazione
+scene_catalog = SceneCatalog(os.path.join(TEMP_FOLDER, 'scenes.db'))
+catalog_backfilled = False
+search_model_client = None
+
+# Cache dei risultati intermedi, condivisa con i worker: il matching in cache
+# di un riassunto viene invalidato quando la revisione cambia le corrispondenze
+performance_optimizer = PerformanceOptimizer(TEMP_FOLDER)
+
+# Caricamenti a chunk, riprendibili
+upload_manager = ChunkedUploadManager(UPLOAD_FOLDER, max_size=app.config['MAX_CONTENT_LENGTH'])
+
+# Indice dei video per hash del contenuto: l'ID del video deriva dall'hash e
+# ogni caricamento riceve un proprio ID del job ("<video_id>-<suffisso>")
+video_index = VideoIndex(os.path.join(TEMP_FOLDER, 'videos.db'), UPLOAD_FOLDER)
+
+# Coda dei job di elaborazione e pool di worker (avviato al primo job)
+job_queue = JobQueue(os.path.join(TEMP_FOLDER, 'jobs.db'))
+job_worker_pool = None
+inline_processor = None
+
+if JOB_WORKERS > 0:
+    job_worker_pool = JobWorkerPool(
+        job_queue.db_path, UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, num_workers=JOB_WORKERS,
+        model_socket=MODEL_SERVER_SOCKET if MODEL_SERVER else None
+    )
+    atexit.register(job_worker_pool.stop)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_summary(job_id, summary):
+    # Salva il riassunto accanto al video caricato
+    summary_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_summary.txt")
+    with open(summary_path, 'w') as f:
+        f.write(summary)
+    return summary_path
+
+def new_upload_path(filename):
+    # File provvisorio per un caricamento: VideoIndex.register lo sposta nel
+    # percorso definitivo, derivato dall'hash del contenuto
+    fd, path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], prefix='.', suffix=f"_{filename}")
+    os.close(fd)
+    return path
+
+def find_video_path(job_id):
+    # Video caricato per il job, con una qualsiasi delle estensioni consentite;
+    # il file è condiviso tra i caricamenti dello stesso video
+    for ext in ['mp4'] + sorted(ALLOWED_EXTENSIONS - {'mp4'}):
+        video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{video_id_of(job_id)}.{ext}")
+        if os.path.exists(video_path):
+            return video_path
+    return None
+
+def request_proxy(job_id, video_path):
+    # Avvia in background la codifica del proxy del video caricato, condiviso
+    # tra i caricamenti dello stesso video
+    if not PROXY_VIDEOS:
+        return "disabled"
+    return proxy_generator.request(video_id_of(job_id), video_path)
+
+def encode_search_query(query):
+    # Embedding CLIP della query dal server dei modelli, se è in esecuzione:
+    # l'API non carica i modelli, senza server la ricerca usa le didascalie
+    global search_model_client
+    if not MODEL_SERVER or not os.path.exists(MODEL_SERVER_SOCKET):
+        return None
+    
+    try:
+        if search_model_client is None:
+            search_model_client = ModelClient(MODEL_SERVER_SOCKET, connect_timeout=1)
+        return search_model_client.encode_texts([query])[0]
+    except Exception as e:
+        logger.warning(f"Embedding della query non disponibile: {str(e)}")
+        return None
+
+def get_inline_processor():
+    # Processore usato nella richiesta: job eseguiti senza worker (JOB_WORKERS=0)
+    # e aggiornamenti del riassunto. Con i worker i modelli restano nel server
+    # dei modelli, avviato insieme al pool
+    global inline_processor
+    if inline_processor is None:
+        from optimized_processing import ScalableVideoProcessor
+        model_client = None
+        if job_worker_pool is not None and MODEL_SERVER:
+            job_worker_pool.start()
+            model_client = ModelClient(MODEL_SERVER_SOCKET)
+        inline_processor = ScalableVideoProcessor(UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, model_client=model_client)
+    return inline_processor
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Backend server is running"}), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Durate, elementi elaborati ed errori per stage e memoria di ogni processo, in formato Prometheus
+    return Response(metrics_registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     # Verifica se la richiesta contiene un file
@@ -64,44 +213,139 @@ def upload_file():
     
     summary = request.form['summary']
     
-    # Salva il file
+    # Salva il file calcolandone l'hash durante la copia
     filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
+    upload_path = new_upload_path(filename)
+    sha256 = save_stream_with_hash(file.stream, upload_path)
+    
+    # L'ID del video deriva dal contenuto: lo stesso video caricato più volte
+    # riusa segmentazione e didascalie già calcolate, ma ogni caricamento ha
+    # un proprio job, con riassunto, corrispondenze e risultati separati
+    video = video_index.register(sha256, upload_path, filename)
+    job_id = video["job_id"]
     
     # Salva il riassunto
-    summary_filename = f"{os.path.splitext(filename)[0]}_summary.txt"
-    summary_path = os.path.join(app.config['UPLOAD_FOLDER'], summary_filename)
-    with open(summary_path, 'w') as f:
-        f.write(summary)
+    summary_path = save_summary(job_id, summary)
     
-    # Crea un ID per il job
-    job_id = os.path.splitext(filename)[0]
+    return jsonify({
+        "message": "Upload successful",
+        "job_id": job_id,
+        "video_id": video["video_id"],
+        "video_path": video["video_path"],
+        "summary_path": summary_path,
+        "sha256": sha256,
+        "deduplicated": video["deduplicated"],
+        "proxy_status": request_proxy(job_id, video["video_path"])
+    }), 200
+
+@app.route('/api/upload/init', methods=['POST'])
+def init_chunked_upload():
+    # Apre un caricamento a chunk: il file viene inviato con PUT /api/upload/<upload_id>
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    
+    data = request.json
+    filename = secure_filename(data.get('filename', ''))
+    
+    if filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({"error": f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
+    
+    if 'summary' not in data:
+        return jsonify({"error": "No summary provided"}), 400
+    
+    try:
+        total_size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid size"}), 400
+    
+    # Stesso limite dei caricamenti in un'unica richiesta
+    if total_size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({"error": f"File too large. Maximum size: {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+    
+    try:
+        status = upload_manager.initiate(filename, total_size, data['summary'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(status), 201
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    # Stato del caricamento: next_offset indica da dove riprendere
+    status = upload_manager.get_status(upload_id)
+    
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    
+    return jsonify(status), 200
+
+@app.route('/api/upload/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # Il corpo della richiesta contiene i byte del chunk, scritti a partire da ?offset=
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"error": "Missing or invalid offset"}), 400
+    
+    if not request.content_length:
+        return jsonify({"error": "Empty chunk"}), 400
+    
+    try:
+        status = upload_manager.write_chunk(upload_id, offset, request.stream, request.content_length)
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(status), 200
+
+@app.route('/api/upload/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    # Conclude il caricamento, verificando l'hash SHA-256 se fornito dal client
+    expected_sha256 = request.json.get('sha256') if request.is_json else None
+    
+    status = upload_manager.get_status(upload_id)
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    
+    upload_path = new_upload_path(status["filename"])
+    
+    try:
+        result = upload_manager.finalize(upload_id, expected_sha256, destination=upload_path)
+    except KeyError:
+        os.remove(upload_path)
+        return jsonify({"error": "Upload not found"}), 404
+    except ValueError as e:
+        os.remove(upload_path)
+        return jsonify({"error": str(e)}), 400
+    
+    video = video_index.register(result["sha256"], upload_path, result["filename"])
+    job_id = video["job_id"]
+    summary_path = save_summary(job_id, result["summary"])
     
     return jsonify({
         "message": "Upload successful",
         "job_id": job_id,
-        "video_path": file_path,
-        "summary_path": summary_path
+        "video_id": video["video_id"],
+        "video_path": video["video_path"],
+        "summary_path": summary_path,
+        "sha256": result["sha256"],
+        "deduplicated": video["deduplicated"],
+        "proxy_status": request_proxy(job_id, video["video_path"])
     }), 200
 
 @app.route('/api/process/<job_id>', methods=['POST'])
 def process_video(job_id):
     try:
         # Recupera i percorsi dei file
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}.mp4")
+        video_path = find_video_path(job_id)
         summary_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_summary.txt")
         
-        if not os.path.exists(video_path):
-            # Prova altre estensioni
-            for ext in ALLOWED_EXTENSIONS:
-                alt_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}.{ext}")
-                if os.path.exists(alt_path):
-                    video_path = alt_path
-                    break
-            
-            if not os.path.exists(video_path):
-                return jsonify({"error": "Video file not found"}), 404
+        if video_path is None:
+            return jsonify({"error": "Video file not found"}), 404
         
         if not os.path.exists(summary_path):
             return jsonify({"error": "Summary file not found"}), 404
@@ -110,58 +354,139 @@ def process_video(job_id):
         with open(summary_path, 'r') as f:
             summary = f.read()
         
-        # Dividi il riassunto in frasi
-        import re
-        sentences = re.split(r'(?<=[.!?])\s+', summary)
+        options = request.get_json(silent=True) or {}
+        match_mode = options.get('match_mode', MATCH_MODE)
+        if match_mode not in MATCH_MODES:
+            return jsonify({"error": f"Invalid match_mode. Allowed values: {', '.join(MATCH_MODES)}"}), 400
         
-        summary_segments = []
-        for i, sentence in enumerate(sentences):
-            if sentence.strip():  # Ignora le frasi vuote
-                summary_segments.append({
-                    "id": i + 1,
-                    "text": sentence.strip()
-                })
-        
-        # Esegui la segmentazione del video
-        # In un'implementazione reale, utilizzeremmo video_segmenter.detect_scenes()
-        # Per ora, utilizziamo dati simulati per evitare problemi di spazio
-        scenes = [
-            {"id": 1, "start_time": 0, "end_time": 10, "thumbnail": "/thumbnails/1.jpg"},
-            {"id": 2, "start_time": 15, "end_time": 25, "thumbnail": "/thumbnails/2.jpg"},
-            {"id": 3, "start_time": 30, "end_time": 40, "thumbnail": "/thumbnails/3.jpg"},
-            {"id": 4, "start_time": 45, "end_time": 55, "thumbnail": "/thumbnails/4.jpg"},
-            {"id": 5, "start_time": 60, "end_time": 70, "thumbnail": "/thumbnails/5.jpg"},
-            {"id": 6, "start_time": 75, "end_time": 85, "thumbnail": "/thumbnails/6.jpg"}
-        ]
-        
-        # Genera didascalie per le scene
-        scenes = caption_generator.generate_captions(scenes, job_id)
+        # Stesso video e stesso riassunto già elaborati: restituisce i risultati salvati
+        results_path = os.path.join(TEMP_FOLDER, f"{job_id}_results.json")
+        status = job_queue.get_status(job_id)
+        if status is not None and status["state"] == "done" and os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                results = json.load(f)
+            
+            same_summary = results.get("summary_sha256") == hashlib.sha256(summary.encode('utf-8')).hexdigest()
+            if same_summary and results.get("match_mode", "argmax") == match_mode:
+                logger.info(f"Job {job_id} già elaborato con lo stesso riassunto")
+                return jsonify({
+                    "message": "Processing complete",
+                    "job_id": job_id,
+                    "scenes": results["scenes"],
+                    "summary_segments": results["summary_segments"]
+                }), 200
         
-        # Abbina le scene alle frasi del riassunto
-        summary_segments = semantic_matcher.match_scenes_to_summary(scenes, summary_segments, job_id)
+        payload = {"video_path": video_path, "summary": summary, "match_mode": match_mode}
         
-        # Salva i risultati
-        results = {
-            "job_id": job_id,
-            "scenes": scenes,
-            "summary_segments": summary_segments
-        }
+        if job_worker_pool is None:
+            # Esecuzione sincrona: nessun processo in background disponibile
+            status = job_queue.enqueue(job_id, payload)
+            job = job_queue.claim_next(worker_identity(), job_id=job_id)
+            
+            if job is None:
+                # Il job è già in esecuzione in un'altra richiesta
+                return jsonify({
+                    "message": "Processing in progress",
+                    "job_id": job_id,
+                    "state": status["state"],
+                    "status_url": f"/api/jobs/{job_id}"
+                }), 202
+            
+            results = run_job(job_queue, get_inline_processor(), job)
+            
+            if "error" in results:
+                return jsonify({"error": f"Error processing video: {results['error']}"}), 500
+            
+            return jsonify({
+                "message": "Processing complete",
+                "job_id": job_id,
+                "scenes": results["scenes"],
+                "summary_segments": results["summary_segments"]
+            }), 200
         
-        results_path = os.path.join(TEMP_FOLDER, f"{job_id}_results.json")
-        with open(results_path, 'w') as f:
-            json.dump(results, f)
+        # Accoda il job e restituisce subito il controllo al client
+        status = job_queue.enqueue(job_id, payload)
+        job_worker_pool.start()
         
         return jsonify({
-            "message": "Processing complete",
+            "message": "Processing queued",
             "job_id": job_id,
-            "scenes": scenes,
-            "summary_segments": summary_segments
-        }), 200
+            "state": status["state"],
+            "status_url": f"/api/jobs/{job_id}"
+        }), 202
     
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         return jsonify({"error": f"Error processing video: {str(e)}"}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # Restituisce lo stato del job e di ogni stage dell'elaborazione
+    status = job_queue.get_status(job_id)
+    
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if status["state"] == "done":
+        results_path = os.path.join(TEMP_FOLDER, f"{job_id}_results.json")
+        if os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                results = json.load(f)
+            status["scenes"] = results["scenes"]
+            status["summary_segments"] = results["summary_segments"]
+    
+    status["progress"] = job_queue.get_progress(job_id)
+    status["proxy_status"] = proxy_generator.status(video_id_of(job_id))
+    
+    return jsonify(status), 200
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # Stream Server-Sent Events con i cambi di stato e l'avanzamento del job.
+    # Gli eventi sono letti dal database della coda, condiviso con i worker;
+    # un client che si riconnette riprende dall'header Last-Event-ID
+    if job_queue.get_status(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    
+    def stream():
+        after_id = last_event_id
+        last_sent = time.monotonic()
+        yield "retry: 3000\n\n"
+        
+        while True:
+            # Lo stato va letto prima degli eventi: un job concluso non pubblica altri eventi
+            status = job_queue.get_status(job_id)
+            events = job_queue.get_events(job_id, after_id)
+            
+            for event in events:
+                after_id = event["id"]
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+            
+            if events:
+                last_sent = time.monotonic()
+                continue
+            
+            if status is None or status["state"] in ("done", "failed"):
+                yield f"event: end\ndata: {json.dumps(status)}\n\n"
+                return
+            
+            if time.monotonic() - last_sent > EVENTS_KEEPALIVE_INTERVAL:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            
+            time.sleep(EVENTS_POLL_INTERVAL)
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/matches/<job_id>', methods=['POST'])
 def update_matches(job_id):
     # Aggiorna le corrispondenze tra scene e frasi
@@ -194,6 +519,12 @@ def update_matches(job_id):
         with open(results_path, 'w') as f:
             json.dump(results, f)
         
+        # Il matching in cache per questo riassunto non corrisponde più ai risultati salvati
+        segment_texts = [segment.get('text', '') for segment in results['summary_segments']]
+        performance_optimizer.invalidate_cache(
+            job_id, matching_cache_stage(segment_texts, results.get('match_mode', 'argmax'))
+        )
+        
         return jsonify({
             "message": "Matches updated",
             "job_id": job_id,
@@ -204,6 +535,48 @@ def update_matches(job_id):
         logger.error(f"Error updating matches: {str(e)}")
         return jsonify({"error": f"Error updating matches: {str(e)}"}), 500
 
+@app.route('/api/summary/<job_id>', methods=['POST'])
+def update_summary(job_id):
+    """
+    Aggiorna il riassunto di un job già elaborato: solo le frasi nuove o
+    modificate vengono abbinate, le altre mantengono la scena (anche se
+    scelta nella revisione). Restituisce i segmenti aggiornati e, in
+    "rematched", il numero di frasi abbinate di nuovo.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    
+    summary = request.json.get('summary', '')
+    if not isinstance(summary, str) or not summary.strip():
+        return jsonify({"error": "Missing summary"}), 400
+    
+    match_mode = request.json.get('match_mode')
+    if match_mode is not None and match_mode not in MATCH_MODES:
+        return jsonify({"error": f"Invalid match_mode. Allowed values: {', '.join(MATCH_MODES)}"}), 400
+    
+    status = job_queue.get_status(job_id)
+    if status is not None and status["state"] in ("queued", "running"):
+        return jsonify({"error": "Processing in progress", "state": status["state"]}), 409
+    
+    if not os.path.exists(os.path.join(TEMP_FOLDER, f"{job_id}_results.json")):
+        return jsonify({"error": "Results not found. Process the video first."}), 404
+    
+    try:
+        results = get_inline_processor().update_summary(job_id, summary, match_mode)
+        save_summary(job_id, summary)
+        
+        return jsonify({
+            "message": "Summary updated",
+            "job_id": job_id,
+            "summary_segments": results["summary_segments"],
+            "match_mode": results["match_mode"],
+            "rematched": results["rematched"]
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error updating summary: {str(e)}")
+        return jsonify({"error": f"Error updating summary: {str(e)}"}), 500
+
 @app.route('/api/generate/<job_id>', methods=['POST'])
 def generate_montage(job_id):
     try:
@@ -217,26 +590,24 @@ def generate_montage(job_id):
             results = json.load(f)
         
         # Recupera il percorso del video
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}.mp4")
+        video_path = find_video_path(job_id)
         
-        if not os.path.exists(video_path):
-            # Prova altre estensioni
-            for ext in ALLOWED_EXTENSIONS:
-                alt_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}.{ext}")
-                if os.path.exists(alt_path):
-                    video_path = alt_path
-                    break
-            
-            if not os.path.exists(video_path):
-                return jsonify({"error": "Video file not found"}), 404
+        if video_path is None:
+            return jsonify({"error": "Video file not found"}), 404
         
-        # Genera il montaggio
-        output_path = montage_generator.create_montage(
-            video_path, 
-            results['scenes'], 
-            results['summary_segments'], 
+        options = request.get_json(silent=True) or {}
+        if options.get('draft'):
+            return generate_draft_montage(job_id, video_path, results)
+        
+        # Genera il montaggio dal video originale
+        output_path = montage_compiler.compile_montage(
+            video_path,
+            results['scenes'],
+            results['summary_segments'],
             job_id
         )
+        if output_path is None:
+            return jsonify({"error": "Error generating montage"}), 500
         
         return jsonify({
             "message": "Montage generated",
@@ -249,21 +620,163 @@ def generate_montage(job_id):
         logger.error(f"Error generating montage: {str(e)}")
         return jsonify({"error": f"Error generating montage: {str(e)}"}), 500
 
+def generate_draft_montage(job_id, video_path, results):
+    # Montaggio in bozza, generato dal proxy a 360p invece che dal video originale
+    proxy_status = proxy_generator.status(video_id_of(job_id))
+    if proxy_status == "running":
+        return jsonify({"error": "Proxy video not ready, retry later", "proxy_status": proxy_status}), 409
+    if proxy_status == "unavailable":
+        return jsonify({"error": "Draft montages require ffmpeg", "proxy_status": proxy_status}), 503
+    
+    # Proxy mai generato (es. PROXY_VIDEOS=0) o fallito: viene codificato ora
+    proxy_path = proxy_generator.generate(video_id_of(job_id), video_path)
+    
+    output_path = montage_compiler.compile_montage(
+        proxy_path,
+        results['scenes'],
+        results['summary_segments'],
+        job_id,
+        draft=True
+    )
+    if output_path is None:
+        return jsonify({"error": "Error generating draft montage"}), 500
+    
+    return jsonify({
+        "message": "Draft montage generated",
+        "job_id": job_id,
+        "output_path": output_path,
+        "stream_url": f"/api/stream/{job_id}?file=draft"
+    }), 200
+
 @app.route('/api/download/<job_id>', methods=['GET'])
 def download_montage(job_id):
-    # In un'implementazione reale, qui si restituirebbe il file del montaggio
     output_path = os.path.join(OUTPUT_FOLDER, f"{job_id}_montage.mp4")
     
     if not os.path.exists(output_path):
         return jsonify({"error": "Montage file not found"}), 404
     
-    # In un'implementazione reale, qui si restituirebbe il file
     return jsonify({
         "message": "Download link generated",
         "job_id": job_id,
-        "download_url": f"/static/output/{job_id}_montage.mp4"
+        "download_url": f"/api/stream/{job_id}?download=1",
+        "stream_url": f"/api/stream/{job_id}"
+    }), 200
+
+@app.route('/api/stream/<job_id>', methods=['GET', 'HEAD'])
+def stream_video(job_id):
+    """
+    Invia il montaggio del job; con ?file= si sceglie un altro file: source
+    (il video caricato), proxy (il video a 360p, per riprodurre le scene nella
+    revisione) o draft (il montaggio in bozza).
+    
+    Supporta le richieste Range (il player può spostarsi nel video scaricando
+    solo i byte necessari) e la riconvalida con ETag/If-None-Match, che
+    restituisce 304 se il file non è cambiato. Il file viene passato al server
+    WSGI come wsgi.file_wrapper, che i server come gunicorn inviano con
+    sendfile senza copiarlo in Python; con USE_X_SENDFILE=1 lo invia il proxy.
+    Con ?download=1 il file viene scaricato come allegato.
+    """
+    kind = request.args.get('file', 'montage')
+    if kind == 'montage':
+        path = os.path.join(OUTPUT_FOLDER, f"{job_id}_montage.mp4")
+        if not os.path.exists(path):
+            return jsonify({"error": "Montage file not found"}), 404
+    elif kind == 'source':
+        path = find_video_path(job_id)
+        if path is None:
+            return jsonify({"error": "Video file not found"}), 404
+    elif kind == 'proxy':
+        path = proxy_generator.get(video_id_of(job_id))
+        if path is None:
+            # Video caricati prima dei proxy: la codifica viene avviata ora
+            video_path = find_video_path(job_id)
+            if video_path is None:
+                return jsonify({"error": "Video file not found"}), 404
+            return jsonify({"error": "Proxy video not ready", "proxy_status": request_proxy(job_id, video_path)}), 404
+    elif kind == 'draft':
+        path = os.path.join(OUTPUT_FOLDER, f"{job_id}_draft.mp4")
+        if not os.path.exists(path):
+            return jsonify({"error": "Draft montage not found"}), 404
+    else:
+        return jsonify({"error": "Invalid file. Allowed values: montage, source, proxy, draft"}), 400
+    
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=request.args.get('download') == '1',
+        download_name=os.path.basename(path),
+        conditional=True,
+        etag=True,
+        max_age=STREAM_MAX_AGE
+    )
+    
+    # Werkzeug lo imposta solo nelle risposte a una richiesta Range; il player
+    # lo legge dalla prima risposta per sapere se può spostarsi nel video
+    response.headers.setdefault('Accept-Ranges', 'bytes')
+    return response
+
+@app.route('/api/search', methods=['GET'])
+def search_scenes():
+    """
+    Cerca tra le scene di tutti i job elaborati con ?q=; ?mode= sceglie la
+    classifica (text: didascalie, semantic: similarità CLIP, hybrid: entrambe,
+    predefinita) e ?limit= il numero di risultati. Senza server dei modelli
+    la ricerca usa solo le didascalie.
+    """
+    global catalog_backfilled
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing query parameter q"}), 400
+    
+    mode = request.args.get('mode', 'hybrid')
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"Invalid mode. Allowed values: {', '.join(SEARCH_MODES)}"}), 400
+    
+    try:
+        limit = max(1, min(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    
+    # Job elaborati prima del catalogo: aggiunti alla prima ricerca
+    if not catalog_backfilled:
+        catalog_backfilled = True
+        added = scene_catalog.index_results(TEMP_FOLDER)
+        if added:
+            logger.info(f"Aggiunti al catalogo delle scene {added} job elaborati in precedenza")
+    
+    started = time.perf_counter()
+    query_embedding = encode_search_query(query) if mode != 'text' else None
+    results = scene_catalog.search(query, limit, mode, query_embedding)
+    
+    for result in results:
+        result.pop("thumbnail")
+        result["thumbnail_url"] = f"/api/thumbnail/{result['job_id']}/{result['scene_id']}"
+    
+    return jsonify({
+        "query": query,
+        "mode": mode if query_embedding is not None else "text",
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
     }), 200
 
+@app.route('/api/thumbnail/<job_id>/<int:scene_id>', methods=['GET'])
+def scene_thumbnail(job_id, scene_id):
+    # Thumbnail di una scena del catalogo
+    scene = scene_catalog.get_scene(job_id, scene_id)
+    if scene is None or not scene["thumbnail"] or not os.path.exists(scene["thumbnail"]):
+        return jsonify({"error": "Thumbnail not found"}), 404
+    
+    return send_file(
+        scene["thumbnail"],
+        mimetype=mimetypes.guess_type(scene["thumbnail"])[0] or 'image/jpeg',
+        conditional=True,
+        etag=True,
+        max_age=STREAM_MAX_AGE
+    )
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
 
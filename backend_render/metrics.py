@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import atexit
+import logging
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cartella in cui ogni processo scrive le proprie metriche, lette da /api/metrics;
+# senza cartella le metriche restano nel processo che le registra
+METRICS_DIR_ENV = "METRICS_DIR"
+
+# Limiti superiori, in secondi, dei bucket dell'istogramma delle durate
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Intervallo minimo, in secondi, tra due scritture delle metriche su disco
+FLUSH_INTERVAL = 1.0
+
+# Prefisso dei nomi delle metriche esposte
+METRIC_PREFIX = "montage"
+
+class MetricsRegistry:
+    """
+    Metriche degli stage di elaborazione di un processo.
+    
+    Per ogni stage registra un istogramma delle durate delle chiamate, il
+    numero di elementi elaborati (scene, didascalie, immagini, ...) e il
+    numero di errori; per il processo il picco di memoria residente (RSS).
+    Gli stage vengono eseguiti in processi diversi (API, worker dei job,
+    server dei modelli): ogni processo scrive periodicamente le proprie
+    metriche in un file della cartella METRICS_DIR, e il processo dell'API le
+    riunisce in formato Prometheus, con le etichette role e pid.
+    """
+    
+    def __init__(self, role="api", metrics_dir=None):
+        """
+        Inizializza il registro.
+        
+        Args:
+            role: Ruolo del processo (api, worker, model_server), esposto come etichetta
+            metrics_dir: Cartella dei file delle metriche (default: variabile
+                d'ambiente METRICS_DIR, letta a ogni scrittura)
+        """
+        self.role = role
+        self._metrics_dir = metrics_dir
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._dirty = False
+    
+    @property
+    def metrics_dir(self):
+        return self._metrics_dir or os.environ.get(METRICS_DIR_ENV)
+    
+    def observe(self, stage, seconds, items=1, error=False):
+        """
+        Registra una chiamata a uno stage.
+        
+        Args:
+            stage: Nome dello stage (es. detect_scenes)
+            seconds: Durata della chiamata
+            items: Elementi elaborati dalla chiamata
+            error: True se la chiamata è terminata con un'eccezione
+        """
+        with self._lock:
+            metrics = self._stages.get(stage)
+            if metrics is None:
+                metrics = self._stages[stage] = {
+                    "buckets": [0] * len(DURATION_BUCKETS),
+                    "sum": 0.0,
+                    "count": 0,
+                    "items": 0,
+                    "errors": 0
+                }
+            
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    metrics["buckets"][i] += 1
+                    break
+            metrics["sum"] += seconds
+            metrics["count"] += 1
+            metrics["items"] += items
+            metrics["errors"] += int(error)
+            self._dirty = True
+        
+        self.flush()
+    
+    def snapshot(self):
+        """
+        Restituisce le metriche correnti del processo.
+        """
+        with self._lock:
+            stages = {
+                stage: dict(metrics, buckets=list(metrics["buckets"]))
+                for stage, metrics in self._stages.items()
+            }
+        
+        return {
+            "pid": os.getpid(),
+            "role": self.role,
+            "updated_at": time.time(),
+            "rss_bytes": _current_rss(),
+            # ru_maxrss è in KiB su Linux; per i figli è il massimo tra i processi terminati (es. ffmpeg)
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "children_peak_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+            "stages": stages
+        }
+    
+    def flush(self, force=False):
+        """
+        Scrive le metriche del processo nella cartella delle metriche, al più
+        una volta ogni FLUSH_INTERVAL secondi (sempre con force=True).
+        """
+        metrics_dir = self.metrics_dir
+        if not metrics_dir:
+            return
+        
+        now = time.monotonic()
+        with self._lock:
+            if not force and (not self._dirty or now - self._last_flush < FLUSH_INTERVAL):
+                return
+            self._last_flush = now
+            self._dirty = False
+        
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            path = os.path.join(metrics_dir, f"{os.getpid()}.json")
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            # Le metriche non devono interrompere l'elaborazione
+            logger.warning(f"Scrittura delle metriche non riuscita: {str(e)}")
+    
+    def collect(self):
+        """
+        Restituisce le metriche di questo processo e quelle scritte dagli
+        altri processi ancora attivi; i file dei processi terminati vengono
+        eliminati.
+        """
+        snapshots = [self.snapshot()]
+        metrics_dir = self.metrics_dir
+        if not metrics_dir or not os.path.isdir(metrics_dir):
+            return snapshots
+        
+        for name in os.listdir(metrics_dir):
+            if not name.endswith(".json"):
+                continue
+            
+            pid = int(name[:-len(".json")]) if name[:-len(".json")].isdigit() else None
+            if pid is None or pid == os.getpid():
+                continue
+            
+            path = os.path.join(metrics_dir, name)
+            if not _process_alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        
+        return snapshots
+    
+    def render_prometheus(self):
+        """
+        Restituisce le metriche di tutti i processi nel formato di testo di Prometheus.
+        """
+        snapshots = self.collect()
+        lines = []
+        
+        def header(name, kind, description):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        
+        header("stage_duration_seconds", "histogram", "Durata delle chiamate agli stage di elaborazione")
+        for snapshot in snapshots:
+            for stage, metrics in sorted(snapshot["stages"].items()):
+                labels = _labels(snapshot, stage=stage)
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, metrics["buckets"]):
+                    cumulative += count
+                    lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics["count"]}')
+                lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_sum{{{labels}}} {metrics['sum']:.6f}")
+                lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_count{{{labels}}} {metrics['count']}")
+        
+        for name, key, description in (
+            ("stage_items_total", "items", "Elementi elaborati dagli stage (scene, didascalie, immagini)"),
+            ("stage_errors_total", "errors", "Chiamate agli stage terminate con un errore")
+        ):
+            header(name, "counter", description)
+            for snapshot in snapshots:
+                for stage, metrics in sorted(snapshot["stages"].items()):
+                    lines.append(f"{METRIC_PREFIX}_{name}{{{_labels(snapshot, stage=stage)}}} {metrics[key]}")
+        
+        for name, key, description in (
+            ("process_resident_memory_bytes", "rss_bytes", "Memoria residente attuale del processo"),
+            ("process_peak_resident_memory_bytes", "peak_rss_bytes", "Picco di memoria residente del processo"),
+            ("process_children_peak_resident_memory_bytes", "children_peak_rss_bytes",
+             "Picco di memoria residente dei processi figli terminati (es. ffmpeg)")
+        ):
+            header(name, "gauge", description)
+            for snapshot in snapshots:
+                if snapshot.get(key) is not None:
+                    lines.append(f"{METRIC_PREFIX}_{name}{{{_labels(snapshot)}}} {snapshot[key]}")
+        
+        return "\n".join(lines) + "\n"
+
+
+def _labels(snapshot, **extra):
+    labels = {"role": snapshot["role"], "pid": snapshot["pid"], **extra}
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _current_rss():
+    # Memoria residente attuale, da /proc (None dove non è disponibile)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Registro del processo corrente
+registry = MetricsRegistry()
+atexit.register(registry.flush, force=True)
+
+def set_role(role):
+    """
+    Imposta il ruolo del processo corrente (es. worker), esposto come etichetta.
+    """
+    registry.role = role
+
+
+@contextmanager
+def stage_timer(stage, items=1):
+    """
+    Misura la durata di un blocco di codice come chiamata a uno stage.
+    
+    Il valore restituito è un dizionario in cui il blocco può aggiornare il
+    numero di elementi elaborati (timer["items"]), se noto solo alla fine.
+    """
+    timer = {"items": items}
+    started = time.perf_counter()
+    error = False
+    try:
+        yield timer
+    except BaseException:
+        error = True
+        raise
+    finally:
+        # Una chiamata fallita non conta elementi elaborati
+        registry.observe(stage, time.perf_counter() - started, items=0 if error else timer["items"], error=error)
+
+
+def timed(stage, items=None):
+    """
+    Decoratore che registra ogni chiamata al metodo come chiamata a uno stage.
+    
+    Args:
+        stage: Nome dello stage
+        items: Funzione che riceve il risultato e restituisce il numero di
+            elementi elaborati (es. len); se None ogni chiamata conta uno
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage) as timer:
+                result = func(*args, **kwargs)
+                if items is not None:
+                    timer["items"] = items(result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,299 @@
+import os
+import json
+import shutil
+import bisect
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Encoder ffmpeg da usare per ricodificare le parti di clip, per codec sorgente
+VIDEO_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "mpeg4": "mpeg4",
+    "vp9": "libvpx-vp9",
+}
+
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "opus": "libopus",
+}
+
+# Tolleranza, in secondi, per considerare un taglio allineato a un keyframe
+KEYFRAME_TOLERANCE = 0.001
+
+class SmartCutRenderer:
+    """
+    Motore di rendering del montaggio basato su ffmpeg.
+    
+    Ogni clip viene divisa in tre parti: la testa, dall'inizio della scena al
+    primo keyframe, la parte centrale tra il primo e l'ultimo keyframe della
+    scena, e la coda, dall'ultimo keyframe alla fine della scena. La parte
+    centrale viene copiata senza ricodifica (stream copy); solo testa e coda,
+    che non iniziano su un keyframe, vengono ricodificate con gli stessi
+    parametri del video sorgente. Le parti vengono infine unite con il concat
+    demuxer di ffmpeg, sempre in stream copy.
+    """
+    
+    def __init__(self, temp_folder, ffmpeg_path=None, ffprobe_path=None, max_workers=4):
+        """
+        Inizializza il motore di rendering.
+        
+        Args:
+            temp_folder: Cartella per le parti di clip temporanee
+            ffmpeg_path: Percorso dell'eseguibile ffmpeg (default: cercato nel PATH)
+            ffprobe_path: Percorso dell'eseguibile ffprobe (default: cercato nel PATH)
+            max_workers: Numero massimo di processi ffmpeg eseguiti in parallelo
+        """
+        self.temp_folder = temp_folder
+        self.ffmpeg_path = ffmpeg_path or shutil.which("ffmpeg")
+        self.ffprobe_path = ffprobe_path or shutil.which("ffprobe")
+        self.max_workers = max_workers
+        self._probe_cache = {}
+    
+    def is_available(self):
+        """
+        Verifica che ffmpeg e ffprobe siano disponibili.
+        """
+        return bool(self.ffmpeg_path and self.ffprobe_path)
+    
+    def render(self, video_path, segments, output_path):
+        """
+        Renderizza un montaggio unendo una sequenza di intervalli del video sorgente.
+        
+        Args:
+            video_path: Percorso del video sorgente
+            segments: Lista di tuple (inizio, fine) in secondi, nell'ordine del montaggio
+            output_path: Percorso del montaggio da generare
+        
+        Returns:
+            Percorso del montaggio generato
+        """
+        if not self.is_available():
+            raise RuntimeError("ffmpeg/ffprobe non disponibili")
+        
+        if not segments:
+            raise ValueError("Nessuna scena da includere nel montaggio")
+        
+        streams, keyframes, decode_delays = self._probe(video_path)
+        
+        # Se il codec non è supportato per la ricodifica parziale, ricodifica le clip intere
+        smart_cut = streams["video"]["codec_name"] in VIDEO_ENCODERS
+        if not smart_cut:
+            logger.warning(f"Codec {streams['video']['codec_name']} non supportato per lo smart cut: ricodifica completa")
+        
+        parts = []
+        for start, end in segments:
+            if smart_cut:
+                parts.extend(plan_smart_cut(start, end, keyframes))
+            else:
+                parts.append((start, end, False))
+        
+        copied = sum(end - start for start, end, copy in parts if copy)
+        total = sum(end - start for start, end, _ in parts)
+        logger.info(f"Smart cut: {len(parts)} parti, {copied:.1f}s/{total:.1f}s copiati senza ricodifica")
+        
+        work_dir = tempfile.mkdtemp(prefix="montage_", dir=self.temp_folder)
+        try:
+            part_paths = [os.path.join(work_dir, f"part_{i:05d}.mp4") for i in range(len(parts))]
+            
+            # Le parti sono indipendenti: vengono estratte in parallelo
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._render_part, video_path, streams, start,
+                        copy_end(end, keyframes, decode_delays) if copy else end,
+                        copy, part_path
+                    )
+                    for (start, end, copy), part_path in zip(parts, part_paths)
+                ]
+                for future in futures:
+                    future.result()
+            
+            self._concat(part_paths, os.path.join(work_dir, "parts.txt"), output_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        logger.info(f"Montaggio renderizzato: {output_path}")
+        return output_path
+    
+    def _probe(self, video_path):
+        """
+        Legge i parametri degli stream e le posizioni dei keyframe del video.
+        I risultati vengono memorizzati per non ripetere l'analisi dello stesso file.
+        """
+        stat = os.stat(video_path)
+        cache_key = (video_path, stat.st_size, stat.st_mtime)
+        if cache_key in self._probe_cache:
+            return self._probe_cache[cache_key]
+        
+        output = self._run([
+            self.ffprobe_path, "-v", "error",
+            "-show_entries", "stream=index,codec_type,codec_name,pix_fmt,time_base,sample_rate,channels",
+            "-of", "json", video_path
+        ])
+        streams = {"video": None, "audio": None}
+        for stream in json.loads(output)["streams"]:
+            if stream["codec_type"] in streams and streams[stream["codec_type"]] is None:
+                streams[stream["codec_type"]] = stream
+        
+        if streams["video"] is None:
+            raise ValueError(f"Nessuno stream video in {video_path}")
+        
+        # I flag dei pacchetti indicano i keyframe senza decodificare il video
+        output = self._run([
+            self.ffprobe_path, "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,dts_time,flags", "-of", "csv=p=0", video_path
+        ])
+        keyframe_packets = []
+        for line in output.splitlines():
+            fields = line.strip().split(",")
+            if len(fields) < 3 or "K" not in fields[2] or fields[0] in ("", "N/A"):
+                continue
+            pts = float(fields[0])
+            dts = float(fields[1]) if fields[1] not in ("", "N/A") else pts
+            keyframe_packets.append((pts, pts - dts))
+        keyframe_packets.sort()
+        
+        keyframes = [pts for pts, _ in keyframe_packets]
+        decode_delays = [delay for _, delay in keyframe_packets]
+        
+        self._probe_cache[cache_key] = (streams, keyframes, decode_delays)
+        return streams, keyframes, decode_delays
+    
+    def _render_part(self, video_path, streams, start, end, copy, part_path):
+        """
+        Estrae una parte di clip, in stream copy o ricodificandola.
+        """
+        command = [
+            self.ffmpeg_path, "-y", "-v", "error",
+            "-ss", f"{start:.6f}", "-i", video_path, "-t", f"{end - start:.6f}",
+            "-map", "0:v:0"
+        ]
+        if streams["audio"] is not None:
+            command += ["-map", "0:a:0"]
+        
+        if copy:
+            command += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+        else:
+            command += self._encode_args(streams)
+        
+        # Stessa timescale per tutte le parti, come richiesto dal concat in stream copy
+        timescale = streams["video"]["time_base"].split("/")[-1]
+        command += ["-video_track_timescale", timescale, part_path]
+        
+        self._run(command)
+    
+    def _encode_args(self, streams):
+        """
+        Parametri di codifica compatibili con gli stream del video sorgente.
+        """
+        video = streams["video"]
+        args = [
+            "-c:v", VIDEO_ENCODERS.get(video["codec_name"], "libx264"),
+            "-preset", "veryfast", "-crf", "18"
+        ]
+        if video.get("pix_fmt"):
+            args += ["-pix_fmt", video["pix_fmt"]]
+        
+        audio = streams["audio"]
+        if audio is not None:
+            args += ["-c:a", AUDIO_ENCODERS.get(audio["codec_name"], "aac")]
+            if audio.get("sample_rate"):
+                args += ["-ar", str(audio["sample_rate"])]
+            if audio.get("channels"):
+                args += ["-ac", str(audio["channels"])]
+        
+        return args
+    
+    def _concat(self, part_paths, list_path, output_path):
+        """
+        Unisce le parti con il concat demuxer di ffmpeg, senza ricodifica.
+        """
+        with open(list_path, 'w') as f:
+            for part_path in part_paths:
+                escaped = part_path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        
+        self._run([
+            self.ffmpeg_path, "-y", "-v", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", "-movflags", "+faststart", output_path
+        ])
+    
+    @staticmethod
+    def _run(command):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Comando fallito ({os.path.basename(command[0])}): {result.stderr.strip()}")
+        return result.stdout
+
+
+def plan_smart_cut(start, end, keyframes):
+    """
+    Divide l'intervallo [inizio, fine) di una scena in parti da copiare o ricodificare.
+    
+    Args:
+        start: Inizio della scena, in secondi
+        end: Fine della scena, in secondi
+        keyframes: Lista ordinata dei tempi dei keyframe, in secondi
+    
+    Returns:
+        Lista di tuple (inizio, fine, copia): copia è True per la parte tra il
+        primo e l'ultimo keyframe della scena, che può essere copiata senza ricodifica
+    """
+    first_index = bisect.bisect_left(keyframes, start - KEYFRAME_TOLERANCE)
+    last_index = bisect.bisect_right(keyframes, end + KEYFRAME_TOLERANCE) - 1
+    
+    if first_index >= len(keyframes) or last_index < first_index:
+        # Nessun keyframe nella scena: ricodifica l'intera clip
+        return [(start, end, False)]
+    
+    first_keyframe = keyframes[first_index]
+    last_keyframe = keyframes[last_index]
+    
+    # Una scena che finisce esattamente su un keyframe lo esclude
+    if last_keyframe >= end - KEYFRAME_TOLERANCE:
+        last_keyframe = end
+    
+    if last_keyframe - first_keyframe <= KEYFRAME_TOLERANCE:
+        return [(start, end, False)]
+    
+    parts = []
+    if first_keyframe - start > KEYFRAME_TOLERANCE:
+        parts.append((start, first_keyframe, False))
+    parts.append((first_keyframe, last_keyframe, True))
+    if end - last_keyframe > KEYFRAME_TOLERANCE:
+        parts.append((last_keyframe, end, False))
+    
+    return parts
+
+
+def copy_end(end, keyframes, decode_delays):
+    """
+    Calcola la fine effettiva di una parte copiata senza ricodifica.
+    
+    In stream copy ffmpeg interrompe la lettura in base al tempo di decodifica
+    (DTS) dei pacchetti: con i B-frame il keyframe che chiude la parte viene
+    decodificato prima del suo tempo di presentazione e finirebbe nella parte,
+    insieme ai fotogrammi che ne dipendono. La fine viene quindi anticipata
+    del ritardo di decodifica del keyframe.
+    
+    Args:
+        end: Fine della parte, in secondi (un keyframe o la fine della scena)
+        keyframes: Lista ordinata dei tempi dei keyframe, in secondi
+        decode_delays: Differenza tra PTS e DTS di ciascun keyframe, in secondi
+    
+    Returns:
+        Fine della parte da passare a ffmpeg, in secondi
+    """
+    index = bisect.bisect_left(keyframes, end - KEYFRAME_TOLERANCE)
+    if index < len(keyframes) and abs(keyframes[index] - end) <= KEYFRAME_TOLERANCE:
+        return end - decode_delays[index] - KEYFRAME_TOLERANCE
+    return end
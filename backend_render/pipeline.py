@@ -0,0 +1,295 @@
+import time
+import queue
+import logging
+import threading
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Numero massimo predefinito di elementi in attesa all'ingresso di uno stage
+DEFAULT_QUEUE_SIZE = 32
+
+# Intervallo, in secondi, con cui le attese sulle code verificano l'interruzione
+_POLL_INTERVAL = 0.1
+
+# Segnala la fine degli elementi su una coda
+_END = object()
+
+class PipelineStage:
+    """
+    Stage di una Pipeline: una funzione applicata a gruppi di elementi da
+    uno o più thread.
+    """
+    
+    def __init__(self, name, func, workers=1, batch_size=1, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Inizializza lo stage.
+        
+        Args:
+            name: Nome dello stage, usato nelle metriche
+            func: Funzione chiamata con una lista di elementi, che restituisce
+                la lista dei risultati nello stesso ordine
+            workers: Numero di thread che eseguono lo stage
+            batch_size: Numero massimo di elementi per chiamata; un worker
+                prende gli elementi già in coda, senza attendere di riempire
+                il gruppo
+            queue_size: Capacità della coda in ingresso: quando è piena lo
+                stage precedente attende (backpressure)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+
+
+class Pipeline:
+    """
+    Esegue una sequenza di stage su un flusso di elementi.
+    
+    Gli elementi prodotti dalla sorgente (un iterabile, consumato in un
+    thread dedicato) attraversano gli stage attraverso code limitate, così
+    che tutti gli stage lavorino contemporaneamente su elementi diversi e
+    che la memoria occupata non dipenda dalla lunghezza del flusso. Gli
+    stage possono completare gli elementi in ordine sparso; run() restituisce
+    i risultati nell'ordine della sorgente. Un errore in uno stage interrompe
+    l'intera pipeline e viene rilanciato da run().
+    """
+    
+    def __init__(self, source, stages, source_name="source"):
+        """
+        Inizializza la pipeline.
+        
+        Args:
+            source: Iterabile degli elementi da elaborare; se è un generatore
+                viene chiuso quando la pipeline si interrompe
+            stages: Lista di PipelineStage, nell'ordine di esecuzione
+            source_name: Nome della sorgente, usato nelle metriche
+        """
+        self.source = source
+        self.stages = stages
+        self.source_name = source_name
+        
+        self._abort = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._metrics = {}
+    
+    def run(self):
+        """
+        Esegue la pipeline fino all'esaurimento della sorgente.
+        
+        Returns:
+            Lista dei risultati dell'ultimo stage, nell'ordine della sorgente
+        """
+        queues = [queue.Queue(stage.queue_size) for stage in self.stages]
+        output = queue.Queue()
+        queues.append(output)
+        
+        self._metrics = {self.source_name: _StageMetrics(1)}
+        for stage in self.stages:
+            self._metrics[stage.name] = _StageMetrics(stage.workers)
+        
+        threads = [threading.Thread(target=self._produce, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], queues[i + 1], remaining), daemon=True
+                ))
+        
+        for thread in threads:
+            thread.start()
+        
+        results = {}
+        completed = False
+        try:
+            while True:
+                item = self._get(output)
+                if item is _END:
+                    break
+                index, result = item
+                results[index] = result
+            completed = True
+        finally:
+            # Se il chiamante viene interrotto si fermano tutti i thread
+            if not completed:
+                self._abort.set()
+            for thread in threads:
+                thread.join()
+        
+        if self._error is not None:
+            stage_name, error = self._error
+            logger.error(f"Pipeline interrotta nello stage {stage_name}: {str(error)}")
+            raise error
+        
+        self._log_metrics()
+        return [results[index] for index in sorted(results)]
+    
+    def metrics(self):
+        """
+        Restituisce le metriche di ogni stage dell'ultima esecuzione: elementi
+        elaborati, chiamate, tempo di lavoro, durata, throughput (elementi al
+        secondo) e utilizzo dei thread (frazione del tempo passata a lavorare).
+        """
+        return {name: metrics.as_dict() for name, metrics in self._metrics.items()}
+    
+    def _produce(self, out_queue):
+        """
+        Consuma la sorgente e ne passa gli elementi al primo stage.
+        """
+        metrics = self._metrics[self.source_name]
+        metrics.start()
+        iterator = iter(self.source)
+        
+        try:
+            index = 0
+            while not self._abort.is_set():
+                started = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                metrics.record(1, time.monotonic() - started)
+                
+                if not self._put(out_queue, (index, item)):
+                    break
+                index += 1
+        except Exception as e:
+            self._fail(self.source_name, e)
+        finally:
+            # Una sorgente interrotta (es. VideoSegmenter.iter_scenes) smette di decodificare
+            if self._abort.is_set() and hasattr(iterator, "close"):
+                iterator.close()
+            metrics.stop()
+            self._put(out_queue, _END)
+    
+    def _work(self, stage, in_queue, out_queue, remaining):
+        """
+        Ciclo di un thread dello stage: preleva gruppi di elementi, li elabora
+        e passa i risultati allo stage successivo.
+        """
+        metrics = self._metrics[stage.name]
+        metrics.start()
+        
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    break
+                
+                # Completa il gruppo con gli elementi già in coda, senza attendere
+                batch = [item]
+                while len(batch) < stage.batch_size:
+                    try:
+                        item = in_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _END:
+                        in_queue.put(_END)
+                        break
+                    batch.append(item)
+                
+                started = time.monotonic()
+                results = stage.func([payload for _, payload in batch])
+                metrics.record(len(batch), time.monotonic() - started)
+                
+                if len(results) != len(batch):
+                    raise ValueError(f"Lo stage {stage.name} ha restituito {len(results)} risultati per {len(batch)} elementi")
+                
+                for (index, _), result in zip(batch, results):
+                    if not self._put(out_queue, (index, result)):
+                        return
+        except Exception as e:
+            self._fail(stage.name, e)
+        finally:
+            # La fine degli elementi resta in coda per gli altri thread dello stage;
+            # l'ultimo thread che termina la passa allo stage successivo
+            self._put(in_queue, _END)
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                metrics.stop()
+                self._put(out_queue, _END)
+    
+    def _get(self, source_queue):
+        # Attesa su una coda che si interrompe se la pipeline viene fermata
+        while not self._abort.is_set():
+            try:
+                return source_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+    
+    def _put(self, target_queue, item):
+        # Inserimento in una coda limitata che si interrompe se la pipeline viene fermata
+        while not self._abort.is_set():
+            try:
+                target_queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _fail(self, stage_name, error):
+        with self._lock:
+            if self._error is None:
+                self._error = (stage_name, error)
+        self._abort.set()
+    
+    def _log_metrics(self):
+        for name, metrics in self.metrics().items():
+            logger.info(
+                f"Stage {name}: {metrics['items']} elementi in {metrics['wall_seconds']:.2f}s "
+                f"({metrics['throughput']:.1f}/s, utilizzo {metrics['utilization']:.0%})"
+            )
+
+
+class _StageMetrics:
+    """
+    Contatori di uno stage, aggiornati dai suoi thread.
+    """
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+    
+    @property
+    def finished(self):
+        return self.finished_at is not None
+    
+    def start(self):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+    
+    def stop(self):
+        with self._lock:
+            self.finished_at = time.monotonic()
+    
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.calls += 1
+            self.busy_seconds += seconds
+    
+    def as_dict(self):
+        with self._lock:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            wall = end - self.started_at if self.started_at is not None else 0.0
+            return {
+                "workers": self.workers,
+                "items": self.items,
+                "calls": self.calls,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "wall_seconds": round(wall, 3),
+                "throughput": self.items / wall if wall > 0 else 0.0,
+                "utilization": min(1.0, self.busy_seconds / (wall * self.workers)) if wall > 0 else 0.0
+            }
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import math
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import closing
+import numpy as np
+from scene_index import SceneIndex
+from video_index import video_id_of
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modalità di ricerca
+#   text: indice invertito delle didascalie (BM25)
+#   semantic: similarità CLIP tra la query e i thumbnail
+#   hybrid: le due classifiche unite per rango (reciprocal rank fusion)
+SEARCH_MODES = ("text", "semantic", "hybrid")
+
+# Parametri di BM25: saturazione della frequenza dei termini e peso della lunghezza della didascalia
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Costante della reciprocal rank fusion: riduce il peso delle prime posizioni di ogni classifica
+RRF_K = 60
+
+# Candidati considerati da ogni classifica, per risultato richiesto, nella modalità hybrid
+HYBRID_CANDIDATES_PER_RESULT = 4
+
+# Parole ignorate nelle didascalie e nelle query (italiano e inglese)
+STOPWORDS = frozenset("""
+    il lo la i gli le un uno una di a da in con su per tra fra e o ed che del dello della dei degli delle
+    al allo alla ai agli alle dal dallo dalla dai dagli dalle nel nello nella nei negli nelle sul sullo
+    sulla sui sugli sulle mentre si non come
+    the an of to in on at by for with and or is are from into while its his her their
+""".split())
+
+class SceneCatalog:
+    """
+    Catalogo persistente delle scene di tutti i job elaborati, basato su SQLite.
+    
+    Per ogni scena conserva intervallo, didascalia, thumbnail e embedding CLIP
+    del thumbnail. Le didascalie sono indicizzate in un indice invertito
+    (termine -> scene), così che una ricerca testuale legga solo le scene che
+    contengono i termini della query; gli embedding vengono caricati in un
+    SceneIndex in memoria, ricostruito solo quando il catalogo cambia. Le
+    scene di un archivio di film possono così essere cercate senza
+    rielaborare i video.
+    """
+    
+    def __init__(self, db_path):
+        """
+        Inizializza il catalogo.
+        
+        Args:
+            db_path: Percorso del database SQLite
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._index = None
+        self._index_version = None
+        
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scenes (
+                    job_id TEXT NOT NULL,
+                    scene_id INTEGER NOT NULL,
+                    start_time REAL,
+                    end_time REAL,
+                    caption TEXT NOT NULL,
+                    thumbnail TEXT,
+                    length INTEGER NOT NULL,
+                    embedding BLOB,
+                    PRIMARY KEY (job_id, scene_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    job_id TEXT NOT NULL,
+                    scene_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (term, job_id, scene_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_job ON postings (job_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO state (key, value) VALUES ('version', 0)")
+    
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+    
+    def index_job(self, job_id, scenes, embeddings=None):
+        """
+        Inserisce nel catalogo le scene di un job, sostituendo quelle già presenti.
+        
+        Args:
+            job_id: ID del job
+            scenes: Lista di scene con id, start_time, end_time, caption e thumbnail
+            embeddings: Matrice opzionale (len(scenes) x dim) degli embedding
+                CLIP dei thumbnail; le righe nulle (thumbnail non leggibili)
+                non vengono salvate
+        """
+        rows = []
+        postings = []
+        for i, scene in enumerate(scenes):
+            terms = tokenize(scene.get("caption", ""))
+            embedding = None
+            if embeddings is not None and np.any(embeddings[i]):
+                embedding = np.asarray(embeddings[i], dtype=np.float16).tobytes()
+            
+            rows.append((
+                job_id, scene["id"], scene.get("start_time"), scene.get("end_time"),
+                scene.get("caption", ""), scene.get("thumbnail"), len(terms), embedding
+            ))
+            postings.extend((term, job_id, scene["id"], tf, len(terms)) for term, tf in Counter(terms).items())
+        
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM postings WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM scenes WHERE job_id = ?", (job_id,))
+            conn.executemany("INSERT INTO scenes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?)", postings)
+            conn.execute("UPDATE state SET value = value + 1 WHERE key = 'version'")
+            conn.execute("COMMIT")
+        
+        logger.info(f"Catalogo delle scene aggiornato: {len(rows)} scene del job {job_id}")
+    
+    def remove_job(self, job_id):
+        """
+        Rimuove dal catalogo le scene di un job.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM postings WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM scenes WHERE job_id = ?", (job_id,))
+            conn.execute("UPDATE state SET value = value + 1 WHERE key = 'version'")
+            conn.execute("COMMIT")
+    
+    def has_job(self, job_id):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM scenes WHERE job_id = ? LIMIT 1", (job_id,)).fetchone() is not None
+    
+    def count(self):
+        """
+        Restituisce il numero di scene nel catalogo.
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+    
+    def index_results(self, temp_folder):
+        """
+        Inserisce nel catalogo le scene dei risultati ({job_id}_results.json)
+        dei job elaborati prima del catalogo, senza embedding.
+        
+        Returns:
+            Numero di job aggiunti
+        """
+        added = 0
+        for name in sorted(os.listdir(temp_folder)):
+            if not name.endswith("_results.json"):
+                continue
+            
+            # I caricamenti dello stesso video condividono le scene del video
+            job_id = video_id_of(name[:-len("_results.json")])
+            if self.has_job(job_id):
+                continue
+            
+            try:
+                with open(os.path.join(temp_folder, name)) as f:
+                    scenes = json.load(f)["scenes"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Risultati del job {job_id} non leggibili: {str(e)}")
+                continue
+            
+            self.index_job(job_id, scenes)
+            added += 1
+        
+        return added
+    
+    def search(self, query, limit=20, mode="hybrid", query_embedding=None):
+        """
+        Cerca le scene più pertinenti per una query.
+        
+        Args:
+            query: Testo della query
+            limit: Numero massimo di risultati
+            mode: Modalità di ricerca, una di SEARCH_MODES; senza
+                query_embedding le modalità semantic e hybrid usano solo le
+                didascalie
+            query_embedding: Embedding CLIP normalizzato della query
+        
+        Returns:
+            Lista di scene (job_id, scene_id, start_time, end_time, caption,
+            thumbnail) ordinate per punteggio decrescente, con il punteggio
+            complessivo e quelli delle singole classifiche
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modalità di ricerca non valida: {mode}")
+        if query_embedding is None:
+            mode = "text"
+        
+        candidates = limit if mode != "hybrid" else limit * HYBRID_CANDIDATES_PER_RESULT
+        text_ranking = self._search_text(query, candidates) if mode != "semantic" else []
+        semantic_ranking = self._search_semantic(query_embedding, candidates) if mode != "text" else []
+        
+        if mode == "hybrid":
+            fused = Counter()
+            for ranking in (text_ranking, semantic_ranking):
+                for rank, (key, _) in enumerate(ranking):
+                    fused[key] += 1.0 / (RRF_K + rank + 1)
+            ranking = fused.most_common(limit)
+        else:
+            ranking = (text_ranking or semantic_ranking)[:limit]
+        
+        text_scores = dict(text_ranking)
+        semantic_scores = dict(semantic_ranking)
+        
+        results = []
+        with self._connect() as conn:
+            for (job_id, scene_id), score in ranking:
+                row = conn.execute(
+                    "SELECT start_time, end_time, caption, thumbnail FROM scenes WHERE job_id = ? AND scene_id = ?",
+                    (job_id, scene_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                
+                results.append({
+                    "job_id": job_id,
+                    "scene_id": scene_id,
+                    "start_time": row[0],
+                    "end_time": row[1],
+                    "caption": row[2],
+                    "thumbnail": row[3],
+                    "score": round(float(score), 6),
+                    "text_score": _round(text_scores.get((job_id, scene_id))),
+                    "semantic_score": _round(semantic_scores.get((job_id, scene_id)))
+                })
+        
+        return results
+    
+    def get_scene(self, job_id, scene_id):
+        """
+        Restituisce una scena del catalogo, o None se non è presente.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT start_time, end_time, caption, thumbnail FROM scenes WHERE job_id = ? AND scene_id = ?",
+                (job_id, scene_id)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        return {"job_id": job_id, "scene_id": scene_id, "start_time": row[0], "end_time": row[1],
+                "caption": row[2], "thumbnail": row[3]}
+    
+    def _search_text(self, query, limit):
+        # BM25 sulle sole scene che contengono almeno un termine della query:
+        # le frequenze dei termini (df) e l'idf sono calcolati qui, i punteggi
+        # delle scene sommati e ordinati da SQLite
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        
+        with self._connect() as conn:
+            total, average_length = conn.execute("SELECT COUNT(*), AVG(length) FROM scenes").fetchone()
+            
+            idf = {}
+            for term in terms:
+                df = conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                if df:
+                    idf[term] = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            
+            if not idf:
+                return []
+            
+            weights = " ".join("WHEN ? THEN ?" for _ in idf)
+            placeholders = ",".join("?" * len(idf))
+            rows = conn.execute(
+                f"SELECT job_id, scene_id, SUM((CASE term {weights} END) * tf * ? / (tf + ? * (1 - ? + ? * length / ?))) AS score "
+                f"FROM postings WHERE term IN ({placeholders}) "
+                f"GROUP BY job_id, scene_id ORDER BY score DESC LIMIT ?",
+                [value for item in idf.items() for value in item]
+                + [BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, average_length or 1.0]
+                + list(idf) + [limit]
+            ).fetchall()
+        
+        return [((job_id, scene_id), score) for job_id, scene_id, score in rows]
+    
+    def _search_semantic(self, query_embedding, limit):
+        index = self._get_index()
+        if len(index) == 0:
+            return []
+        
+        ids, scores = index.query(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1), limit)
+        return list(zip(ids[0], scores[0].tolist()))
+    
+    def _get_index(self):
+        # L'indice in memoria viene ricostruito quando un altro processo (es.
+        # un worker che ha concluso un job) modifica il catalogo
+        with self._connect() as conn:
+            version = conn.execute("SELECT value FROM state WHERE key = 'version'").fetchone()[0]
+            
+            with self._lock:
+                if self._index is not None and self._index_version == version:
+                    return self._index
+                
+                rows = conn.execute(
+                    "SELECT job_id, scene_id, embedding FROM scenes WHERE embedding IS NOT NULL"
+                ).fetchall()
+                
+                index = SceneIndex()
+                if rows:
+                    index.add(
+                        [(job_id, scene_id) for job_id, scene_id, _ in rows],
+                        np.stack([np.frombuffer(embedding, dtype=np.float16) for _, _, embedding in rows])
+                    )
+                
+                self._index = index
+                self._index_version = version
+                return index
+
+
+def tokenize(text):
+    """
+    Divide un testo nei termini indicizzati: parole in minuscolo, senza
+    accenti, escluse le parole di una lettera e quelle in STOPWORDS.
+    """
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [word for word in re.findall(r"\w+", text) if len(word) > 1 and word not in STOPWORDS]
+
+
+def _round(score):
+    return None if score is None else round(float(score), 6)
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Suffisso dei file della cache su disco
+CACHE_SUFFIX = "_cache.json"
+
+class TieredCache:
+    """
+    Cache a due livelli per i risultati intermedi della pipeline.
+    
+    Il primo livello è una LRU in memoria, limitata in byte, che evita di
+    rileggere e decodificare il JSON a ogni accesso. Il secondo livello è su
+    disco: un file JSON per chiave, scritto in modo atomico (file temporaneo
+    e rinomina), con scadenza (TTL) e un limite complessivo in byte oltre il
+    quale vengono eliminati i file usati meno di recente.
+    
+    I valori restituiti sono condivisi con la cache in memoria e non devono
+    essere modificati dal chiamante. Una voce in memoria vale solo finché
+    esiste il suo file: una voce rimossa da un altro processo (delete) non
+    viene più restituita.
+    """
+    
+    def __init__(self, cache_folder, memory_budget=64 * 1024 * 1024, disk_budget=512 * 1024 * 1024,
+                 ttl=7 * 24 * 3600, rescan_interval=60):
+        """
+        Inizializza la cache.
+        
+        Args:
+            cache_folder: Cartella dei file di cache
+            memory_budget: Dimensione massima, in byte, dei valori tenuti in memoria
+            disk_budget: Dimensione massima, in byte, dei file di cache su disco
+            ttl: Durata, in secondi, di una voce dall'ultima scrittura
+            rescan_interval: Intervallo, in secondi, tra due ricalcoli dell'occupazione
+                del disco (la cartella può essere condivisa con altri processi)
+        """
+        self.cache_folder = cache_folder
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.ttl = ttl
+        self.rescan_interval = rescan_interval
+        os.makedirs(cache_folder, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # chiave -> (valore, dimensione, scadenza)
+        self._memory_bytes = 0
+        
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "expired": 0,
+            "evicted": 0
+        }
+        
+        self._disk_bytes = 0
+        self._last_scan = 0
+        self._scan_disk()
+    
+    def path(self, key):
+        """
+        Percorso del file su disco per una chiave.
+        """
+        return os.path.join(self.cache_folder, f"{key}{CACHE_SUFFIX}")
+    
+    def get(self, key):
+        """
+        Restituisce il valore associato alla chiave, o None se assente o scaduto.
+        """
+        now = time.time()
+        
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > now and os.path.exists(self.path(key)):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                self._drop_memory(key)
+        
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return self._miss()
+        
+        if stat.st_mtime + self.ttl <= now:
+            self._remove_file(path, "expired")
+            return self._miss()
+        
+        try:
+            with open(path, 'r') as f:
+                data = f.read()
+            value = json.loads(data)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Voce di cache non leggibile ({key}): {str(e)}")
+            return self._miss()
+        
+        # Registra l'uso per l'eliminazione LRU su disco, senza cambiare la scadenza
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+        
+        with self._lock:
+            self._counters["disk_hits"] += 1
+            self._store_memory(key, value, len(data), stat.st_mtime + self.ttl)
+        
+        return value
+    
+    def contains(self, key):
+        """
+        Verifica se la chiave è presente e non scaduta, senza leggere il valore.
+        """
+        now = time.time()
+        
+        try:
+            return os.stat(self.path(key)).st_mtime + self.ttl > now
+        except FileNotFoundError:
+            return False
+    
+    def put(self, key, value):
+        """
+        Salva un valore in memoria e su disco.
+        
+        Returns:
+            Percorso del file su disco
+        """
+        data = json.dumps(value)
+        path = self.path(key)
+        
+        # Scrittura atomica: un lettore concorrente vede il file vecchio o quello nuovo
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_folder, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            
+            try:
+                previous_size = os.path.getsize(path)
+            except FileNotFoundError:
+                previous_size = 0
+            
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        
+        with self._lock:
+            self._counters["writes"] += 1
+            self._store_memory(key, value, len(data), time.time() + self.ttl)
+            self._disk_bytes += len(data) - previous_size
+            
+            over_budget = self._disk_bytes > self.disk_budget
+            rescan = time.time() - self._last_scan > self.rescan_interval
+        
+        if over_budget or rescan:
+            self._scan_disk()
+        
+        return path
+    
+    def delete(self, key):
+        """
+        Rimuove una voce dalla cache.
+        """
+        with self._lock:
+            self._drop_memory(key)
+        self._remove_file(self.path(key))
+    
+    def stats(self):
+        """
+        Restituisce i contatori di utilizzo e l'occupazione della cache.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_bytes"] = self._disk_bytes
+        
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+    
+    def _miss(self):
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+    
+    def _store_memory(self, key, value, size, expires_at):
+        # Da chiamare con il lock acquisito
+        self._drop_memory(key)
+        
+        # Valori più grandi dell'intero budget restano solo su disco
+        if size > self.memory_budget:
+            return
+        
+        self._memory[key] = (value, size, expires_at)
+        self._memory_bytes += size
+        
+        while self._memory_bytes > self.memory_budget:
+            _, (_, evicted_size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+    
+    def _drop_memory(self, key):
+        # Da chiamare con il lock acquisito
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+    
+    def _remove_file(self, path, counter=None):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        
+        with self._lock:
+            self._disk_bytes -= size
+            if counter is not None:
+                self._counters[counter] += 1
+    
+    def _scan_disk(self):
+        """
+        Ricalcola l'occupazione del disco, elimina le voci scadute e, oltre il
+        limite, quelle usate meno di recente.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        
+        for entry in os.scandir(self.cache_folder):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            
+            if stat.st_mtime + self.ttl <= now:
+                self._remove_file(entry.path, "expired")
+                continue
+            
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+            total += stat.st_size
+        
+        evicted = 0
+        if total > self.disk_budget:
+            for _, size, path in sorted(entries):
+                if total <= self.disk_budget:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            
+            logger.info(f"Cache su disco oltre il limite: eliminate {evicted} voci")
+        
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["evicted"] += evicted
+            self._last_scan = now
@@ -1,18 +1,39 @@
 import os
+import queue
 import logging
-from scenedetect import VideoManager, SceneManager, StatsManager
-from scenedetect.detectors import ContentDetector
-from scenedetect.scene_manager import save_images
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from progress import ProgressTracker
+from metrics import timed
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Durata, in secondi di video, dei blocchi decodificati tra due notifiche di avanzamento
+PROGRESS_BLOCK_SECONDS = 10.0
+
+# Numero massimo di frame candidati tenuti in memoria per la scena in corso,
+# e passo iniziale, in frame, del campionamento dei candidati
+THUMBNAIL_BUFFER_SIZE = 16
+THUMBNAIL_MIN_STRIDE = 4
+
+# Larghezza massima, in pixel, dei thumbnail (e dei frame candidati in memoria)
+THUMBNAIL_MAX_WIDTH = 640
+
+# Numero massimo di scene rilevate da iter_scenes e non ancora consumate
+SCENE_QUEUE_SIZE = 64
+
+# Segnala a iter_scenes la fine della segmentazione
+_END_OF_SCENES = object()
+
 class VideoSegmenter:
     def __init__(self, temp_folder):
         self.temp_folder = temp_folder
         
-    def detect_scenes(self, video_path, job_id, threshold=30.0):
+    @timed("detect_scenes", items=len)
+    def detect_scenes(self, video_path, job_id, threshold=30.0, num_workers=1, progress_callback=None):
         """
         Segmenta il video in scene utilizzando PySceneDetect.
         
@@ -20,65 +41,670 @@ class VideoSegmenter:
             video_path: Percorso del file video
             job_id: ID del job per identificare i file temporanei
             threshold: Soglia di rilevamento delle scene (default: 30.0)
+            num_workers: Numero di processi per il rilevamento parallelo;
+                con 1 (default) il video viene decodificato in un unico processo,
+                con None si usano tutti i core disponibili
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback("segmentation", "progress", dettagli) con
+                frame decodificati, scene trovate e tempo residuo stimato
             
         Returns:
             List di scene rilevate con timestamp di inizio e fine
         """
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        
+        if num_workers > 1:
+            return self.detect_scenes_parallel(video_path, job_id, threshold, num_workers,
+                                               progress_callback=progress_callback)
+        
         logger.info(f"Iniziando la segmentazione del video: {video_path}")
         
+        scenes = list(self.iter_scenes(video_path, job_id, threshold, progress_callback=progress_callback))
+        
+        logger.info(f"Segmentazione completata. Rilevate {len(scenes)} scene.")
+        return scenes
+    
+    def iter_scenes(self, video_path, job_id, threshold=30.0, progress_callback=None, max_pending=SCENE_QUEUE_SIZE):
+        """
+        Segmenta il video restituendo le scene una alla volta, appena il
+        taglio successivo ne conferma la fine e il thumbnail è stato scritto.
+        
+        La decodifica prosegue in un thread in background mentre il chiamante
+        elabora le scene già ricevute (didascalie, embedding); se il chiamante
+        resta indietro di max_pending scene, la decodifica attende. Le scene
+        sono le stesse, nello stesso ordine, restituite da detect_scenes con
+        un solo processo.
+        
+        Args:
+            video_path: Percorso del file video
+            job_id: ID del job per identificare i file temporanei
+            threshold: Soglia di rilevamento delle scene (default: 30.0)
+            progress_callback: Funzione opzionale per l'avanzamento della
+                decodifica (vedi detect_scenes)
+            max_pending: Numero massimo di scene rilevate e non ancora consumate
+            
+        Yields:
+            Scene nello stesso formato di detect_scenes
+        """
+        # PySceneDetect (e OpenCV) vengono importati solo quando serve segmentare un video,
+        # per non rallentare l'avvio dei processi che importano questo modulo
+        from scenedetect import VideoManager, SceneManager, StatsManager
+        from scenedetect.detectors import ContentDetector
+        
         # Crea la directory per i thumbnail se non esiste
         thumbnails_dir = os.path.join(self.temp_folder, f"{job_id}_thumbnails")
         os.makedirs(thumbnails_dir, exist_ok=True)
         
+        # Crea il video manager e carica il video
+        video_manager = VideoManager([video_path])
+        stats_manager = StatsManager()
+        scene_manager = SceneManager(stats_manager)
+        
+        # Aggiungi il detector di contenuto
+        scene_manager.add_detector(ContentDetector(threshold=threshold))
+        
+        # Imposta il downscale per migliorare le prestazioni
+        video_manager.set_downscale_factor()
+        
+        pending = queue.Queue(max_pending)
+        stop = threading.Event()
+        state = {"emitted": 0, "finishing": False}
+        
+        def emit(item):
+            # Attende che il chiamante consumi le scene, a meno che non abbia smesso di farlo
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+        
+        def emit_scene(scene_number, start_time, end_time):
+            state["emitted"] = scene_number
+            emit(self._scene_dict(scene_number, start_time, end_time, thumbnails_dir))
+        
+        def on_scene(scene_number, start_frame, end_frame, sample):
+            # I thumbnail vengono scelti tra i frame decodificati per il rilevamento
+            # e scritti alla chiusura di ogni scena, senza rileggere il video
+            if sample is not None:
+                _write_thumbnail(sample[2], _thumbnail_path(thumbnails_dir, scene_number))
+            
+            # L'ultima scena viene restituita con la fine indicata dal SceneManager
+            if not state["finishing"]:
+                framerate = video_manager.get_framerate()
+                emit_scene(scene_number, start_frame / framerate, end_frame / framerate)
+        
+        collector = ThumbnailCollector(on_scene)
+        frame_source = _CapturingFrameSource(video_manager, collector)
+        
+        def produce():
+            try:
+                # Inizia il processo di rilevamento
+                video_manager.start()
+                
+                if progress_callback is None:
+                    scene_manager.detect_scenes(frame_source=frame_source, callback=collector.on_cut)
+                else:
+                    self._detect_with_progress(scene_manager, frame_source, progress_callback, collector.on_cut)
+                
+                # Senza tagli non c'è nessuna scena (vedi get_scene_list) e nessun thumbnail
+                scene_list = scene_manager.get_scene_list()
+                if scene_list and not stop.is_set():
+                    state["finishing"] = True
+                    collector.finish()
+                    
+                    for i, (start, end) in enumerate(scene_list[state["emitted"]:], state["emitted"]):
+                        emit_scene(i + 1, start.get_seconds(), end.get_seconds())
+                
+                emit(_END_OF_SCENES)
+            except Exception as e:
+                emit(e)
+            finally:
+                video_manager.release()
+        
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        
         try:
-            # Crea il video manager e carica il video
-            video_manager = VideoManager([video_path])
-            stats_manager = StatsManager()
-            scene_manager = SceneManager(stats_manager)
+            while True:
+                item = pending.get()
+                if item is _END_OF_SCENES:
+                    return
+                if isinstance(item, Exception):
+                    logger.error(f"Errore durante la segmentazione del video: {str(item)}")
+                    raise item
+                yield item
+        finally:
+            # Il chiamante può interrompere l'iterazione: la decodifica si ferma
+            stop.set()
+            scene_manager.stop()
+            producer.join()
+    
+    def _detect_with_progress(self, scene_manager, video_manager, progress_callback, cut_callback=None):
+        """
+        Esegue il rilevamento a blocchi di PROGRESS_BLOCK_SECONDS secondi,
+        notificando l'avanzamento al termine di ogni blocco. Il SceneManager
+        riprende ogni volta dal frame successivo, quindi i tagli rilevati sono
+        gli stessi di un unico passaggio.
+        """
+        total_frames = video_manager.get_duration()[0].get_frames()
+        block_frames = max(1, int(video_manager.get_framerate() * PROGRESS_BLOCK_SECONDS))
+        tracker = ProgressTracker(progress_callback, "segmentation", total_frames, unit="frames")
+        
+        frames_decoded = 0
+        while True:
+            decoded = scene_manager.detect_scenes(frame_source=video_manager, duration=block_frames,
+                                                  callback=cut_callback)
+            frames_decoded += decoded
             
-            # Aggiungi il detector di contenuto
-            scene_manager.add_detector(ContentDetector(threshold=threshold))
+            if decoded < block_frames:
+                break
             
-            # Imposta il downscale per migliorare le prestazioni
-            video_manager.set_downscale_factor()
+            tracker.update(min(frames_decoded, total_frames), scenes_found=len(scene_manager.get_scene_list()))
+        
+        # La durata dichiarata dal container può differire dai frame effettivamente decodificati
+        tracker.update(frames_decoded, total=frames_decoded,
+                       scenes_found=len(scene_manager.get_scene_list()))
+    
+    def detect_scenes_parallel(self, video_path, job_id, threshold=30.0, num_workers=None,
+                               overlap_seconds=2.0, min_chunk_seconds=30.0, min_scene_len=15,
+                               progress_callback=None):
+        """
+        Segmenta il video in scene dividendo la decodifica su più processi.
+        
+        Il video viene diviso in intervalli di tempo contigui, estesi di una
+        piccola sovrapposizione sui bordi per permettere al detector di
+        stabilizzarsi. Ogni intervallo viene analizzato da un ContentDetector
+        in un processo separato; i tagli vengono poi ricuciti tenendo per ogni
+        intervallo solo quelli che cadono nella sua parte di competenza ed
+        eliminando i duplicati in corrispondenza delle giunture.
+        
+        Args:
+            video_path: Percorso del file video
+            job_id: ID del job per identificare i file temporanei
+            threshold: Soglia di rilevamento delle scene (default: 30.0)
+            num_workers: Numero di processi (default: tutti i core disponibili)
+            overlap_seconds: Sovrapposizione tra intervalli adiacenti, in secondi
+            min_chunk_seconds: Durata minima di un intervallo, in secondi
+            min_scene_len: Lunghezza minima di una scena, in frame (default del ContentDetector)
+            progress_callback: Funzione opzionale chiamata come
+                progress_callback("segmentation", "progress", dettagli) al
+                termine di ogni intervallo
             
-            # Inizia il processo di rilevamento
-            video_manager.start()
-            scene_manager.detect_scenes(frame_source=video_manager)
+        Returns:
+            List di scene rilevate con timestamp di inizio e fine
+        """
+        scenes = list(self.iter_scenes_parallel(video_path, job_id, threshold, num_workers, overlap_seconds,
+                                                min_chunk_seconds, min_scene_len, progress_callback))
+        
+        logger.info(f"Segmentazione parallela completata. Rilevate {len(scenes)} scene.")
+        return scenes
+    
+    def iter_scenes_parallel(self, video_path, job_id, threshold=30.0, num_workers=None,
+                             overlap_seconds=2.0, min_chunk_seconds=30.0, min_scene_len=15,
+                             progress_callback=None):
+        """
+        Segmenta il video su più processi come detect_scenes_parallel,
+        restituendo le scene una alla volta appena sono definitive.
+        
+        Gli intervalli terminano in ordine sparso ma vengono ricuciti
+        nell'ordine del video: una scena viene restituita quando tutti gli
+        intervalli che ne hanno decodificato una parte sono terminati, quindi
+        tagli e thumbnail sono gli stessi di detect_scenes_parallel. I processi
+        continuano ad analizzare gli intervalli successivi mentre il chiamante
+        elabora le scene ricevute. Se il video è troppo corto per essere
+        diviso, le scene vengono da iter_scenes.
+        
+        Args:
+            video_path: Percorso del file video
+            job_id: ID del job per identificare i file temporanei
+            threshold: Soglia di rilevamento delle scene (default: 30.0)
+            num_workers: Numero di processi (default: tutti i core disponibili)
+            overlap_seconds: Sovrapposizione tra intervalli adiacenti, in secondi
+            min_chunk_seconds: Durata minima di un intervallo, in secondi
+            min_scene_len: Lunghezza minima di una scena, in frame (default del ContentDetector)
+            progress_callback: Funzione opzionale per l'avanzamento della
+                decodifica (vedi detect_scenes_parallel)
             
-            # Ottieni l'elenco delle scene
-            scene_list = scene_manager.get_scene_list()
+        Yields:
+            Scene nello stesso formato di detect_scenes
+        """
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        
+        from scenedetect import VideoManager
+        
+        thumbnails_dir = os.path.join(self.temp_folder, f"{job_id}_thumbnails")
+        os.makedirs(thumbnails_dir, exist_ok=True)
+        
+        # Legge durata e framerate senza decodificare il video
+        video_manager = VideoManager([video_path])
+        try:
+            framerate = video_manager.get_framerate()
+            total_frames = video_manager.get_duration()[0].get_frames()
+            base_timecode = video_manager.get_base_timecode()
+        finally:
+            video_manager.release()
+        
+        # Il detector ignora i tagli nei primi min_scene_len frame letti: la sovrapposizione
+        # deve coprirli, altrimenti un taglio all'inizio di un intervallo andrebbe perso
+        ranges = plan_chunk_ranges(
+            total_frames,
+            num_workers,
+            overlap_frames=max(int(overlap_seconds * framerate), min_scene_len),
+            min_chunk_frames=int(min_chunk_seconds * framerate)
+        )
+        
+        if len(ranges) <= 1:
+            # Video troppo corto per trarre vantaggio dalla parallelizzazione
+            yield from self.iter_scenes(video_path, job_id, threshold, progress_callback=progress_callback)
+            return
+        
+        logger.info(f"Iniziando la segmentazione parallela del video: {video_path} ({num_workers} worker)")
+        
+        tracker = ProgressTracker(progress_callback, "segmentation", total_frames, unit="frames")
+        chunk_cuts = [None] * len(ranges)
+        thumbnail_candidates = []
+        cuts_found = 0
+        
+        # Intervalli iniziali già terminati e ricuciti, e inizio della prossima scena da restituire
+        merged_chunks = 0
+        scene_start = 0
+        scene_number = 0
+        
+        def scene(start_frame, end_frame):
+            # Il miglior candidato che cade nella scena diventa il suo thumbnail
+            inside = [candidate for candidate in thumbnail_candidates if candidate[0] < end_frame]
+            thumbnail_candidates[:] = [candidate for candidate in thumbnail_candidates if candidate[0] >= end_frame]
+            self._select_thumbnail(video_path, scene_number, start_frame, end_frame, inside, thumbnails_dir)
             
-            # Salva i thumbnail per ogni scena
-            save_images(
-                scene_list,
-                video_manager,
-                num_images=1,
-                output_dir=thumbnails_dir,
-                image_name_template='$SCENE_NUMBER',
-                format='jpg'
-            )
+            return self._scene_dict(scene_number, (base_timecode + start_frame).get_seconds(),
+                                    (base_timecode + end_frame).get_seconds(), thumbnails_dir)
+        
+        executor = ProcessPoolExecutor(max_workers=min(num_workers, len(ranges)))
+        try:
+            futures = {
+                executor.submit(_detect_cuts_in_range, video_path, read_start, read_end, threshold, min_scene_len,
+                                thumbnails_dir): i
+                for i, (_, _, read_start, read_end) in enumerate(ranges)
+            }
             
-            # Converti le scene in un formato più utile
-            scenes = []
-            for i, scene in enumerate(scene_list):
-                start_time = scene[0].get_seconds()
-                end_time = scene[1].get_seconds()
-                thumbnail_path = os.path.join(thumbnails_dir, f"{i+1:03d}.jpg")
+            # Gli intervalli terminano in ordine sparso: l'avanzamento conta i frame di competenza
+            for future in as_completed(futures):
+                i = futures[future]
+                start, end, _, _ = ranges[i]
+                chunk_cuts[i], candidates = future.result()
+                thumbnail_candidates.extend(candidates)
+                cuts_found += sum(1 for cut in chunk_cuts[i] if start <= cut < end and cut > 0)
                 
-                scenes.append({
-                    "id": i + 1,
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "duration": end_time - start_time,
-                    "thumbnail": thumbnail_path
-                })
+                # Come get_scene_list: senza tagli non viene restituita nessuna scena
+                tracker.advance(end - start, scenes_found=cuts_found + 1 if cuts_found else 0)
+        
+                if chunk_cuts[merged_chunks] is None:
+                    continue
+                while merged_chunks < len(ranges) and chunk_cuts[merged_chunks] is not None:
+                    merged_chunks += 1
+        
+                # Il ContentDetector non emette tagli più vicini di min_scene_len frame: i tagli
+                # degli intervalli ricuciti non dipendono da quelli degli intervalli successivi
+                cuts = merge_chunk_cuts(ranges[:merged_chunks], chunk_cuts[:merged_chunks],
+                                        min_gap_frames=min_scene_len)
+        
+                # Una scena è definitiva se termina prima della parte letta dal primo
+                # intervallo non ancora ricucito, che potrebbe avere altri candidati
+                ready_until = ranges[merged_chunks][2] if merged_chunks < len(ranges) else total_frames
+                for cut in cuts:
+                    if scene_start < cut <= ready_until:
+                        scene_number += 1
+                        yield scene(scene_start, cut)
+                        scene_start = cut
+        
+            # L'ultima scena termina con il video
+            if scene_number:
+                scene_number += 1
+                yield scene(scene_start, total_frames)
+        finally:
+            # Il chiamante può interrompere l'iterazione: gli intervalli non ancora avviati vengono annullati
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+            for _, _, path in thumbnail_candidates:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    
+    def _select_thumbnail(self, video_path, scene_number, start_frame, end_frame, candidates, thumbnails_dir):
+        """
+        Assegna alla scena il miglior thumbnail candidato che cade al suo
+        interno (vedi choose_thumbnail) ed elimina gli altri. Una scena senza
+        candidati, possibile solo a cavallo di due intervalli, riceve il
+        frame centrale letto con un accesso diretto.
+        """
+        sample = choose_thumbnail(candidates, start_frame, end_frame)
+        
+        if sample is None:
+            _extract_thumbnail(video_path, (start_frame + end_frame) // 2, _thumbnail_path(thumbnails_dir, scene_number))
+        else:
+            os.replace(sample[2], _thumbnail_path(thumbnails_dir, scene_number))
+        
+        for _, _, path in candidates:
+            if sample is None or path != sample[2]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    
+    @staticmethod
+    def _scene_dict(scene_number, start_time, end_time, thumbnails_dir):
+        return {
+            "id": scene_number,
+            "start_time": start_time,
+            "end_time": end_time,
+            "duration": end_time - start_time,
+            "thumbnail": _thumbnail_path(thumbnails_dir, scene_number)
+        }
+
+
+def plan_chunk_ranges(total_frames, num_chunks, overlap_frames, min_chunk_frames=0):
+    """
+    Divide un video in intervalli contigui da analizzare in parallelo.
+    
+    Args:
+        total_frames: Numero totale di frame del video
+        num_chunks: Numero di intervalli desiderato
+        overlap_frames: Frame di sovrapposizione letti prima di ogni intervallo
+        min_chunk_frames: Lunghezza minima di un intervallo, in frame
+        
+    Returns:
+        Lista di tuple (inizio, fine, inizio_lettura, fine_lettura) in frame:
+        [inizio, fine) è la parte di competenza dell'intervallo,
+        [inizio_lettura, fine_lettura) la parte effettivamente decodificata
+    """
+    if min_chunk_frames > 0:
+        num_chunks = min(num_chunks, max(1, total_frames // min_chunk_frames))
+    num_chunks = max(1, min(num_chunks, total_frames))
+    
+    ranges = []
+    for i in range(num_chunks):
+        start = total_frames * i // num_chunks
+        end = total_frames * (i + 1) // num_chunks
+        read_start = max(0, start - overlap_frames)
+        read_end = min(total_frames, end + overlap_frames)
+        ranges.append((start, end, read_start, read_end))
+    
+    return ranges
+
+
+def merge_chunk_cuts(ranges, chunk_cuts, min_gap_frames=0):
+    """
+    Ricuce i tagli rilevati negli intervalli in un'unica lista ordinata.
+    
+    Ogni intervallo contribuisce solo con i tagli nella sua parte di competenza;
+    i tagli più vicini di min_gap_frames al taglio precedente vengono scartati,
+    come farebbe il detector in un unico passaggio.
+    
+    Args:
+        ranges: Intervalli restituiti da plan_chunk_ranges
+        chunk_cuts: Liste dei frame di taglio rilevati per ogni intervallo
+        min_gap_frames: Distanza minima tra due tagli consecutivi, in frame
+        
+    Returns:
+        Lista ordinata dei frame di taglio
+    """
+    owned_cuts = []
+    for (start, end, _, _), cuts in zip(ranges, chunk_cuts):
+        owned_cuts.extend(cut for cut in cuts if start <= cut < end and cut > 0)
+    
+    merged = []
+    for cut in sorted(set(owned_cuts)):
+        if merged and cut - merged[-1] < min_gap_frames:
+            continue
+        merged.append(cut)
+    
+    return merged
+
+
+def _detect_cuts_in_range(video_path, start_frame, end_frame, threshold, min_scene_len, thumbnails_dir):
+    """
+    Rileva i tagli in un intervallo di frame del video (eseguita in un processo worker).
+    
+    Nella stessa decodifica sceglie il thumbnail di ogni scena dell'intervallo
+    e lo scrive come candidato in thumbnails_dir: la scelta definitiva tra i
+    candidati avviene dopo la ricucitura dei tagli.
+    
+    Returns:
+        Lista dei frame di taglio, in numerazione assoluta, e lista dei
+        candidati (frame, nitidezza, percorso)
+    """
+    from scenedetect import VideoManager, SceneManager
+    from scenedetect.detectors import ContentDetector
+    
+    candidates = []
+    
+    def write_candidate(scene_number, scene_start, scene_end, sample):
+        if sample is None:
+            return
+        
+        frame_num, sharpness, image = sample
+        path = os.path.join(thumbnails_dir, f".candidate_{start_frame}_{frame_num}.jpg")
+        _write_thumbnail(image, path)
+        candidates.append((frame_num, sharpness, path))
+    
+    collector = ThumbnailCollector(write_candidate)
+    
+    video_manager = VideoManager([video_path])
+    try:
+        scene_manager = SceneManager()
+        scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_scene_len))
+        
+        video_manager.set_downscale_factor()
+        base_timecode = video_manager.get_base_timecode()
+        video_manager.set_duration(start_time=base_timecode + start_frame, end_time=base_timecode + end_frame)
+        
+        video_manager.start()
+        scene_manager.detect_scenes(frame_source=_CapturingFrameSource(video_manager, collector),
+                                    callback=collector.on_cut)
+        
+        # Anche senza tagli l'intervallo può far parte di una scena più lunga
+        collector.finish()
+        
+        # L'inizio di ogni scena tranne la prima corrisponde a un taglio
+        scene_list = scene_manager.get_scene_list()
+        return [scene[0].get_frames() for scene in scene_list[1:]], candidates
+    finally:
+        video_manager.release()
+
+
+class ThumbnailCollector:
+    """
+    Sceglie il thumbnail di ogni scena tra i frame decodificati per il
+    rilevamento, così che il video venga letto una sola volta.
+    
+    Per la scena in corso viene tenuto un buffer di al più buffer_size frame,
+    campionati a passo costante: quando il buffer è pieno si scarta un frame
+    su due e il passo raddoppia, così i campioni restano distribuiti su tutta
+    la scena qualunque sia la sua durata. Alla chiusura della scena (taglio
+    rilevato) il frame scelto con choose_thumbnail viene passato a on_scene e
+    il buffer riparte dalla scena successiva.
+    """
+    
+    def __init__(self, on_scene, buffer_size=THUMBNAIL_BUFFER_SIZE, min_stride=THUMBNAIL_MIN_STRIDE,
+                 max_width=THUMBNAIL_MAX_WIDTH):
+        """
+        Inizializza il collettore.
+        
+        Args:
+            on_scene: Funzione chiamata alla chiusura di ogni scena come
+                on_scene(numero_scena, frame_iniziale, frame_finale, campione),
+                con campione = (frame, nitidezza, immagine BGR), o None se
+                della scena non è stato registrato nessun frame
+            buffer_size: Numero massimo di frame candidati in memoria
+            min_stride: Passo iniziale del campionamento, in frame
+            max_width: Larghezza massima, in pixel, dei frame candidati
+        """
+        self.on_scene = on_scene
+        self.buffer_size = max(2, buffer_size)
+        self.min_stride = max(1, min_stride)
+        self.max_width = max_width
+        self.scenes_closed = 0
+        
+        self._scene_start = None
+        self._last_frame = None
+        self._samples = []
+        self._stride = self.min_stride
+        
+        # I frame arrivano dal thread di decodifica, i tagli dal thread di rilevamento
+        self._lock = threading.Lock()
+    
+    def add_frame(self, frame_num, frame):
+        """
+        Registra un frame decodificato.
+        """
+        with self._lock:
+            if self._scene_start is None:
+                self._scene_start = frame_num
+            self._last_frame = frame_num
             
-            logger.info(f"Segmentazione completata. Rilevate {len(scenes)} scene.")
-            return scenes
+            if (frame_num - self._scene_start) % self._stride:
+                return
+        
+        # Ridimensionamento e nitidezza fuori dal lock: i tagli non attendono la decodifica
+        image = _resize_frame(frame, self.max_width)
+        sample = (frame_num, _sharpness(image), image)
+        
+        with self._lock:
+            if frame_num < self._scene_start:
+                return
+            self._samples.append(sample)
+            if len(self._samples) >= self.buffer_size:
+                self._stride *= 2
+                self._samples = [
+                    sample for sample in self._samples
+                    if (sample[0] - self._scene_start) % self._stride == 0
+                ]
+    
+    def on_cut(self, frame_image, frame_num):
+        """
+        Callback di SceneManager.detect_scenes: chiude la scena che termina
+        al frame di taglio.
+        """
+        self.close_scene(frame_num)
+    
+    def close_scene(self, end_frame):
+        """
+        Chiude la scena in corso, che termina (escluso) a end_frame.
+        """
+        with self._lock:
+            # Il thread di decodifica può essere già avanti: i frame successivi
+            # al taglio appartengono alla scena seguente
+            closed = [sample for sample in self._samples if sample[0] < end_frame]
+            self._samples = [sample for sample in self._samples if sample[0] >= end_frame]
             
-        except Exception as e:
-            logger.error(f"Errore durante la segmentazione del video: {str(e)}")
-            raise
-        finally:
-            video_manager.release()
+            start_frame = self._scene_start if self._scene_start is not None else end_frame
+            self._scene_start = end_frame
+            self._stride = self.min_stride
+            self.scenes_closed += 1
+            scene_number = self.scenes_closed
+        
+        self.on_scene(scene_number, start_frame, end_frame, choose_thumbnail(closed, start_frame, end_frame))
+    
+    def finish(self):
+        """
+        Chiude l'ultima scena, al termine della decodifica.
+        """
+        if self._last_frame is not None:
+            self.close_scene(self._last_frame + 1)
+
+
+class _CapturingFrameSource:
+    """
+    Sorgente dei frame per SceneManager che passa ogni frame decodificato a
+    un ThumbnailCollector; il resto viene delegato al VideoManager.
+    """
+    
+    def __init__(self, video_manager, collector):
+        self._video_manager = video_manager
+        self._collector = collector
+    
+    def __getattr__(self, name):
+        return getattr(self._video_manager, name)
+    
+    def read(self, decode=True, advance=True):
+        frame = self._video_manager.read(decode, advance)
+        if decode and frame is not False and frame is not None:
+            self._collector.add_frame(self._video_manager.position.frame_num, frame)
+        return frame
+
+
+def choose_thumbnail(samples, start_frame, end_frame):
+    """
+    Sceglie il thumbnail di una scena tra i frame campionati: il più nitido
+    tra quelli della metà centrale della scena (lontano dalle dissolvenze ai
+    bordi), o il più vicino al centro se nessuno cade nella metà centrale.
+    
+    Args:
+        samples: Lista di tuple (frame, nitidezza, dati)
+        start_frame: Primo frame della scena
+        end_frame: Frame successivo all'ultimo della scena
+        
+    Returns:
+        Il campione scelto, o None se la lista è vuota
+    """
+    if not samples:
+        return None
+    
+    quarter = (end_frame - start_frame) / 4
+    central = [sample for sample in samples if start_frame + quarter <= sample[0] <= end_frame - quarter]
+    if central:
+        return max(central, key=lambda sample: sample[1])
+    
+    middle = (start_frame + end_frame) / 2
+    return min(samples, key=lambda sample: abs(sample[0] - middle))
+
+
+def _thumbnail_path(thumbnails_dir, scene_number):
+    return os.path.join(thumbnails_dir, f"{scene_number:03d}.jpg")
+
+
+def _resize_frame(frame, max_width):
+    import cv2
+    
+    height, width = frame.shape[:2]
+    if width <= max_width:
+        return frame
+    return cv2.resize(frame, (max_width, round(height * max_width / width)), interpolation=cv2.INTER_AREA)
+
+
+def _sharpness(image):
+    # Varianza del laplaciano: più alta per i frame a fuoco e senza mosso
+    import cv2
+    
+    return float(cv2.Laplacian(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var())
+
+
+def _write_thumbnail(image, path):
+    import cv2
+    
+    if not cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+        raise IOError(f"Impossibile scrivere il thumbnail {path}")
+
+
+def _extract_thumbnail(video_path, frame_num, path, max_width=THUMBNAIL_MAX_WIDTH):
+    """
+    Legge un singolo frame con un accesso diretto e lo salva come thumbnail.
+    """
+    import cv2
+    
+    capture = cv2.VideoCapture(video_path)
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        retrieved, frame = capture.read()
+    finally:
+        capture.release()
+    
+    if not retrieved:
+        logger.warning(f"Impossibile leggere il frame {frame_num} per il thumbnail {path}")
+        return
+    
+    _write_thumbnail(_resize_frame(frame, max_width), path)
@@ -18,15 +18,61 @@ export class ApiClient {
   }
 
   // Carica un video e un riassunto
-  async uploadVideo(videoFile: File, summary: string): Promise<any> {
+  // Il file viene inviato a chunk: in caso di errore il caricamento riprende
+  // dal primo byte non ricevuto dal backend, invece di ripartire da zero
+  async uploadVideo(videoFile: File, summary: string, maxRetries: number = 5): Promise<any> {
     try {
-      const formData = new FormData();
-      formData.append('video', videoFile);
-      formData.append('summary', summary);
+      const initResponse = await fetch(`${this.baseUrl}/upload/init`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ filename: videoFile.name, size: videoFile.size, summary }),
+      });
+
+      const session = await initResponse.json();
+      if (!initResponse.ok) {
+        return session;
+      }
+
+      const uploadUrl = `${this.baseUrl}/upload/${session.upload_id}`;
+      let offset = 0;
+      let retries = 0;
+
+      while (offset < videoFile.size) {
+        const chunk = videoFile.slice(offset, offset + session.chunk_size);
 
-      const response = await fetch(`${this.baseUrl}/upload`, {
+        try {
+          const response = await fetch(`${uploadUrl}?offset=${offset}`, {
+            method: 'PUT',
+            headers: {
+              'Content-Type': 'application/octet-stream',
+            },
+            body: chunk,
+          });
+
+          if (!response.ok) {
+            throw new Error(`Chunk rifiutato (${response.status})`);
+          }
+
+          offset = (await response.json()).next_offset;
+          retries = 0;
+        } catch (error) {
+          if (++retries > maxRetries) {
+            throw error;
+          }
+
+          // Riprende dall'offset confermato dal backend
+          await new Promise((resolve) => setTimeout(resolve, 1000 * retries));
+          const status = await fetch(uploadUrl)
+            .then((response) => response.json())
+            .catch(() => ({ next_offset: offset }));
+          offset = status.next_offset;
+        }
+      }
+
+      const response = await fetch(`${uploadUrl}/complete`, {
         method: 'POST',
-        body: formData,
       });
 
       return await response.json();
@@ -37,19 +83,88 @@ export class ApiClient {
   }
 
   // Elabora un video caricato
-  async processVideo(jobId: string): Promise<any> {
+  // Il backend accoda il job (202) e l'elaborazione prosegue in background:
+  // attende il completamento seguendo gli eventi del job (SSE) o, se il
+  // browser non supporta EventSource, interrogando lo stato del job
+  // matchMode sceglie l'abbinamento tra scene e frasi: 'argmax', 'unique',
+  // 'ordered' o 'ordered_unique' (default: quello configurato nel backend)
+  // onEvent riceve ogni evento del job (cambi di stato e avanzamento degli stage)
+  async processVideo(
+    jobId: string,
+    pollIntervalMs: number = 2000,
+    matchMode?: string,
+    onEvent?: (event: any) => void
+  ): Promise<any> {
     try {
       const response = await fetch(`${this.baseUrl}/process/${jobId}`, {
         method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(matchMode ? { match_mode: matchMode } : {}),
       });
 
-      return await response.json();
+      if (response.status !== 202) {
+        return await response.json();
+      }
+
+      if (typeof EventSource !== 'undefined') {
+        await this.watchJobEvents(jobId, onEvent);
+        return await this.getJobStatus(jobId);
+      }
+
+      while (true) {
+        const status = await this.getJobStatus(jobId);
+        if (status.state === 'done' || status.state === 'failed' || status.error) {
+          return status;
+        }
+        await new Promise((resolve) => setTimeout(resolve, pollIntervalMs));
+      }
     } catch (error) {
       console.error('Errore durante l\'elaborazione del video:', error);
       throw error;
     }
   }
 
+  // Segue gli eventi di un job con Server-Sent Events fino alla sua conclusione.
+  // In caso di disconnessione EventSource si riconnette da solo, riprendendo
+  // dall'ultimo evento ricevuto (header Last-Event-ID)
+  watchJobEvents(jobId: string, onEvent?: (event: any) => void): Promise<void> {
+    return new Promise((resolve) => {
+      const source = new EventSource(`${this.baseUrl}/jobs/${jobId}/events`);
+
+      source.onmessage = (message) => {
+        if (onEvent) {
+          onEvent(JSON.parse(message.data));
+        }
+      };
+
+      source.addEventListener('end', () => {
+        source.close();
+        resolve();
+      });
+
+      // Una risposta di errore (es. 404) chiude la connessione senza riconnessione:
+      // lo stato finale viene letto dal chiamante
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          resolve();
+        }
+      };
+    });
+  }
+
+  // Ottiene lo stato di un job di elaborazione e dei suoi stage
+  async getJobStatus(jobId: string): Promise<any> {
+    try {
+      const response = await fetch(`${this.baseUrl}/jobs/${jobId}`);
+      return await response.json();
+    } catch (error) {
+      console.error('Errore durante il recupero dello stato del job:', error);
+      throw error;
+    }
+  }
+
   // Aggiorna le corrispondenze tra scene e frasi
   async updateMatches(jobId: string, matches: any[]): Promise<any> {
     try {